@@ -1,19 +1,66 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
-import pandas as pd
-import numpy as np
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 import datetime
 import os
 import io
-from shift_optimizer import ShiftOptimizer
+import json
+import math
+import time
+from collections import OrderedDict
+from shift_optimizer import ShiftOptimizer, make_employee, make_shift
 from shift_request import ShiftRequestManager
+from solve_jobs import SolveJobManager, JobQueueFullError
+from solution_cache import SolutionCache
+from csv_import import read_employees, read_shifts
+from registry import DuplicateIdError
+from solver_config import SolverConfig
+from storage import create_storage
+from metrics import REGISTRY, PhaseTimer, peak_rss_bytes
 
 app = Flask(__name__)
 app.secret_key = 'shift_optimization_app'
 
-# アプリケーションのグローバル変数
-global_optimizer = None
-global_result = None
-global_request_manager = None
+# 従業員・シフト・シフト希望・期間・最適化結果の保存先（環境変数 SHIFT_STORAGE_URL）
+# 状態はすべて保存先に置き、複数のワーカープロセスから同じデータを使う
+storage = create_storage()
+
+def _store_job_result(job_id, result):
+    """完了したジョブの結果を保存する（同じジョブの結果は1回だけ保存される）
+
+    取り消し後や新しいジョブの投入後に終わった古いジョブの結果は、現在のスケジュールを上書きしない。
+    """
+    storage.save_job_result(job_id, result)
+
+# 最適化ジョブはリクエストスレッドではなくプロセスプールで実行する
+# 結果と状態・最良解は保存先に書き込むため、ほかのワーカーからも表示・取り消し・採用できる
+job_manager = SolveJobManager(on_finished=_store_job_result, job_store=storage)
+
+# 同じ入力での再実行は保存済みの結果を返す
+solution_cache = SolutionCache()
+
+# 表示済みのスケジュール表: (保存先の結果の版, 絞り込み・ページ) → (HTML, ページ情報)
+schedule_view_cache = OrderedDict()
+SCHEDULE_VIEW_CACHE_SIZE = int(os.environ.get('SHIFT_SCHEDULE_VIEW_CACHE_SIZE', 64))
+# スケジュール表の1ページあたりの従業員数
+SCHEDULE_PAGE_SIZE = int(os.environ.get('SHIFT_SCHEDULE_PAGE_SIZE', 50))
+# ジョブの進捗の Server-Sent Events を1回の接続で送る秒数
+# 同期ワーカーを長時間占有しないように接続を閉じ、ブラウザ (EventSource) に再接続させる
+JOB_EVENTS_STREAM_SECONDS = float(os.environ.get('SHIFT_JOB_EVENTS_STREAM_SECONDS', 30))
+
+def _load_optimizer(include=('employees', 'shifts', 'period')):
+    """保存先の問題データから最適化エンジンを作る（include で読み込む部分を選ぶ）"""
+    return ShiftOptimizer.from_problem(storage.load_problem(include=include))
+
+def _minutes_to_time(minutes):
+    """分単位の時間をHH:MM形式に変換"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _flash_import_report(report, noun):
+    """CSVインポートの件数と、取り込めなかった行のエラーを表示する"""
+    flash(f'{report.imported} {noun}をインポートしました。')
+    if report.errors:
+        flash(f'{report.failed_rows} 行はエラーのため取り込みませんでした。')
+        for message in report.messages():
+            flash(f'CSVインポートエラー: {message}')
 
 @app.route('/')
 def index():
@@ -21,11 +68,6 @@ def index():
 
 @app.route('/employees', methods=['GET', 'POST'])
 def employees():
-    global global_optimizer
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
     if request.method == 'POST':
         employee_id = int(request.form['employee_id'])
         name = request.form['name']
@@ -54,44 +96,42 @@ def employees():
                 except ValueError:
                     flash(f'シフトIDエラー: {shift_id}. 数値を入力してください。')
         
-        global_optimizer.add_employee(
-            employee_id=employee_id,
-            name=name,
-            skills=skills,
-            max_hours_day=max_hours_day,
-            max_hours_week=max_hours_week,
-            max_consecutive_days=max_consecutive_days,
-            unavailable_days=unavailable_days,
-            preferred_shifts=preferred_shifts
-        )
+        try:
+            storage.add_employees([make_employee(
+                employee_id=employee_id,
+                name=name,
+                skills=skills,
+                max_hours_day=max_hours_day,
+                max_hours_week=max_hours_week,
+                max_consecutive_days=max_consecutive_days,
+                unavailable_days=unavailable_days,
+                preferred_shifts=preferred_shifts
+            )])
+        except DuplicateIdError as e:
+            flash(f'従業員を追加できません: {str(e)}')
+            return redirect(url_for('employees'))
         
         flash(f'従業員 {name} を追加しました。')
         return redirect(url_for('employees'))
     
     # 従業員一覧を表示
     employees_data = []
-    if global_optimizer and global_optimizer.employees:
-        for emp in global_optimizer.employees:
-            employees_data.append({
-                'id': emp['id'],
-                'name': emp['name'],
-                'skills': ', '.join(emp['skills']),
-                'max_hours_day': emp['max_hours_day'],
-                'max_hours_week': emp['max_hours_week'],
-                'max_consecutive_days': emp['max_consecutive_days'],
-                'unavailable_days': ', '.join(str(d) for d in emp['unavailable_days']),
-                'preferred_shifts': ', '.join(str(s) for s in emp['preferred_shifts'])
-            })
+    for emp in storage.list_employees():
+        employees_data.append({
+            'id': emp['id'],
+            'name': emp['name'],
+            'skills': ', '.join(emp['skills']),
+            'max_hours_day': emp['max_hours_day'],
+            'max_hours_week': emp['max_hours_week'],
+            'max_consecutive_days': emp['max_consecutive_days'],
+            'unavailable_days': ', '.join(str(d) for d in sorted(emp['unavailable_days'])),
+            'preferred_shifts': ', '.join(str(s) for s in sorted(emp['preferred_shifts']))
+        })
     
     return render_template('employees.html', employees=employees_data)
 
 @app.route('/import_employees', methods=['POST'])
 def import_employees():
-    global global_optimizer
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
     if 'file' not in request.files:
         flash('ファイルがありません。')
         return redirect(url_for('employees'))
@@ -103,44 +143,11 @@ def import_employees():
     
     if file and file.filename.endswith('.csv'):
         try:
-            df = pd.read_csv(file, encoding='utf-8-sig')
-            
-            for _, row in df.iterrows():
-                # 勤務不可日をリストに変換
-                unavailable_days = []
-                if pd.notna(row.get('unavailable_days', '')):
-                    for date_str in str(row['unavailable_days']).split(','):
-                        try:
-                            unavailable_days.append(datetime.datetime.strptime(date_str.strip(), '%Y-%m-%d').date())
-                        except ValueError:
-                            pass
-                
-                # スキルをリストに変換
-                skills = []
-                if pd.notna(row.get('skills', '')):
-                    skills = [s.strip() for s in str(row['skills']).split(',')]
-                
-                # 希望シフトをリストに変換
-                preferred_shifts = []
-                if pd.notna(row.get('preferred_shifts', '')):
-                    for shift_id in str(row['preferred_shifts']).split(','):
-                        try:
-                            preferred_shifts.append(int(shift_id.strip()))
-                        except ValueError:
-                            pass
-                
-                global_optimizer.add_employee(
-                    employee_id=int(row['employee_id']),
-                    name=row['name'],
-                    skills=skills,
-                    max_hours_day=int(row.get('max_hours_day', 8)),
-                    max_hours_week=int(row.get('max_hours_week', 40)),
-                    max_consecutive_days=int(row.get('max_consecutive_days', 5)),
-                    unavailable_days=unavailable_days,
-                    preferred_shifts=preferred_shifts
-                )
-            
-            flash(f'{len(df)} 人の従業員をインポートしました。')
+            employees, report = read_employees(file, existing_ids=storage.employee_names().keys())
+            records = [make_employee(**employee) for employee in employees]
+            storage.add_employees(records)
+            report.imported = len(records)
+            _flash_import_report(report, '人の従業員')
         except Exception as e:
             flash(f'CSVインポートエラー: {str(e)}')
     else:
@@ -150,11 +157,6 @@ def import_employees():
 
 @app.route('/shifts', methods=['GET', 'POST'])
 def shifts():
-    global global_optimizer
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
     if request.method == 'POST':
         shift_id = int(request.form['shift_id'])
         name = request.form['name']
@@ -170,46 +172,44 @@ def shifts():
         required_employees = int(request.form['required_employees'])
         is_fixed = 'is_fixed' in request.form
         
-        global_optimizer.add_shift(
-            shift_id=shift_id,
-            name=name,
-            start_time=start_time,
-            end_time=end_time,
-            required_skills=required_skills,
-            required_employees=required_employees,
-            is_fixed=is_fixed
-        )
+        try:
+            storage.add_shifts([make_shift(
+                shift_id=shift_id,
+                name=name,
+                start_time=start_time,
+                end_time=end_time,
+                required_skills=required_skills,
+                required_employees=required_employees,
+                is_fixed=is_fixed
+            )])
+        except DuplicateIdError as e:
+            flash(f'シフトを追加できません: {str(e)}')
+            return redirect(url_for('shifts'))
         
         flash(f'シフト {name} を追加しました。')
         return redirect(url_for('shifts'))
     
     # シフト一覧を表示
     shifts_data = []
-    if global_optimizer and global_optimizer.shifts:
-        for shift in global_optimizer.shifts:
-            start_time = global_optimizer._minutes_to_time(shift['start_minutes'])
-            end_time = global_optimizer._minutes_to_time(shift['end_minutes'] % (24 * 60))
-            
-            shifts_data.append({
-                'id': shift['id'],
-                'name': shift['name'],
-                'start_time': start_time,
-                'end_time': end_time,
-                'duration': f"{shift['duration'] // 60}時間{shift['duration'] % 60}分",
-                'required_skills': ', '.join(shift['required_skills']),
-                'required_employees': shift['required_employees'],
-                'is_fixed': 'はい' if shift['is_fixed'] else 'いいえ'
-            })
+    for shift in storage.list_shifts():
+        start_time = _minutes_to_time(shift['start_minutes'])
+        end_time = _minutes_to_time(shift['end_minutes'] % (24 * 60))
+        
+        shifts_data.append({
+            'id': shift['id'],
+            'name': shift['name'],
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': f"{shift['duration'] // 60}時間{shift['duration'] % 60}分",
+            'required_skills': ', '.join(shift['required_skills']),
+            'required_employees': shift['required_employees'],
+            'is_fixed': 'はい' if shift['is_fixed'] else 'いいえ'
+        })
     
     return render_template('shifts.html', shifts=shifts_data)
 
 @app.route('/import_shifts', methods=['POST'])
 def import_shifts():
-    global global_optimizer
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
     if 'file' not in request.files:
         flash('ファイルがありません。')
         return redirect(url_for('shifts'))
@@ -221,25 +221,11 @@ def import_shifts():
     
     if file and file.filename.endswith('.csv'):
         try:
-            df = pd.read_csv(file, encoding='utf-8-sig')
-            
-            for _, row in df.iterrows():
-                # スキル要件をリストに変換
-                required_skills = []
-                if pd.notna(row.get('required_skills', '')):
-                    required_skills = [s.strip() for s in str(row['required_skills']).split(',')]
-                
-                global_optimizer.add_shift(
-                    shift_id=int(row['shift_id']),
-                    name=row['name'],
-                    start_time=row['start_time'],
-                    end_time=row['end_time'],
-                    required_skills=required_skills,
-                    required_employees=int(row.get('required_employees', 1)),
-                    is_fixed=str(row.get('is_fixed', '')).lower() in ['true', 'yes', 'はい', '1']
-                )
-            
-            flash(f'{len(df)} 件のシフトをインポートしました。')
+            shifts, report = read_shifts(file, existing_ids=[shift['id'] for shift in storage.list_shifts()])
+            records = [make_shift(**shift) for shift in shifts]
+            storage.add_shifts(records)
+            report.imported = len(records)
+            _flash_import_report(report, '件のシフト')
         except Exception as e:
             flash(f'CSVインポートエラー: {str(e)}')
     else:
@@ -249,19 +235,13 @@ def import_shifts():
 
 @app.route('/shift_requests', methods=['GET', 'POST'])
 def shift_requests():
-    global global_optimizer
-    global global_request_manager
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
-    if global_request_manager is None:
-        global_request_manager = ShiftRequestManager(global_optimizer)
-    
     if request.method == 'POST':
         employee_id = int(request.form['employee_id'])
         date_str = request.form['date']
         
+        # 入力の変換にだけ使う（登録した希望は保存先に置く）
+        request_manager = ShiftRequestManager()
+        
         try:
             date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
             
@@ -270,22 +250,22 @@ def shift_requests():
             
             if shift_type == 'day_off':
                 # 休みの申請
-                global_request_manager.add_request(
+                request_manager.add_request(
                     employee_id=employee_id,
                     date=date,
                     is_day_off=True
                 )
-                flash(f'従業員 ID: {employee_id} の {date_str} の休み希望を登録しました。')
+                message = f'従業員 ID: {employee_id} の {date_str} の休み希望を登録しました。'
                 
             elif shift_type == 'shift_pattern':
                 # シフトパターンの申請
                 shift_name = request.form['shift_name']
-                global_request_manager.add_request(
+                request_manager.add_request(
                     employee_id=employee_id,
                     date=date,
                     shift_name=shift_name
                 )
-                flash(f'従業員 ID: {employee_id} の {date_str} のシフト希望 "{shift_name}" を登録しました。')
+                message = f'従業員 ID: {employee_id} の {date_str} のシフト希望 "{shift_name}" を登録しました。'
                 
             elif shift_type == 'time_specified':
                 # 時刻指定の申請
@@ -294,7 +274,7 @@ def shift_requests():
                 break_time = request.form.get('break_time', '')
                 note = request.form.get('note', '')
                 
-                global_request_manager.add_request(
+                request_manager.add_request(
                     employee_id=employee_id,
                     date=date,
                     start_time=start_time,
@@ -302,63 +282,59 @@ def shift_requests():
                     break_time=break_time,
                     note=note
                 )
-                flash(f'従業員 ID: {employee_id} の {date_str} の時刻指定シフト希望 ({start_time}-{end_time}) を登録しました。')
+                message = f'従業員 ID: {employee_id} の {date_str} の時刻指定シフト希望 ({start_time}-{end_time}) を登録しました。'
+            
+            if request_manager.shift_requests:
+                storage.add_requests(request_manager.shift_requests)
+                flash(message)
             
             return redirect(url_for('shift_requests'))
             
         except ValueError as e:
             flash(f'入力エラー: {str(e)}')
     
+    employee_names = storage.employee_names()
+    
     # シフト希望一覧を表示
     requests_data = []
-    if global_request_manager and global_request_manager.shift_requests:
-        for req in global_request_manager.shift_requests:
-            row = {
-                'employee_id': req['employee_id'],
-                'date': req['date'].strftime('%Y-%m-%d'),
-                'is_day_off': '休み' if req['is_day_off'] else '',
-                'shift_name': req['shift_name'] if req['shift_name'] else '',
-                'time': ''
-            }
-            
-            if req['start_minutes'] is not None and req['end_minutes'] is not None:
-                start_time = global_optimizer._minutes_to_time(req['start_minutes'])
-                end_time = global_optimizer._minutes_to_time(req['end_minutes'] % (24 * 60))
-                row['time'] = f"{start_time} - {end_time}"
-                
-                if req['break_minutes']:
-                    break_hours = req['break_minutes'] // 60
-                    break_mins = req['break_minutes'] % 60
-                    row['time'] += f" (休憩: {break_hours}時間{break_mins}分)"
-            
-            row['note'] = req['note'] if req['note'] else ''
-            
-            # 従業員名を取得
-            for emp in global_optimizer.employees:
-                if emp['id'] == req['employee_id']:
-                    row['employee_name'] = emp['name']
-                    break
+    for req in storage.list_requests():
+        row = {
+            'employee_id': req['employee_id'],
+            'date': req['date'].strftime('%Y-%m-%d'),
+            'is_day_off': '休み' if req['is_day_off'] else '',
+            'shift_name': req['shift_name'] if req['shift_name'] else '',
+            'time': ''
+        }
+        
+        if req['start_minutes'] is not None and req['end_minutes'] is not None:
+            start_time = _minutes_to_time(req['start_minutes'])
+            end_time = _minutes_to_time(req['end_minutes'] % (24 * 60))
+            row['time'] = f"{start_time} - {end_time}"
             
-            requests_data.append(row)
+            if req['break_minutes']:
+                break_hours = int(req['break_minutes'] // 60)
+                break_mins = int(req['break_minutes'] % 60)
+                row['time'] += f" (休憩: {break_hours}時間{break_mins}分)"
+        
+        row['note'] = req['note'] if req['note'] else ''
+        
+        # 従業員名を取得
+        if req['employee_id'] in employee_names:
+            row['employee_name'] = employee_names[req['employee_id']]
+        
+        requests_data.append(row)
     
     # シフトパターン一覧を取得
     shift_patterns = []
-    if global_optimizer and global_optimizer.shifts:
-        for shift in global_optimizer.shifts:
-            if not shift['name'].startswith('Request_'):  # 申請用の自動生成シフトは除外
-                shift_patterns.append({
-                    'id': shift['id'],
-                    'name': shift['name']
-                })
+    for shift in storage.list_shifts():
+        if not shift['request_only']:  # 申請用の自動生成シフトは除外
+            shift_patterns.append({
+                'id': shift['id'],
+                'name': shift['name']
+            })
     
     # 従業員一覧を取得
-    employees_data = []
-    if global_optimizer and global_optimizer.employees:
-        for emp in global_optimizer.employees:
-            employees_data.append({
-                'id': emp['id'],
-                'name': emp['name']
-            })
+    employees_data = [{'id': emp_id, 'name': name} for emp_id, name in employee_names.items()]
     
     return render_template('shift_requests.html', 
                           requests=requests_data, 
@@ -367,15 +343,6 @@ def shift_requests():
 
 @app.route('/import_shift_requests', methods=['POST'])
 def import_shift_requests():
-    global global_optimizer
-    global global_request_manager
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
-    
-    if global_request_manager is None:
-        global_request_manager = ShiftRequestManager(global_optimizer)
-    
     if 'file' not in request.files:
         flash('ファイルがありません。')
         return redirect(url_for('shift_requests'))
@@ -391,9 +358,10 @@ def import_shift_requests():
             file_content = io.StringIO(file.stream.read().decode('utf-8-sig'))
             
             # シフト希望をインポート
-            count = global_request_manager.import_requests_from_csv(file_content=file_content)
-            
-            flash(f'{count} 件のシフト希望をインポートしました。')
+            request_manager = ShiftRequestManager()
+            report = request_manager.import_requests_from_csv(file_content=file_content)
+            storage.add_requests(request_manager.shift_requests)
+            _flash_import_report(report, '件のシフト希望')
         except Exception as e:
             flash(f'CSVインポートエラー: {str(e)}')
     else:
@@ -403,38 +371,201 @@ def import_shift_requests():
 
 @app.route('/clear_shift_requests')
 def clear_shift_requests():
-    global global_request_manager
-    
-    if global_request_manager:
-        global_request_manager.clear_requests()
-        flash('すべてのシフト希望をクリアしました。')
+    storage.clear_requests()
+    flash('すべてのシフト希望をクリアしました。')
     
     return redirect(url_for('shift_requests'))
 
 @app.route('/apply_shift_requests')
 def apply_shift_requests():
-    global global_optimizer
-    global global_request_manager
-    
-    if global_optimizer is None or global_request_manager is None:
+    if storage.count_employees() == 0 or storage.count_shifts() == 0:
         flash('従業員とシフトを先に登録してください。')
         return redirect(url_for('index'))
     
     try:
-        count = global_request_manager.apply_requests_to_optimizer()
+        # 読み込みから保存までを1つのトランザクションで行い、希望で変わった行だけを書き戻す
+        with storage.edit_problem() as problem:
+            optimizer = ShiftOptimizer.from_problem(problem)
+            count = ShiftRequestManager(optimizer).apply_requests(storage.list_requests())
+            problem.update(optimizer.export_problem())
         flash(f'{count} 件のシフト希望を適用しました。スケジュール作成時に考慮されます。')
     except Exception as e:
         flash(f'シフト希望の適用エラー: {str(e)}')
     
     return redirect(url_for('schedule'))
 
+def _flash_result_messages(result):
+    """最適化結果に応じたメッセージを表示する"""
+    if result['status'] == 'success':
+        # 制約違反の情報を表示
+        violations = result.get('violations', {})
+        
+        if sum(violations.values()) > 0:
+            violation_msgs = []
+            if violations.get('required_employees_violations', 0) > 0:
+                violation_msgs.append(f"必要人数の不足: {int(violations['required_employees_violations'])}箇所")
+            if violations.get('unavailable_violations', 0) > 0:
+                violation_msgs.append(f"勤務不可日の出勤: {int(violations['unavailable_violations'])}箇所")
+            if violations.get('avoidance_violations', 0) > 0:
+                violation_msgs.append(f"バッティング回避の違反: {int(violations['avoidance_violations'])}箇所")
+            
+            if violation_msgs:
+                flash(f'スケジュールが作成されましたが、一部制約条件を緩和しました: {", ".join(violation_msgs)}')
+            else:
+                flash('スケジュール作成が完了しました！')
+        else:
+            flash('全ての制約条件を満たしたスケジュールが作成されました！')
+        if result.get('changed_assignments') is not None:
+            flash(f'前回のスケジュールから {result["changed_assignments"]} 箇所の割り当てを変更しました。')
+    else:
+        debug_info = result.get('debug_info', {})
+        status_name = debug_info.get('status_name', 'Unknown')
+        flash(f'スケジュール作成に失敗しました: {status_name}')
+        
+        # 詳細情報も表示
+        flash(f'詳細情報: 従業員数={debug_info.get("num_employees", "?")}、'
+              f'シフト数={debug_info.get("num_shifts", "?")}、'
+              f'期間={debug_info.get("num_days", "?")}日')
+        
+        # 対策案も表示
+        flash('対策: 期間を短くする、従業員を増やす、シフトの必要人数を減らす、制約条件を緩めるなどを試してください。')
+
+def _result_to_json(result):
+    """最適化結果をJSONに変換できる形式にする"""
+    if result['status'] != 'success':
+        return result
+    
+    schedule = {}
+    for emp_id, employee_schedule in result['schedule'].items():
+        schedule[str(emp_id)] = [
+            {
+                'date': day_data['date'].isoformat(),
+                'weekday': day_data['weekday'],
+                'shift_id': day_data['shift']['id'] if day_data['shift'] else None,
+                'shift_name': day_data['shift']['name'] if day_data['shift'] else None
+            }
+            for day_data in employee_schedule
+        ]
+    
+    return {
+        'status': result['status'],
+        'schedule': schedule,
+        'objective_value': result['objective_value'],
+        'changed_assignments': result.get('changed_assignments'),
+        'violations': result['violations'],
+        'metrics': result.get('metrics')
+    }
+
+def _job_status(job_id):
+    """ジョブの状態（このワーカーのジョブでなければ保存先に書き込まれた状態、ない場合は None）"""
+    return job_manager.status(job_id) or storage.load_job(job_id)
+
+def _job_result(job_id):
+    """完了したジョブの結果（このワーカーのジョブでなければ保存先から読む）"""
+    return job_manager.result(job_id) or storage.load_job_result(job_id)
+
+def _request_job_control(job_id, action):
+    """ジョブの取り消し ('cancel')・採用 ('accept') を実行する
+
+    ほかのワーカーのジョブは保存先に依頼を書き込み、そのワーカーが次の同期で実行する。
+    """
+    if job_manager.status(job_id) is not None:
+        return job_manager.cancel(job_id) if action == 'cancel' else job_manager.accept(job_id)
+    job = storage.load_job(job_id)
+    if job is None:
+        return False
+    # 採用できる条件は SolveJobManager.accept と同じ
+    if action == 'accept' and (job['method'] == 'rolling' or job['progress'] is None):
+        return False
+    return storage.request_job_control(job_id, action)
+
+def _cancel_current_job():
+    """実行中のジョブがあれば取り消す"""
+    job_id = storage.get_settings().get('current_job_id')
+    if job_id is not None:
+        _request_job_control(job_id, 'cancel')
+        storage.update_settings(current_job_id=None)
+
+def _collect_job_result():
+    """完了した最適化ジョブの結果を取り込む"""
+    job_id = storage.get_settings().get('current_job_id')
+    if job_id is None:
+        return None
+    
+    job = _job_status(job_id)
+    if job is None:
+        # 状態がまだ書き込まれていないジョブ
+        return None
+    
+    if job['status'] == 'done':
+        result = _job_result(job_id)
+        if result is None:
+            # 結果の保存が終わるまでは実行中として扱う
+            return None
+        storage.save_job_result(job_id, result)
+        storage.update_settings(current_job_id=None)
+        if job['accepted'] and result['status'] == 'success':
+            flash(f'探索を打ち切り、{job["progress"]["elapsed"]:.1f} 秒時点の最良解を採用しました。')
+        _flash_result_messages(result)
+        return None
+    elif job['status'] == 'failed':
+        storage.update_settings(current_job_id=None)
+        flash(f'スケジュール作成に失敗しました: {job["error"]}')
+        return None
+    elif job['status'] == 'cancelled':
+        storage.update_settings(current_job_id=None)
+        flash('スケジュール作成ジョブを取り消しました。')
+        return None
+    
+    return job
+
+def _schedule_view_args(args):
+    """スケジュール表の表示条件（従業員・日付の範囲・ページ）をクエリ文字列から読む
+
+    不正な値は無視して既定値を使う。
+    """
+    view_args = {'employee': args.get('employee', '').strip(), 'start': '', 'end': '',
+                 'page': 1, 'per_page': SCHEDULE_PAGE_SIZE}
+    for key in ('start', 'end'):
+        try:
+            view_args[key] = datetime.datetime.strptime(args.get(key, ''), '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            pass
+    for key in ('page', 'per_page'):
+        try:
+            view_args[key] = max(1, int(args.get(key, view_args[key])))
+        except ValueError:
+            pass
+    view_args['per_page'] = min(view_args['per_page'], 500)
+    return view_args
+
+def _render_schedule_view(result, view_args):
+    """スケジュール表の1ページ分を HTML にする"""
+    timer = PhaseTimer()
+    with timer.phase('shift_table'):
+        # 表には従業員名だけを使う
+        matrix = _load_optimizer(include=('employees',)).get_schedule_matrix(
+            result,
+            employee_query=view_args['employee'] or None,
+            start_date=datetime.date.fromisoformat(view_args['start']) if view_args['start'] else None,
+            end_date=datetime.date.fromisoformat(view_args['end']) if view_args['end'] else None
+        )
+    
+    per_page = view_args['per_page']
+    pages = max(1, math.ceil(len(matrix) / per_page))
+    page = min(view_args['page'], pages)
+    with timer.phase('render'):
+        table = matrix.iloc[(page - 1) * per_page:page * per_page].to_html(
+            classes='table table-striped table-bordered', index=False
+        )
+    REGISTRY.record_phases(timer.to_dict())
+    
+    view = dict(view_args, page=page, pages=pages, total=len(matrix))
+    return table, view
+
 @app.route('/schedule', methods=['GET', 'POST'])
 def schedule():
-    global global_optimizer
-    global global_result
-    
-    if global_optimizer is None:
-        global_optimizer = ShiftOptimizer()
+    if storage.count_employees() == 0 and storage.count_shifts() == 0:
         flash('従業員とシフトを先に登録してください。')
         return redirect(url_for('index'))
     
@@ -445,15 +576,18 @@ def schedule():
         try:
             start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            if end_date < start_date:
+                flash('期間エラー: 終了日は開始日以降の日付を入力してください。')
+                return redirect(url_for('schedule'))
             
-            # スケジュール期間を設定
-            global_optimizer.set_schedule_period(start_date, end_date)
+            # 週の区切りなどの保存済みの設定も読み込む（期間とバッティング回避ペアはフォームの値で置き換える）
+            optimizer = _load_optimizer()
             
-            # バッティング回避ペアをリセット
-            if hasattr(global_optimizer, 'avoidance_pairs'):
-                global_optimizer.avoidance_pairs = []
+            # スケジュール期間を設定
+            optimizer.set_schedule_period(start_date, end_date)
             
             # バッティング回避ペアを追加
+            optimizer.avoidance_pairs = []
             avoidance_pairs_str = request.form['avoidance_pairs']
             if avoidance_pairs_str.strip():
                 for pair_str in avoidance_pairs_str.split(','):
@@ -462,105 +596,245 @@ def schedule():
                         try:
                             emp1_id = int(pair[0].strip())
                             emp2_id = int(pair[1].strip())
-                            global_optimizer.add_avoidance_pair(emp1_id, emp2_id)
+                            optimizer.add_avoidance_pair(emp1_id, emp2_id)
                         except ValueError:
                             flash(f'バッティング回避ペアエラー: {pair_str}. "ID1-ID2"形式で入力してください。')
             
-            # 最適化実行
-            global_result = global_optimizer.solve()
+            # 週の区切り（空欄の場合は月曜日始まり）と週の勤務時間の上限を適用する期間
+            if 'week_origin' in request.form:
+                week_origin_str = request.form['week_origin'].strip()
+                try:
+                    optimizer.week_origin = (
+                        datetime.datetime.strptime(week_origin_str, '%Y-%m-%d').date() if week_origin_str else None
+                    )
+                except ValueError:
+                    flash(f'週の区切りエラー: {week_origin_str}. YYYY-MM-DD 形式の日付を入力してください。')
+                    return redirect(url_for('schedule'))
+            weekly_hours_window = request.form.get('weekly_hours_window', optimizer.weekly_hours_window)
+            if weekly_hours_window not in ('calendar', 'rolling'):
+                flash(f'週の勤務時間の期間エラー: {weekly_hours_window}. calendar または rolling を指定してください。')
+                return redirect(url_for('schedule'))
+            optimizer.weekly_hours_window = weekly_hours_window
             
-            if global_result['status'] == 'success':
-                # 制約違反の情報を表示
-                violations = global_result.get('violations', {})
-                
-                if sum(violations.values()) > 0:
-                    violation_msgs = []
-                    if violations.get('required_employees_violations', 0) > 0:
-                        violation_msgs.append(f"必要人数の不足: {int(violations['required_employees_violations'])}箇所")
-                    if violations.get('unavailable_violations', 0) > 0:
-                        violation_msgs.append(f"勤務不可日の出勤: {int(violations['unavailable_violations'])}箇所")
-                    if violations.get('avoidance_violations', 0) > 0:
-                        violation_msgs.append(f"バッティング回避の違反: {int(violations['avoidance_violations'])}箇所")
-                    
-                    if violation_msgs:
-                        flash(f'スケジュールが作成されましたが、一部制約条件を緩和しました: {", ".join(violation_msgs)}')
-                    else:
-                        flash('スケジュール作成が完了しました！')
-                else:
-                    flash('全ての制約条件を満たしたスケジュールが作成されました！')
-            else:
-                debug_info = global_result.get('debug_info', {})
-                status_name = debug_info.get('status_name', 'Unknown')
-                flash(f'スケジュール作成に失敗しました: {status_name}')
-                
-                # 詳細情報も表示
-                flash(f'詳細情報: 従業員数={debug_info.get("num_employees", "?")}、'
-                      f'シフト数={debug_info.get("num_shifts", "?")}、'
-                      f'期間={debug_info.get("num_days", "?")}日')
-                
-                # 対策案も表示
-                flash('対策: 期間を短くする、従業員を増やす、シフトの必要人数を減らす、制約条件を緩めるなどを試してください。')
+            # 勤務の間に空ける最低休息時間（0 の場合は制約なし）
+            try:
+                min_rest_hours = float(request.form.get('min_rest_hours') or optimizer.min_rest_hours)
+            except ValueError:
+                min_rest_hours = -1
+            if not 0 <= min_rest_hours < 24:
+                flash(f'最低休息時間エラー: {request.form.get("min_rest_hours")}. 0 以上 24 未満の時間数を入力してください。')
+                return redirect(url_for('schedule'))
+            optimizer.min_rest_hours = min_rest_hours
+            
+            storage.update_settings(
+                start_date=start_date.isoformat(),
+                end_date=end_date.isoformat(),
+                avoidance_pairs=[list(pair) for pair in optimizer.avoidance_pairs],
+                week_origin=optimizer.week_origin.isoformat() if optimizer.week_origin else None,
+                weekly_hours_window=optimizer.weekly_hours_window,
+                min_rest_hours=optimizer.min_rest_hours
+            )
+            
+            # 前回の結果を引き継ぐ場合は、その解から探索を始めて変更を最小限にする
+            previous_result = None
+            if 'keep_previous' in request.form:
+                _, latest_result = storage.load_result()
+                if latest_result and latest_result['status'] == 'success':
+                    previous_result = latest_result
+            
+            # 解法: 通常 / 期間分割（長期間向け）
+            solve_options = {'method': request.form.get('solve_method', 'standard')}
+            if solve_options['method'] == 'rolling':
+                try:
+                    window_days = int(request.form.get('window_days') or 14)
+                except ValueError:
+                    window_days = 0
+                if window_days < 2:
+                    flash(f'区間の日数エラー: {request.form.get("window_days")}. 2 以上の整数を入力してください。')
+                    return redirect(url_for('schedule'))
+                solve_options['window_days'] = window_days
+            
+            # ソルバーの設定: プリセットと個別の指定（空欄は環境変数・プリセットの値）
+            try:
+                solve_options['solver_config'] = SolverConfig.from_form(request.form)
+            except ValueError as e:
+                flash(f'ソルバー設定エラー: {str(e)}')
+                return redirect(url_for('schedule'))
+            
+            # 同じ入力の結果がキャッシュにあれば最適化せずに表示する
+            cached_result = None
+            if solve_options['method'] == 'standard':
+                cached_result = solution_cache.get(
+                    optimizer.get_cache_key(previous_result, solver_config=solve_options['solver_config'])
+                )
+            if cached_result is not None:
+                _cancel_current_job()
+                storage.save_result(cached_result)
+                _flash_result_messages(cached_result)
+                return redirect(url_for('schedule'))
+            
+            # 実行中のジョブがあれば取り消してから新しいジョブを投入する
+            _cancel_current_job()
+            
+            try:
+                job_id = job_manager.submit(
+                    optimizer.export_problem(),
+                    previous_result=previous_result,
+                    solve_options=solve_options
+                )
+                storage.update_settings(current_job_id=job_id)
+                flash('スケジュール作成を開始しました。完了までしばらくお待ちください。')
+            except JobQueueFullError as e:
+                flash(f'スケジュール作成を開始できません: {str(e)}')
             
             return redirect(url_for('schedule'))
             
         except ValueError as e:
             flash(f'日付フォーマットエラー: {str(e)}. YYYY-MM-DD形式で入力してください。')
     
-    # スケジュール結果を表示
-    schedule_table = None
-    if global_result and global_result['status'] == 'success':
-        df = global_optimizer.get_shift_table(global_result)
-        
-        # ピボットテーブルに変換して見やすく表示
-        pivot_df = df.pivot_table(
-            index=['employee_name'],
-            columns=['date'],
-            values=['shift_name'],
-            aggfunc=lambda x: ' '.join(str(v) for v in x)
-        )
-        
-        # マルチインデックスを解除
-        pivot_df.columns = [col[1] for col in pivot_df.columns]
-        pivot_df = pivot_df.reset_index()
-        
-        # DataFrameをHTMLテーブルに変換
-        schedule_table = pivot_df.to_html(classes='table table-striped table-bordered')
+    # 実行中のジョブの状態を確認
+    job = _collect_job_result()
     
-    return render_template('schedule.html', schedule_table=schedule_table)
+    # スケジュール結果を表示（同じ結果・同じ表示条件なら作成済みの HTML を使う）
+    schedule_table = None
+    schedule_view = None
+    result_version, result_status = storage.result_info()
+    if result_status == 'success':
+        view_args = _schedule_view_args(request.args)
+        cache_key = (result_version,) + tuple(sorted(view_args.items()))
+        cached_view = schedule_view_cache.get(cache_key)
+        if cached_view is not None:
+            schedule_view_cache.move_to_end(cache_key)
+            REGISTRY.inc('shift_schedule_view_cache_hits_total', help_text='スケジュール表の表示キャッシュのヒット数')
+        else:
+            _, result = storage.load_result()
+            cached_view = _render_schedule_view(result, view_args)
+            schedule_view_cache[cache_key] = cached_view
+            while len(schedule_view_cache) > SCHEDULE_VIEW_CACHE_SIZE:
+                schedule_view_cache.popitem(last=False)
+            REGISTRY.inc('shift_schedule_view_cache_misses_total', help_text='スケジュール表の表示キャッシュのミス数')
+        schedule_table, schedule_view = cached_view
+    
+    return render_template('schedule.html', schedule_table=schedule_table, schedule_view=schedule_view,
+                           job=job, solver_presets=SolverConfig.PRESETS, settings=storage.get_settings())
+
+@app.route('/schedule/jobs/<job_id>')
+def schedule_job_status(job_id):
+    job = _job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job)
+
+@app.route('/schedule/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_schedule_job(job_id):
+    if _job_status(job_id) is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    cancelled = _request_job_control(job_id, 'cancel')
+    return jsonify({'id': job_id, 'cancelled': cancelled})
+
+@app.route('/schedule/jobs/<job_id>/accept', methods=['POST'])
+def accept_schedule_job(job_id):
+    if _job_status(job_id) is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    accepted = _request_job_control(job_id, 'accept')
+    return jsonify({'id': job_id, 'accepted': accepted})
+
+@app.route('/schedule/jobs/<job_id>/events')
+def schedule_job_events(job_id):
+    """ジョブの状態と改善解の進捗を Server-Sent Events で送る
+
+    1回の接続は JOB_EVENTS_STREAM_SECONDS 秒で閉じ、ブラウザの再接続で続きを送る。
+    再接続時は Last-Event-ID（最後に受け取った解の番号）の解を送り直さない。
+    """
+    if _job_status(job_id) is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    last_event_id = request.headers.get('Last-Event-ID')
+    
+    def generate():
+        last_status = None
+        last_progress = None
+        started = last_sent = time.monotonic()
+        while True:
+            job = _job_status(job_id)
+            if job is None:
+                return
+            if job['progress'] is not None and job['progress'] != last_progress:
+                last_progress = job['progress']
+                solution_index = str(last_progress.get('solution_index'))
+                if solution_index != last_event_id:
+                    yield f'id: {solution_index}\nevent: solution\ndata: {json.dumps(last_progress)}\n\n'
+                    last_sent = time.monotonic()
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f'event: status\ndata: {json.dumps(job)}\n\n'
+                last_sent = time.monotonic()
+            if job['status'] not in ('queued', 'running'):
+                return
+            if time.monotonic() - started > JOB_EVENTS_STREAM_SECONDS:
+                # 1秒後に再接続させる
+                yield 'retry: 1000\n\n'
+                return
+            # 接続が切れないように定期的にコメント行を送る
+            if time.monotonic() - last_sent > 15:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(0.5)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/schedule/jobs/<job_id>/incumbent')
+def schedule_job_incumbent(job_id):
+    """ジョブのこれまでの最良解（format=html の場合はスケジュール表の1ページ目の HTML）"""
+    if _job_status(job_id) is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    incumbent = job_manager.incumbent(job_id) if job_manager.status(job_id) else storage.load_job_incumbent(job_id)
+    if incumbent is None or incumbent['status'] != 'success':
+        return jsonify({'error': '解がまだ見つかっていません'}), 409
+    if request.args.get('format') == 'html':
+        table, _ = _render_schedule_view(incumbent, _schedule_view_args({}))
+        return table
+    return jsonify(dict(_result_to_json(incumbent), solution_index=incumbent.get('solution_index')))
+
+@app.route('/schedule/jobs/<job_id>/result')
+def schedule_job_result(job_id):
+    job = _job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    result = _job_result(job_id) if job['status'] == 'done' else None
+    if result is None:
+        return jsonify({'error': 'ジョブが完了していません', 'status': job['status']}), 409
+    return jsonify(_result_to_json(result))
 
 @app.route('/export_schedule')
 def export_schedule():
-    global global_optimizer
-    global global_result
-    
-    if global_result and global_result['status'] == 'success':
-        df = global_optimizer.get_shift_table(global_result)
-        
-        # CSVファイルをメモリに書き込む
-        output = io.BytesIO()
-        df.to_csv(output, index=False, encoding='utf-8-sig')
-        output.seek(0)
-        
-        # CSVファイルをダウンロード
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='shift_schedule.csv',
-            mimetype='text/csv'
+    _, result = storage.load_result()
+    if result and result['status'] == 'success':
+        # CSVファイルを一定の行数ずつ生成しながらダウンロードさせる
+        return Response(
+            _load_optimizer(include=('employees',)).iter_csv_chunks(result),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=shift_schedule.csv'}
         )
     else:
         flash('エクスポートするスケジュールがありません。')
         return redirect(url_for('schedule'))
 
+@app.route('/metrics')
+def metrics():
+    """最適化・画面表示の計測値を Prometheus のテキスト形式で返す"""
+    REGISTRY.set('shift_jobs_pending', job_manager.count_pending(), help_text='実行待ち・実行中の最適化ジョブの数')
+    cache_stats = solution_cache.stats()
+    REGISTRY.set('shift_cache_hits', cache_stats['hits'], help_text='結果キャッシュのヒット数')
+    REGISTRY.set('shift_cache_misses', cache_stats['misses'], help_text='結果キャッシュのミス数')
+    REGISTRY.set('shift_cache_evictions', cache_stats['evictions'], help_text='結果キャッシュから破棄したエントリ数')
+    REGISTRY.set('shift_app_peak_rss_bytes', peak_rss_bytes(), help_text='アプリのプロセスのピーク RSS（バイト）')
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/reset')
 def reset():
-    global global_optimizer
-    global global_result
-    global global_request_manager
-    
-    global_optimizer = ShiftOptimizer()
-    global_result = None
-    global_request_manager = ShiftRequestManager()
+    _cancel_current_job()
+    storage.reset()
+    schedule_view_cache.clear()
     
     flash('全てのデータをリセットしました。')
     return redirect(url_for('index'))
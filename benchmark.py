@@ -0,0 +1,227 @@
+"""ShiftOptimizer のベンチマーク
+
+乱数シード付きの問題生成器で作った問題（と shift_optimizer.py の実行例）を解き、
+モデル構築時間・変数/制約数・presolve 時間・最初の実行可能解までの時間・
+最適解までの時間・目的関数値・ピークメモリを計測して JSON に書き出す。
+
+    python benchmark.py --cases example,small,medium --output bench.json
+
+各ケースはピークメモリを個別に測るため、新しいプロセスで実行する。
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools import __version__ as ortools_version
+from shift_optimizer import ShiftOptimizer, example_optimizer
+from solver_config import SolverConfig
+from metrics import peak_rss_bytes
+
+# ケース名 → 生成器のパラメータ
+CASES = {
+    'small': {'num_employees': 20, 'num_shifts': 4, 'num_days': 14},
+    'medium': {'num_employees': 100, 'num_shifts': 8, 'num_days': 28},
+    'large': {'num_employees': 300, 'num_shifts': 20, 'num_days': 31},
+}
+
+
+def example_problem():
+    """shift_optimizer.py の実行例と同じ問題"""
+    return example_optimizer().export_problem()
+
+
+def generate_problem(num_employees, num_shifts, num_days, seed=0, num_skills=5,
+                     unavailable_rate=0.1, preference_rate=0.3, num_avoidance_pairs=None,
+                     start_date=datetime.date(2023, 1, 1)):
+    """乱数シード付きで問題を生成し、export_problem() 形式の辞書で返す
+
+    必要人数の合計は、従業員が週5日程度勤務すれば満たせる程度に調整する。
+    """
+    rng = random.Random(seed)
+    skills = [f'スキル{k + 1}' for k in range(num_skills)]
+    dates = [start_date + datetime.timedelta(days=d) for d in range(num_days)]
+    if num_avoidance_pairs is None:
+        num_avoidance_pairs = num_employees // 10
+
+    optimizer = ShiftOptimizer()
+    optimizer.set_schedule_period(dates[0], dates[-1])
+
+    for s in range(num_shifts):
+        start_hour = rng.choice([6, 7, 8, 9, 10, 12, 14, 16, 18, 22])
+        length = rng.choice([4, 6, 8, 8, 8])
+        end_hour = (start_hour + length) % 24
+        required_employees = max(1, round(num_employees * 0.5 / num_shifts * rng.uniform(0.5, 1.5)))
+        optimizer.add_shift(
+            s + 1, f'シフト{s + 1}', f'{start_hour:02d}:00', f'{end_hour:02d}:00',
+            required_skills=rng.sample(skills, rng.randint(0, min(2, num_skills))),
+            required_employees=required_employees
+        )
+
+    for e in range(num_employees):
+        optimizer.add_employee(
+            e + 1, f'従業員{e + 1}',
+            skills=rng.sample(skills, rng.randint(1, num_skills)),
+            max_hours_day=8,
+            max_hours_week=rng.choice([20, 30, 40, 40]),
+            max_consecutive_days=rng.choice([3, 4, 5, 5]),
+            unavailable_days=[date for date in dates if rng.random() < unavailable_rate],
+            preferred_shifts=[s + 1 for s in range(num_shifts) if rng.random() < preference_rate / num_shifts]
+        )
+
+    pairs = set()
+    while len(pairs) < min(num_avoidance_pairs, num_employees * (num_employees - 1) // 2):
+        emp1_id, emp2_id = rng.sample(range(1, num_employees + 1), 2)
+        pairs.add((min(emp1_id, emp2_id), max(emp1_id, emp2_id)))
+    for emp1_id, emp2_id in sorted(pairs):
+        optimizer.add_avoidance_pair(emp1_id, emp2_id)
+
+    return optimizer.export_problem()
+
+
+def run_case(name, problem, solver_config):
+    """1ケースを解いて計測結果を返す"""
+    optimizer = ShiftOptimizer.from_problem(problem, solver_config=solver_config)
+
+    # ベースモデルを含めたモデル構築の時間（solve() の中では構築済みのベースモデルを再利用する）
+    start = time.perf_counter()
+    optimizer.setup_model()
+    build_time = time.perf_counter() - start
+
+    first_solution = []
+
+    def on_solution(progress):
+        if not first_solution:
+            first_solution.append(progress['elapsed'])
+
+    start = time.perf_counter()
+    result = optimizer.solve(progress_callback=on_solution)
+    solve_time = time.perf_counter() - start
+    metrics = result['metrics']
+    status = metrics['solver']['status']
+
+    return {
+        'case': name,
+        'num_employees': len(problem['employees']),
+        'num_shifts': len(problem['shifts']),
+        'num_days': len(problem['days']),
+        'build_time': build_time,
+        'num_variables': metrics['model']['variables'],
+        'num_constraints': metrics['model']['constraints'],
+        'families': metrics['model']['families'],
+        'presolve_time': metrics['solver'].get('presolve_time'),
+        'time_to_first_feasible': first_solution[0] if first_solution else None,
+        'time_to_optimal': metrics['solver']['wall_time'] if status == 'OPTIMAL' else None,
+        'solve_time': solve_time,
+        'status': status,
+        'objective_value': result.get('objective_value'),
+        'best_bound': optimizer.solver.BestObjectiveBound() if result['status'] == 'success' else None,
+        'violations': result.get('violations'),
+        'num_branches': metrics['solver']['num_branches'],
+        'num_conflicts': metrics['solver']['num_conflicts'],
+        'phases': metrics['phases'],
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+
+def _case_problem(name, seed):
+    if name == 'example':
+        return example_problem()
+    return generate_problem(seed=seed, **CASES[name])
+
+
+def _run_case_in_process(name, seed, solver_config):
+    return run_case(name, _case_problem(name, seed), solver_config)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(case_names, seed=0, solver_config=None):
+    """ケースを順に（それぞれ新しいプロセスで）実行し、計測結果をまとめて返す"""
+    if solver_config is None:
+        solver_config = SolverConfig.from_env()
+
+    for name in case_names:
+        if name != 'example' and name not in CASES:
+            raise ValueError(f"不明なケースです: {name} (example, {', '.join(CASES)} のいずれか)")
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name in case_names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(_run_case_in_process, name, seed, solver_config).result())
+
+    return {
+        'revision': _git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'ortools': ortools_version,
+        'seed': seed,
+        'solver_config': solver_config.to_dict(),
+        'cases': results
+    }
+
+
+def _format_seconds(value):
+    return '-' if value is None else f'{value:.3f}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ShiftOptimizer のベンチマーク')
+    parser.add_argument('--cases', default='example,small',
+                        help=f"実行するケース（カンマ区切り: example, {', '.join(CASES)}）")
+    parser.add_argument('--seed', type=int, default=0, help='問題生成の乱数シード')
+    parser.add_argument('--time-limit', type=float, help='ケースごとの時間制限（秒）')
+    parser.add_argument('--workers', type=int, help='ソルバーのワーカー数')
+    parser.add_argument('--output', help='計測結果の JSON の出力先（省略時は標準出力）')
+    args = parser.parse_args(argv)
+
+    solver_config = SolverConfig.from_env()
+    # ソルバーのログは計測結果の JSON と混ざらないよう、指定がなければ出力しない
+    if not os.environ.get('SHIFT_SOLVER_LOG'):
+        solver_config = solver_config.replace(log_to='none')
+    if args.time_limit is not None:
+        solver_config = solver_config.replace(max_time_in_seconds=args.time_limit)
+    if args.workers is not None:
+        solver_config = solver_config.replace(num_workers=args.workers)
+
+    report = run_benchmark([name.strip() for name in args.cases.split(',') if name.strip()],
+                           seed=args.seed, solver_config=solver_config)
+
+    header = f"{'case':<10}{'vars':>9}{'cons':>9}{'build':>9}{'presolve':>10}{'first':>9}{'optimal':>9}{'objective':>13}{'rss MB':>9}"
+    print(header, file=sys.stderr)
+    for case in report['cases']:
+        objective = '-' if case['objective_value'] is None else f"{case['objective_value']:.0f}"
+        print(
+            f"{case['case']:<10}{case['num_variables']:>9}{case['num_constraints']:>9}"
+            f"{_format_seconds(case['build_time']):>9}{_format_seconds(case['presolve_time']):>10}"
+            f"{_format_seconds(case['time_to_first_feasible']):>9}{_format_seconds(case['time_to_optimal']):>9}"
+            f"{objective:>13}{case['peak_rss_bytes'] / 2 ** 20:>9.1f}",
+            file=sys.stderr
+        )
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# HH:MM（秒は無視する）
+_TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})(?::\d{2})?$')
+
+_TRUE_VALUES = ['true', 'yes', 'はい', '1']
+
+
+class ImportReport:
+    """CSV インポートの結果（取り込んだ件数と、取り込めなかった行のエラー）
+
+    エラーのある行は取り込まず、(CSV の行番号, メッセージ) として記録する。
+    行番号はヘッダーを1行目とした番号。
+    """
+
+    def __init__(self, total_rows=0):
+        self.total_rows = total_rows
+        self.imported = 0
+        self.errors = []
+
+    def add_errors(self, invalid, values, message):
+        """invalid が True の行に message（{value} はその行の値に置き換える）を記録する"""
+        for index, value in values[invalid].items():
+            self.errors.append((int(index) + 2, message.format(value=value)))
+
+    def error_index(self):
+        """エラーのあった行の（データフレーム上の）インデックス"""
+        return pd.Index(sorted({line - 2 for line, _ in self.errors}), dtype=np.int64)
+
+    @property
+    def failed_rows(self):
+        return len({line for line, _ in self.errors})
+
+    def messages(self, limit=10):
+        """画面表示用のエラーメッセージ（先頭 limit 件）"""
+        errors = sorted(self.errors)
+        lines = [f'{line} 行目: {message}' for line, message in errors[:limit]]
+        if len(errors) > limit:
+            lines.append(f'ほか {len(errors) - limit} 件のエラーがあります')
+        return lines
+
+    def to_dict(self):
+        return {
+            'total_rows': self.total_rows,
+            'imported': self.imported,
+            'failed_rows': self.failed_rows,
+            'errors': [{'line': line, 'message': message} for line, message in sorted(self.errors)]
+        }
+
+    def __repr__(self):
+        return f'ImportReport(total_rows={self.total_rows}, imported={self.imported}, failed_rows={self.failed_rows})'
+
+
+def read_csv(source, encoding='utf-8-sig'):
+    """CSV をすべて文字列の列として読み込み、カラム名を正規化する（全角スペースを半角に、前後の空白を削除）"""
+    df = pd.read_csv(source, encoding=encoding, dtype=str)
+    df.columns = [str(col).replace('　', ' ').strip() for col in df.columns]
+    return df.reset_index(drop=True)
+
+
+def check_columns(df, required_columns):
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"必須カラムがありません: {', '.join(missing_columns)}")
+
+
+def text_column(df, column):
+    """列を前後の空白を除いた文字列で返す（列がない場合・空欄は ''）"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[column].fillna('').astype(str).str.strip()
+
+
+def parse_int(df, column, report, default=None):
+    """整数の列を読む。default が None の場合は必須の列として空欄もエラーにする"""
+    text = text_column(df, column)
+    values = pd.to_numeric(text.where(text != ''), errors='coerce')
+    report.add_errors((text != '') & (values.isna() | (values % 1 != 0)), text,
+                      f'{column} は整数で入力してください: {{value}}')
+    if default is None:
+        report.add_errors(text == '', text, f'{column} が空欄です')
+    else:
+        values = values.fillna(default)
+    return values
+
+
+def parse_dates(text, formats=('%Y-%m-%d',)):
+    """日付の文字列を datetime64 に変換する（先に指定した書式を優先、読めない値は NaT）"""
+    dates = pd.to_datetime(text, format=formats[0], errors='coerce')
+    for date_format in formats[1:]:
+        dates = dates.mask(dates.isna(), pd.to_datetime(text, format=date_format, errors='coerce'))
+    return dates
+
+
+def parse_minutes(text):
+    """HH:MM の文字列を 0時からの分に変換する（読めない値・範囲外の時刻・空欄は NaN）"""
+    parts = text.str.extract(_TIME_PATTERN)
+    hours = pd.to_numeric(parts[0])
+    minutes = pd.to_numeric(parts[1])
+    return (hours * 60 + minutes).where((hours <= 23) & (minutes <= 59))
+
+
+def parse_time_column(df, column, report, required=False):
+    text = text_column(df, column)
+    minutes = parse_minutes(text)
+    report.add_errors((text != '') & minutes.isna(), text, f'{column} は 00:00〜23:59 の HH:MM 形式で入力してください: {{value}}')
+    if required:
+        report.add_errors(text == '', text, f'{column} が空欄です')
+    return minutes
+
+
+def split_list(text):
+    """カンマ区切りの値を行のインデックス付きで1件ずつに分ける（空の要素は除く）"""
+    items = text.str.split(',').explode().str.strip()
+    return items[items.notna() & (items != '')]
+
+
+def group_lists(items):
+    """split_list() で分けた値を行ごとのリストに戻す（行のインデックス → リスト）"""
+    if items.empty:
+        return {}
+    return items.groupby(level=0).agg(list).to_dict()
+
+
+def check_duplicate_ids(ids, column, report, existing_ids=()):
+    """ファイル内で重複する ID（2件目以降）と登録済みの ID をエラーにする"""
+    report.add_errors(ids.notna() & ids.duplicated(), ids, f'{column} {{value:.0f}} がファイル内で重複しています')
+    report.add_errors(ids.notna() & ids.isin(list(existing_ids)), ids, f'{column} {{value:.0f}} は既に登録されています')
+
+
+def _valid_index(df, report):
+    return df.index.difference(report.error_index())
+
+
+def read_employees(source, encoding='utf-8-sig', existing_ids=()):
+    """従業員の CSV を読み、(add_employee の引数の辞書のリスト, ImportReport) を返す
+
+    ファイル内で重複する ID と existing_ids に含まれる ID の行はエラーにする。
+
+    必須カラム: employee_id, name
+    任意カラム: skills, max_hours_day, max_hours_week, max_consecutive_days,
+    unavailable_days (YYYY-MM-DD のカンマ区切り), preferred_shifts (シフトIDのカンマ区切り)
+    """
+    df = read_csv(source, encoding)
+    check_columns(df, ['employee_id', 'name'])
+    report = ImportReport(len(df))
+
+    employee_ids = parse_int(df, 'employee_id', report)
+    check_duplicate_ids(employee_ids, 'employee_id', report, existing_ids)
+    names = text_column(df, 'name')
+    report.add_errors(names == '', names, 'name が空欄です')
+    max_hours_day = parse_int(df, 'max_hours_day', report, default=8)
+    max_hours_week = parse_int(df, 'max_hours_week', report, default=40)
+    max_consecutive_days = parse_int(df, 'max_consecutive_days', report, default=5)
+
+    skills = group_lists(split_list(text_column(df, 'skills')))
+
+    day_items = split_list(text_column(df, 'unavailable_days'))
+    dates = parse_dates(day_items)
+    report.add_errors(dates.isna(), day_items, '日付は YYYY-MM-DD 形式で入力してください: {value}')
+    unavailable_days = group_lists(dates.dropna().dt.date)
+
+    shift_items = split_list(text_column(df, 'preferred_shifts'))
+    shift_ids = pd.to_numeric(shift_items, errors='coerce')
+    report.add_errors(shift_ids.isna() | (shift_ids % 1 != 0), shift_items, 'シフトIDは整数で入力してください: {value}')
+    preferred_shifts = group_lists(shift_ids.dropna().astype(np.int64).map(int))
+
+    valid = _valid_index(df, report)
+    employees = [
+        {
+            'employee_id': employee_id,
+            'name': name,
+            'skills': skills.get(index, []),
+            'max_hours_day': hours_day,
+            'max_hours_week': hours_week,
+            'max_consecutive_days': consecutive_days,
+            'unavailable_days': unavailable_days.get(index, []),
+            'preferred_shifts': preferred_shifts.get(index, [])
+        }
+        for index, employee_id, name, hours_day, hours_week, consecutive_days in zip(
+            valid,
+            employee_ids[valid].astype(np.int64).tolist(),
+            names[valid].tolist(),
+            max_hours_day[valid].astype(np.int64).tolist(),
+            max_hours_week[valid].astype(np.int64).tolist(),
+            max_consecutive_days[valid].astype(np.int64).tolist()
+        )
+    ]
+    return employees, report
+
+
+def read_shifts(source, encoding='utf-8-sig', existing_ids=()):
+    """シフトの CSV を読み、(add_shift の引数の辞書のリスト, ImportReport) を返す
+
+    ファイル内で重複する ID と existing_ids に含まれる ID の行はエラーにする。
+
+    必須カラム: shift_id, name, start_time, end_time (HH:MM)
+    任意カラム: required_skills, required_employees, is_fixed
+    """
+    df = read_csv(source, encoding)
+    check_columns(df, ['shift_id', 'name', 'start_time', 'end_time'])
+    report = ImportReport(len(df))
+
+    shift_ids = parse_int(df, 'shift_id', report)
+    check_duplicate_ids(shift_ids, 'shift_id', report, existing_ids)
+    names = text_column(df, 'name')
+    report.add_errors(names == '', names, 'name が空欄です')
+    start_minutes = parse_time_column(df, 'start_time', report, required=True)
+    end_minutes = parse_time_column(df, 'end_time', report, required=True)
+    required_employees = parse_int(df, 'required_employees', report, default=1)
+    required_skills = group_lists(split_list(text_column(df, 'required_skills')))
+    is_fixed = text_column(df, 'is_fixed').str.lower().isin(_TRUE_VALUES)
+
+    valid = _valid_index(df, report)
+    shifts = [
+        {
+            'shift_id': shift_id,
+            'name': name,
+            'start_time': start,
+            'end_time': end,
+            'required_skills': required_skills.get(index, []),
+            'required_employees': employees,
+            'is_fixed': fixed
+        }
+        for index, shift_id, name, start, end, employees, fixed in zip(
+            valid,
+            shift_ids[valid].astype(np.int64).tolist(),
+            names[valid].tolist(),
+            start_minutes[valid].astype(np.int64).tolist(),
+            end_minutes[valid].astype(np.int64).tolist(),
+            required_employees[valid].astype(np.int64).tolist(),
+            is_fixed[valid].tolist()
+        )
+    ]
+    return shifts, report
+
+
+def read_shift_requests(source, encoding='utf-8-sig'):
+    """シフト希望の CSV を読み、(ShiftRequestManager に追加する辞書のリスト, ImportReport) を返す
+
+    必須カラム: スタッフコード, 日付 (YYYY/MM/DD または YYYY-MM-DD)
+    任意カラム: 休み, シフト名, 出勤時刻, 退勤時刻, 休憩時間 (H:MM または時間数), スタッフからの備考
+    """
+    df = read_csv(source, encoding)
+    check_columns(df, ['スタッフコード', '日付'])
+    report = ImportReport(len(df))
+
+    employee_ids = parse_int(df, 'スタッフコード', report)
+
+    date_text = text_column(df, '日付')
+    dates = parse_dates(date_text, formats=('%Y/%m/%d', '%Y-%m-%d'))
+    report.add_errors(dates.isna(), date_text, '日付は YYYY/MM/DD または YYYY-MM-DD 形式で入力してください: {value}')
+
+    is_day_off = text_column(df, '休み') != ''
+    shift_names = text_column(df, 'シフト名')
+
+    start_minutes = parse_time_column(df, '出勤時刻', report)
+    end_minutes = parse_time_column(df, '退勤時刻', report)
+    # 終了時間が開始時間より前の場合は翌日とみなす
+    end_minutes = end_minutes.where(~(end_minutes < start_minutes), end_minutes + 24 * 60)
+
+    # 休憩時間: H:MM 形式、または数値のみの場合は時間数
+    break_text = text_column(df, '休憩時間')
+    break_minutes = parse_minutes(break_text).fillna(
+        pd.to_numeric(break_text.where(~break_text.str.contains(':')), errors='coerce') * 60
+    )
+    report.add_errors((break_text != '') & break_minutes.isna(), break_text,
+                      '休憩時間は H:MM 形式または時間数で入力してください: {value}')
+
+    notes = text_column(df, 'スタッフからの備考')
+
+    valid = _valid_index(df, report)
+
+    def optional(values):
+        return values.round().astype(object).where(values.notna(), None)[valid].tolist()
+
+    day_off = is_day_off[valid].tolist()
+    requests = [
+        {
+            'employee_id': employee_id,
+            'date': date,
+            'shift_name': shift_name if shift_name and not off else None,
+            'start_minutes': None if start is None else int(start),
+            'end_minutes': None if end is None else int(end),
+            'break_minutes': None if break_time is None else int(break_time),
+            'note': note or None,
+            'is_day_off': off
+        }
+        for employee_id, date, off, shift_name, start, end, break_time, note in zip(
+            employee_ids[valid].astype(np.int64).tolist(),
+            dates[valid].dt.date.tolist(),
+            day_off,
+            shift_names[valid].tolist(),
+            optional(start_minutes),
+            optional(end_minutes),
+            optional(break_minutes),
+            notes[valid].tolist()
+        )
+    ]
+    return requests, report
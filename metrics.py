@@ -0,0 +1,178 @@
+import re
+import sys
+import time
+import resource
+import threading
+import contextlib
+
+
+def peak_rss_bytes():
+    """このプロセスのピーク RSS（バイト）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux では KB 単位、macOS ではバイト単位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PhaseTimer:
+    """フェーズごとの実時間と CPU 時間（全スレッドの合計）を記録する"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+    def add(self, name, wall_time, cpu_time=0.0):
+        entry = self.phases.setdefault(name, {'wall_time': 0.0, 'cpu_time': 0.0})
+        entry['wall_time'] += wall_time
+        entry['cpu_time'] += cpu_time
+
+    def to_dict(self):
+        return {name: dict(entry) for name, entry in self.phases.items()}
+
+
+def merge_metrics(metrics_list):
+    """区間・連結成分ごとの計測結果を合算する（フェーズ時間・探索統計は合計、メモリは最大）"""
+    timer = PhaseTimer()
+    families = {}
+    solver = {}
+    peak = 0
+    for metrics in metrics_list:
+        for name, entry in metrics.get('phases', {}).items():
+            timer.add(name, entry['wall_time'], entry['cpu_time'])
+        for family, counts in metrics.get('model', {}).get('families', {}).items():
+            total = families.setdefault(family, {'variables': 0, 'constraints': 0})
+            total['variables'] += counts['variables']
+            total['constraints'] += counts['constraints']
+        for key, value in metrics.get('solver', {}).items():
+            if isinstance(value, (int, float)):
+                solver[key] = solver.get(key, 0) + value
+        peak = max(peak, metrics.get('peak_rss_bytes', 0))
+
+    return {
+        'phases': timer.to_dict(),
+        'model': {
+            'variables': sum(counts['variables'] for counts in families.values()),
+            'constraints': sum(counts['constraints'] for counts in families.values()),
+            'families': families
+        },
+        'solver': solver,
+        'peak_rss_bytes': peak,
+        'parts': len(metrics_list)
+    }
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + '}'
+
+
+class MetricsRegistry:
+    """最適化の計測値を集計し、Prometheus のテキスト形式で出力する"""
+
+    _NAME_PATTERN = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 名前 → (種類, 説明)
+        self._meta = {}
+        # 名前 → {ラベルのタプル: 値}（summary は [合計, 件数]）
+        self._values = {}
+
+    def _series(self, name, kind, help_text):
+        if not self._NAME_PATTERN.match(name):
+            raise ValueError(f"メトリクス名が不正です: {name}")
+        if name not in self._meta:
+            self._meta[name] = (kind, help_text)
+            self._values[name] = {}
+        return self._values[name]
+
+    def inc(self, name, value=1, help_text='', **labels):
+        """カウンターを増やす"""
+        with self._lock:
+            series = self._series(name, 'counter', help_text)
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, help_text='', **labels):
+        """ゲージを設定する"""
+        with self._lock:
+            self._series(name, 'gauge', help_text)[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, help_text='', **labels):
+        """サマリーに観測値を追加する（合計と件数を出力する）"""
+        with self._lock:
+            series = self._series(name, 'summary', help_text)
+            key = tuple(sorted(labels.items()))
+            total = series.setdefault(key, [0.0, 0])
+            total[0] += value
+            total[1] += 1
+
+    def record_phases(self, phases):
+        """PhaseTimer.to_dict() の各フェーズの時間を集計に加える"""
+        for phase, entry in phases.items():
+            self.observe('shift_phase_wall_seconds', entry['wall_time'],
+                         help_text='フェーズごとの実時間（秒）', phase=phase)
+            self.observe('shift_phase_cpu_seconds', entry['cpu_time'],
+                         help_text='フェーズごとの CPU 時間（秒）', phase=phase)
+
+    def record_solve(self, result, method='standard'):
+        """solve() の結果に含まれる計測値を集計に加える"""
+        self.inc('shift_solves_total', help_text='最適化の実行回数',
+                 method=method, status=result.get('status', 'unknown'))
+        metrics = result.get('metrics')
+        if not metrics:
+            return
+
+        self.record_phases(metrics.get('phases', {}))
+
+        for family, counts in metrics.get('model', {}).get('families', {}).items():
+            self.set('shift_model_variables', counts['variables'],
+                     help_text='直近のモデルの変数の数（制約の種類別）', family=family)
+            self.set('shift_model_constraints', counts['constraints'],
+                     help_text='直近のモデルの制約の数（制約の種類別）', family=family)
+
+        solver = metrics.get('solver', {})
+        if 'num_branches' in solver:
+            self.inc('shift_solver_branches_total', solver['num_branches'], help_text='CP-SAT の分岐数')
+        if 'num_conflicts' in solver:
+            self.inc('shift_solver_conflicts_total', solver['num_conflicts'], help_text='CP-SAT の競合数')
+        if 'wall_time' in solver:
+            self.observe('shift_solver_wall_seconds', solver['wall_time'], help_text='CP-SAT の実行時間（秒）')
+
+        if metrics.get('peak_rss_bytes'):
+            self.set('shift_solve_peak_rss_bytes', metrics['peak_rss_bytes'],
+                     help_text='直近の最適化を実行したプロセスのピーク RSS（バイト）')
+
+    def render(self):
+        """Prometheus のテキスト形式で出力する"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._meta):
+                kind, help_text = self._meta[name]
+                if help_text:
+                    lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(self._values[name].items()):
+                    labels = _format_labels(key)
+                    if kind == 'summary':
+                        lines.append(f'{name}_sum{labels} {value[0]}')
+                        lines.append(f'{name}_count{labels} {value[1]}')
+                    else:
+                        lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# アプリ全体で共有する集計
+REGISTRY = MetricsRegistry()
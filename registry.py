@@ -0,0 +1,155 @@
+from bisect import bisect_left
+from collections.abc import MutableSequence, Sequence
+
+
+class DuplicateIdError(ValueError):
+    """登録済みのIDで追加しようとした"""
+
+
+class Registry(MutableSequence):
+    """ID・名前・名前の前方一致で引ける登録簿（要素は 'id' と 'name' を持つ辞書）
+
+    リストと同じように添字・スライス・len・for で扱える。追加時に ID の重複を検出する。
+    登録後の要素の 'id' / 'name' は書き換えないこと（索引が古くなる）。
+    """
+
+    # エラーメッセージに使う要素の呼び名
+    kind = '要素'
+
+    def __init__(self, records=()):
+        self._records = []
+        # ID → 位置
+        self._positions = {}
+        # 名前 → その名前の最初の位置
+        self._name_positions = {}
+        # (名前, 位置) の昇順。前方一致の検索に使う
+        self._sorted_names = []
+        self._max_id = 0
+        self.extend(records)
+
+    def _index_record(self, record, position):
+        self._positions[record['id']] = position
+        name = str(record['name'])
+        self._name_positions.setdefault(name, position)
+        if isinstance(record['id'], int) and record['id'] > self._max_id:
+            self._max_id = record['id']
+        return name, position
+
+    def _check_new_ids(self, records):
+        duplicates = []
+        seen = set()
+        for record in records:
+            record_id = record['id']
+            if record_id in self._positions or record_id in seen:
+                duplicates.append(record_id)
+            seen.add(record_id)
+        if duplicates:
+            raise DuplicateIdError(
+                f"{self.kind}ID {', '.join(str(record_id) for record_id in duplicates)} は既に登録されています"
+            )
+
+    def _rebuild(self, records):
+        records = list(records)
+        self._records = []
+        self._positions = {}
+        self._name_positions = {}
+        self._sorted_names = []
+        self._max_id = 0
+        self.extend(records)
+
+    def append(self, record):
+        self._check_new_ids([record])
+        position = len(self._records)
+        self._records.append(record)
+        entry = self._index_record(record, position)
+        self._sorted_names.insert(bisect_left(self._sorted_names, entry), entry)
+
+    def extend(self, records):
+        """まとめて追加する（ID が重複する場合は1件も追加しない）"""
+        records = list(records)
+        self._check_new_ids(records)
+        start = len(self._records)
+        self._records.extend(records)
+        self._sorted_names.extend(
+            self._index_record(record, position) for position, record in enumerate(records, start)
+        )
+        self._sorted_names.sort()
+
+    def insert(self, index, record):
+        if index >= len(self._records):
+            self.append(record)
+            return
+        records = list(self._records)
+        records.insert(index, record)
+        self._rebuild(records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __setitem__(self, index, value):
+        records = list(self._records)
+        records[index] = value
+        self._rebuild(records)
+
+    def __delitem__(self, index):
+        records = list(self._records)
+        del records[index]
+        self._rebuild(records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self._records) == list(other)
+        return NotImplemented
+
+    def get(self, record_id, default=None):
+        """ID で要素を引く"""
+        position = self._positions.get(record_id)
+        return default if position is None else self._records[position]
+
+    def position(self, record_id):
+        """ID の要素の位置（見つからない場合は None）"""
+        return self._positions.get(record_id)
+
+    def has_id(self, record_id):
+        return record_id in self._positions
+
+    def ids(self):
+        return [record['id'] for record in self._records]
+
+    def get_by_name(self, name):
+        """名前が一致する最初の要素"""
+        position = self._name_positions.get(str(name))
+        return None if position is None else self._records[position]
+
+    def find_prefix(self, prefix):
+        """名前が prefix で始まる要素のうち、最初に登録されたもの"""
+        prefix = str(prefix)
+        best = None
+        for i in range(bisect_left(self._sorted_names, (prefix,)), len(self._sorted_names)):
+            name, position = self._sorted_names[i]
+            if not name.startswith(prefix):
+                break
+            if best is None or position < best:
+                best = position
+        return None if best is None else self._records[best]
+
+    def next_id(self):
+        """未使用の ID（登録済みの整数 ID の最大値 + 1）"""
+        return self._max_id + 1
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._records!r})'
+
+
+class EmployeeRegistry(Registry):
+    kind = '従業員'
+
+
+class ShiftRegistry(Registry):
+    kind = 'シフト'
@@ -0,0 +1,46 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class Schedule(Mapping):
+    """割り当て配列（従業員 × 日 → シフト位置、休みは -1）で保持するスケジュール
+
+    schedule[employee_id] は従来と同じ形式の日ごとのリスト
+    （{'date', 'weekday', 'shift'} の辞書のリスト）を返す。リストは参照されたときに作る。
+    """
+
+    def __init__(self, assignment, employee_ids, days, shifts):
+        self.assignment = np.asarray(assignment, dtype=np.int32)
+        self.employee_ids = list(employee_ids)
+        self.days = list(days)
+        self.shifts = list(shifts)
+        if self.assignment.shape != (len(self.employee_ids), len(self.days)):
+            raise ValueError(
+                f"割り当て配列の形 {self.assignment.shape} が従業員数・日数 "
+                f"({len(self.employee_ids)}, {len(self.days)}) と一致しません"
+            )
+        self._rows = {employee_id: e for e, employee_id in enumerate(self.employee_ids)}
+
+    def __getitem__(self, employee_id):
+        row = self.assignment[self._rows[employee_id]].tolist()
+        return [
+            {
+                'date': day["date"],
+                'weekday': day["weekday"],
+                'shift': self.shifts[s] if s >= 0 else None
+            }
+            for day, s in zip(self.days, row)
+        ]
+
+    def __contains__(self, employee_id):
+        return employee_id in self._rows
+
+    def __iter__(self):
+        return iter(self.employee_ids)
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+    def __repr__(self):
+        return f'Schedule(employees={len(self.employee_ids)}, days={len(self.days)}, shifts={len(self.shifts)})'
@@ -2,80 +2,290 @@ import numpy as np
 import pandas as pd
 from ortools.sat.python import cp_model
 import datetime
+import hashlib
+import queue
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from solution_cache import make_cache_key
+from solver_config import SolverConfig, available_cpu_count
+from metrics import PhaseTimer, merge_metrics, peak_rss_bytes
+from schedule_result import Schedule
+from registry import EmployeeRegistry, ShiftRegistry
+
+
+def _watch_stop_event(stop_event, solver, finished):
+    """停止要求を監視し、要求があれば探索を打ち切る"""
+    while not finished.wait(0.5):
+        try:
+            if stop_event.is_set():
+                # 探索開始前に要求された場合に備えて、終了するまで繰り返し停止させる
+                solver.StopSearch()
+        except (EOFError, OSError):
+            # 停止要求を共有するマネージャーが終了した場合は監視をやめる
+            return
+
+
+def _model_size(model):
+    """モデルの (変数の数, 制約の数)"""
+    proto = model.Proto()
+    return len(proto.variables), len(proto.constraints)
+
+
+class _SolverLogListener:
+    """ソルバーのログから探索の開始時刻（presolve の終了時刻）を読み取り、元の出力先に渡す"""
+
+    _SEARCH_START_PATTERN = re.compile(r'Starting search at ([0-9.]+)s')
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.search_start = None
+
+    def __call__(self, message):
+        if self.search_start is None:
+            match = self._SEARCH_START_PATTERN.search(message)
+            if match:
+                self.search_start = float(match.group(1))
+        if self.forward is not None:
+            self.forward(message)
+
+
+class _ProgressCallback(cp_model.CpSolverSolutionCallback):
+    """改善解が見つかるたびに目的関数値・上界・ギャップ・経過時間とその時点のスケジュールを通知する"""
+
+    def __init__(self, optimizer, on_solution):
+        super().__init__()
+        self.optimizer = optimizer
+        self.on_solution = on_solution
+        self.solution_count = 0
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        objective_value = self.ObjectiveValue()
+        best_bound = self.BestObjectiveBound()
+        optimizer = self.optimizer
+        response = self.response_proto
+        values = np.fromiter(response.solution, dtype=np.int64, count=len(response.solution))
+        self.on_solution({
+            'solution_index': self.solution_count,
+            'objective_value': objective_value,
+            'best_bound': best_bound,
+            'gap': abs(best_bound - objective_value) / max(1.0, abs(objective_value)),
+            'elapsed': self.WallTime(),
+            'violations': {
+                'required_employees_violations': sum(
+                    self.Value(v) * int(weight)
+                    for v, weight in zip(optimizer.required_employees_violations, optimizer.required_violation_weights)
+                ),
+                'unavailable_violations': sum(self.Value(v) for v in optimizer.unavailable_violations),
+                'avoidance_violations': sum(self.Value(v) for v in optimizer.avoidance_violations)
+            },
+            'schedule': optimizer._make_schedule(optimizer._assignment_from_values(values))
+        })
+
+
+def make_employee(employee_id, name, skills=None, max_hours_day=8, max_hours_week=40,
+                  max_consecutive_days=5, unavailable_days=None, preferred_shifts=None):
+    """add_employee の引数から従業員の辞書を作る"""
+    if skills is None:
+        skills = []
+    # 勤務不可日・希望シフトは集合で持つ（画面表示などでは sorted() で並べる）
+    unavailable_days = set(unavailable_days) if unavailable_days is not None else set()
+    preferred_shifts = set(preferred_shifts) if preferred_shifts is not None else set()
+
+    employee = {
+        'id': employee_id,
+        'name': name,
+        'skills': skills,
+        'max_hours_day': max_hours_day,
+        'max_hours_week': max_hours_week,
+        'max_consecutive_days': max_consecutive_days,
+        'unavailable_days': unavailable_days,
+        'preferred_shifts': preferred_shifts
+    }
+    return employee
+
+
+def _time_range_minutes(start_time, end_time):
+    """開始・終了時刻（HH:MM 形式または0時からの分）を分単位の (開始, 終了) にする"""
+    # 時間をHH:MM形式から分単位に変換
+    if isinstance(start_time, str):
+        h, m = map(int, start_time.split(':'))
+        start_minutes = h * 60 + m
+    else:
+        start_minutes = start_time
+
+    if isinstance(end_time, str):
+        h, m = map(int, end_time.split(':'))
+        end_minutes = h * 60 + m
+    else:
+        end_minutes = end_time
+
+    # 終了時間が開始時間より前の場合は翌日とみなす
+    if end_minutes < start_minutes:
+        end_minutes += 24 * 60
+    return start_minutes, end_minutes
+
+
+def make_shift(shift_id, name, start_time, end_time, required_skills=None,
+               required_employees=1, is_fixed=False, request_only=False):
+    """add_shift の引数からシフトの辞書を作る（時刻は HH:MM 形式または0時からの分）"""
+    if required_skills is None:
+        required_skills = []
+
+    start_minutes, end_minutes = _time_range_minutes(start_time, end_time)
+
+    shift = {
+        'id': shift_id,
+        'name': name,
+        'start_minutes': start_minutes,
+        'end_minutes': end_minutes,
+        'duration': end_minutes - start_minutes,
+        'required_skills': required_skills,
+        'required_employees': required_employees,
+        'is_fixed': is_fixed,
+        'request_only': request_only
+    }
+    return shift
+
+
+def make_demand(start_time, end_time, required_employees, weekday=None, date=None):
+    """add_demand の引数から時間帯の必要人数の辞書を作る"""
+    start_minutes, end_minutes = _time_range_minutes(start_time, end_time)
+    if weekday is not None and date is not None:
+        raise ValueError("曜日と日付はどちらか一方だけを指定してください")
+    return {
+        'start_minutes': start_minutes,
+        'end_minutes': end_minutes,
+        'required_employees': required_employees,
+        'weekday': weekday,
+        'date': date
+    }
+
+
+def _solve_component(problem, previous_result, change_penalty, stop_event, solver_config):
+    """連結成分ごとの部分問題をワーカープロセスで解く"""
+    optimizer = ShiftOptimizer.from_problem(problem, solver_config=solver_config)
+    optimizer.stop_event = stop_event
+    return optimizer.solve(previous_result=previous_result, change_penalty=change_penalty)
+
 
 class ShiftOptimizer:
-    def __init__(self):
-        self.employees = []
-        self.shifts = []
+    # 目的関数の重み
+    PREFERENCE_WEIGHT = 10
+    REQUIRED_EMPLOYEES_WEIGHT = 1000
+    UNAVAILABLE_WEIGHT = 500
+    AVOIDANCE_WEIGHT = 300
+    
+    def __init__(self, solver_config=None):
+        # ID・名前で引ける登録簿（リストとしても扱える）
+        self.employees = EmployeeRegistry()
+        self.shifts = ShiftRegistry()
         self.days = []
+        # 週の区切りの基準日（None の場合は月曜日始まりの暦週）
+        self.week_origin = None
+        # 週の勤務時間の上限を適用する期間: 'calendar'（暦週）/ 'rolling'（任意の連続7日間）
+        self.weekly_hours_window = 'calendar'
+        # 勤務の終了から次の日の勤務の開始までに空ける最低休息時間（時間、0 の場合は制約なし）
+        # 既定は 0 で、設定を含まない既存の問題の解は変わらない
+        self.min_rest_hours = 0
+        # 割り当てを固定する (従業員ID, 日付) → シフトID（None は休み）
+        self.fixed_assignments = {}
+        # 時刻指定の希望 (従業員ID, 日付) → 申請用シフト（同じ時間帯で共有するパターン）のID
+        self.time_requests = {}
+        # 時間帯ごとの必要人数（需要曲線）。設定するとシフトごとの必要人数の代わりに使う
+        self.demands = []
+        # 需要曲線の時間帯の幅（分）。1日の分数を割り切れる値
+        self.demand_bucket_minutes = 30
         self.model = cp_model.CpModel()
+        # 従業員・シフト・期間が変わらない限り再利用するベースモデル
+        self._base_model = None
+        self._base_fingerprint = None
+        # 入れ替えても解が変わらない従業員の対称性を制約で除く（前回の解を引き継ぐ場合は使わない）
+        self.symmetry_breaking = True
+        # 結果キャッシュ (solution_cache.SolutionCache)。None の場合は使用しない
+        self.cache = None
+        # 停止要求 (threading.Event またはマネージャー経由の Event)。セットされると探索を打ち切る
+        self.stop_event = None
+        # ソルバーの設定 (solver_config.SolverConfig)。省略時は環境変数 SHIFT_SOLVER_* から読み込む
+        self.solver_config = solver_config if solver_config is not None else SolverConfig.from_env()
         self.solver = cp_model.CpSolver()
-        self.solver.parameters.linearization_level = 0
-        # デフォルトでは1時間のタイムリミットを設定
-        self.solver.parameters.max_time_in_seconds = 3600.0
+        self.solver_config.apply(self.solver)
         
     def add_employee(self, employee_id, name, skills=None, max_hours_day=8, 
                     max_hours_week=40, max_consecutive_days=5, unavailable_days=None, 
                     preferred_shifts=None):
-        """従業員を追加する"""
-        if skills is None:
-            skills = []
-        if unavailable_days is None:
-            unavailable_days = []
-        if preferred_shifts is None:
-            preferred_shifts = []
-            
-        employee = {
-            'id': employee_id,
-            'name': name,
-            'skills': skills,
-            'max_hours_day': max_hours_day,
-            'max_hours_week': max_hours_week,
-            'max_consecutive_days': max_consecutive_days,
-            'unavailable_days': unavailable_days,
-            'preferred_shifts': preferred_shifts
-        }
+        """従業員を追加する（ID が登録済みの場合は registry.DuplicateIdError）"""
+        employee = make_employee(employee_id, name, skills, max_hours_day, max_hours_week,
+                                 max_consecutive_days, unavailable_days, preferred_shifts)
         self.employees.append(employee)
         return employee
     
+    def add_employees(self, employees):
+        """従業員をまとめて追加する（各要素は add_employee の引数の辞書。ID が重複する場合は1件も追加しない）"""
+        records = [make_employee(**employee) for employee in employees]
+        self.employees.extend(records)
+        return records
+    
     def add_shift(self, shift_id, name, start_time, end_time, required_skills=None, 
-                 required_employees=1, is_fixed=False):
-        """シフトを追加する"""
-        if required_skills is None:
-            required_skills = []
-            
-        # 時間をHH:MM形式から分単位に変換
-        if isinstance(start_time, str):
-            h, m = map(int, start_time.split(':'))
-            start_minutes = h * 60 + m
-        else:
-            start_minutes = start_time
-            
-        if isinstance(end_time, str):
-            h, m = map(int, end_time.split(':'))
-            end_minutes = h * 60 + m
-        else:
-            end_minutes = end_time
-            
+                 required_employees=1, is_fixed=False, request_only=False):
+        """シフトを追加する（ID が登録済みの場合は registry.DuplicateIdError）
+
+        request_only のシフトは時刻指定の希望用で、希望を出した従業員・日にだけ割り当てる。
+        """
+        shift = make_shift(shift_id, name, start_time, end_time, required_skills,
+                           required_employees, is_fixed, request_only)
+        self.shifts.append(shift)
+        return shift
+    
+    def add_shifts(self, shifts):
+        """シフトをまとめて追加する（各要素は add_shift の引数の辞書。ID が重複する場合は1件も追加しない）"""
+        records = [make_shift(**shift) for shift in shifts]
+        self.shifts.extend(records)
+        return records
+    
+    def add_time_request(self, employee_id, date, start_minutes, end_minutes):
+        """従業員のある日の時刻指定の希望を追加し、申請用シフトのIDを返す
+
+        同じ時間帯の希望は1つの申請用シフト（パターン）を共有する。割り当て変数は
+        希望を出した (従業員, 日) にだけ作り、必要人数の制約は付けない。
+        """
         # 終了時間が開始時間より前の場合は翌日とみなす
         if end_minutes < start_minutes:
             end_minutes += 24 * 60
-            
-        shift = {
-            'id': shift_id,
-            'name': name,
-            'start_minutes': start_minutes,
-            'end_minutes': end_minutes,
-            'duration': end_minutes - start_minutes,
-            'required_skills': required_skills,
-            'required_employees': required_employees,
-            'is_fixed': is_fixed
-        }
-        self.shifts.append(shift)
-        return shift
+        name = f"Request_{self._minutes_to_time(start_minutes)}-{self._minutes_to_time(end_minutes % (24 * 60))}"
+        shift = self.shifts.get_by_name(name)
+        if shift is None or not shift.get('request_only') or shift['end_minutes'] != end_minutes:
+            shift = self.add_shift(
+                shift_id=self.shifts.next_id(),
+                name=name,
+                start_time=start_minutes,
+                end_time=end_minutes,
+                required_skills=[],
+                required_employees=0,
+                is_fixed=True,
+                request_only=True
+            )
+        self.time_requests[(employee_id, date)] = shift['id']
+        return shift['id']
+    
+    def add_demand(self, start_time, end_time, required_employees, weekday=None, date=None):
+        """時間帯の必要人数（需要曲線）を追加する
+
+        weekday (0=月曜日) を指定するとその曜日だけ、date を指定するとその日だけ、どちらも
+        省略すると毎日に適用する。日付を指定した需要がある日は、その日付の需要だけを使う。
+        需要を1件でも追加すると需要曲線モードになり、シフトごとの必要人数の代わりに、
+        demand_bucket_minutes 分ごとの時間帯にその時間帯を通して勤務する人数（申請用シフトを含む）を数える。
+        """
+        demand = make_demand(start_time, end_time, required_employees, weekday, date)
+        self.demands.append(demand)
+        return demand
     
     def set_schedule_period(self, start_date, end_date):
-        """スケジュール期間を設定する"""
+        """スケジュール期間を設定する（終了日が開始日より前の場合は ValueError）"""
+        if end_date < start_date:
+            raise ValueError(f"終了日 ({end_date}) が開始日 ({start_date}) より前です")
         current_date = start_date
         self.days = []
         
@@ -92,179 +302,790 @@ class ShiftOptimizer:
             self.avoidance_pairs = []
         self.avoidance_pairs.append((employee1_id, employee2_id))
     
-    def setup_model(self):
-        """最適化モデルをセットアップする"""
+    def fix_assignment(self, employee_id, date, shift_id):
+        """従業員のある日の割り当てを固定する（shift_id が None の場合は休みに固定）"""
+        self.fixed_assignments[(employee_id, date)] = shift_id
+
+    def export_problem(self):
+        """問題データ（従業員・シフト・期間・回避ペア）をpickle可能な辞書で取得"""
+        return {
+            'employees': [dict(e) for e in self.employees],
+            'shifts': [dict(s) for s in self.shifts],
+            'days': [dict(d) for d in self.days],
+            'avoidance_pairs': list(getattr(self, 'avoidance_pairs', [])),
+            'week_origin': self.week_origin,
+            'fixed_assignments': dict(self.fixed_assignments),
+            'time_requests': dict(self.time_requests),
+            'demands': [dict(demand) for demand in self.demands],
+            'demand_bucket_minutes': self.demand_bucket_minutes,
+            'weekly_hours_window': self.weekly_hours_window,
+            'min_rest_hours': self.min_rest_hours
+        }
+
+    def load_problem(self, problem):
+        """export_problem() の辞書で問題データを置き換える（ベースモデルは可能なら再利用）"""
+        self.employees = EmployeeRegistry(
+            dict(e, unavailable_days=set(e['unavailable_days']), preferred_shifts=set(e['preferred_shifts']))
+            for e in problem['employees']
+        )
+        self.shifts = ShiftRegistry(dict(s) for s in problem['shifts'])
+        self.days = [dict(d) for d in problem['days']]
+        self.avoidance_pairs = list(problem.get('avoidance_pairs', []))
+        self.week_origin = problem.get('week_origin')
+        self.fixed_assignments = dict(problem.get('fixed_assignments', {}))
+        self.time_requests = dict(problem.get('time_requests', {}))
+        self.demands = [dict(demand) for demand in problem.get('demands', [])]
+        self.demand_bucket_minutes = problem.get('demand_bucket_minutes', 30)
+        self.weekly_hours_window = problem.get('weekly_hours_window', 'calendar')
+        self.min_rest_hours = problem.get('min_rest_hours', 0)
+
+    @classmethod
+    def from_problem(cls, problem, solver_config=None):
+        """export_problem() の辞書から最適化エンジンを復元する"""
+        optimizer = cls(solver_config=solver_config)
+        optimizer.load_problem(problem)
+        return optimizer
+
+    def get_base_fingerprint(self):
+        """ベースモデルの構造を決める入力（従業員の属性・シフト・期間）のフィンガープリント"""
+        key = (
+            tuple(
+                (e['id'], tuple(sorted(e['skills'])), e['max_hours_day'], e['max_hours_week'], e['max_consecutive_days'])
+                for e in self.employees
+            ),
+            tuple(
+                (s['id'], s['start_minutes'], s['end_minutes'], tuple(sorted(s['required_skills'])), s['required_employees'],
+                 s.get('request_only', False))
+                for s in self.shifts
+            ),
+            tuple(d['date'].isoformat() for d in self.days),
+            self._week_offset(),
+            tuple(sorted((str(emp_id), date.isoformat(), shift_id) for (emp_id, date), shift_id in self.time_requests.items())),
+            tuple(
+                (d['start_minutes'], d['end_minutes'], d['required_employees'], d['weekday'], str(d['date']))
+                for d in self.demands
+            ),
+            self.demand_bucket_minutes,
+            self.weekly_hours_window,
+            self.min_rest_hours
+        )
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+    def _week_offset(self):
+        """期間の初日が週の何日目か（週は week_origin の曜日から、None の場合は月曜日から始まる）"""
+        if not self.days:
+            return 0
+        if self.week_origin is None:
+            return self.days[0]['date'].weekday()
+        return (self.days[0]['date'] - self.week_origin).days % 7
+    
+    def _calendar_day_minutes(self):
+        """シフトごとの、開始日の0時までの勤務時間と翌日0時以降の勤務時間（分）"""
+        starts = np.array([shift["start_minutes"] for shift in self.shifts], dtype=np.int64)
+        ends = np.array([shift["end_minutes"] for shift in self.shifts], dtype=np.int64)
+        return np.minimum(ends, 24 * 60) - starts, np.maximum(ends - 24 * 60, 0)
+    
+    def _longest_day_minutes(self):
+        """シフトごとの、1つの暦日に入る勤務時間の最大値（分）。1日の上限時間と比べる値"""
+        same_day_minutes, next_day_minutes = self._calendar_day_minutes()
+        return np.maximum(same_day_minutes, next_day_minutes)
+    
+    def _rest_conflicts(self):
+        """最低休息時間を空けられない (前日のシフト, 翌日のシフト) の組の表
+        
+        翌日の相手が同じ前日のシフトをまとめ、(前日のシフト位置の配列, 翌日のシフト位置の配列) のリストで返す。
+        """
+        min_rest_minutes = int(self.min_rest_hours * 60)
+        if min_rest_minutes <= 0 or not self.shifts:
+            return []
+        starts = np.array([shift["start_minutes"] for shift in self.shifts], dtype=np.int64)
+        ends = np.array([shift["end_minutes"] for shift in self.shifts], dtype=np.int64)
+        # conflict[a, b]: 前日のシフト a の終了から翌日のシフト b の開始までが最低休息時間に満たない
+        conflict = 24 * 60 + starts[None, :] - ends[:, None] < min_rest_minutes
+        groups = defaultdict(list)
+        for a in np.flatnonzero(conflict.any(axis=1)).tolist():
+            groups[tuple(np.flatnonzero(conflict[a]).tolist())].append(a)
+        return [(np.array(first), np.array(following)) for following, first in groups.items()]
+    
+    def _compute_eligibility(self):
+        """スキル要件を満たし、1日の上限時間に収まる (従業員, シフト) の組み合わせを bool 配列で求める
+
+        日をまたぐシフトは、制約5と同じく0時までと0時以降をそれぞれの暦日の勤務時間として上限と比べる。
+        申請用シフトは含めない。
+        """
+        eligibility = np.zeros((len(self.employees), len(self.shifts)), dtype=bool)
+        longest_day_minutes = self._longest_day_minutes()
+        for e, employee in enumerate(self.employees):
+            skills = set(employee["skills"])
+            max_daily_minutes = employee["max_hours_day"] * 60
+            for s, shift in enumerate(self.shifts):
+                eligibility[e, s] = (
+                    not shift.get('request_only') and skills.issuperset(shift["required_skills"])
+                    and longest_day_minutes[s] <= max_daily_minutes
+                )
+        return eligibility
+    
+    def _time_request_positions(self):
+        """期間内の時刻指定の希望の (従業員, 日, シフト) 位置の配列"""
+        positions = [
+            (self._employee_pos[emp_id], self._day_pos[date], self._shift_pos[shift_id])
+            for (emp_id, date), shift_id in self.time_requests.items()
+            if emp_id in self._employee_pos and date in self._day_pos and shift_id in self._shift_pos
+        ]
+        return np.array(positions, dtype=np.int64).reshape(-1, 3).T
+    
+    def _demand_curve(self):
+        """需要曲線の時間帯ごとの必要人数（期間の初日0時からの時間帯の番号 → 人数）
+
+        日をまたぐ需要・シフトのため、期間の翌日の分まで含める。需要の開始・終了が
+        時間帯の途中の場合は、その時間帯全体を需要に含める。
+        """
+        bucket = self.demand_bucket_minutes
+        if (24 * 60) % bucket != 0:
+            raise ValueError(f"需要曲線の時間帯の幅は1日の分数を割り切れる値にしてください: {bucket}")
+        buckets_per_day = 24 * 60 // bucket
+        demand = np.zeros((len(self.days) + 1) * buckets_per_day, dtype=np.int64)
+        dated = {}
+        for entry in self.demands:
+            if entry['date'] is not None:
+                dated.setdefault(entry['date'], []).append(entry)
+        
+        for d, day in enumerate(self.days):
+            entries = dated.get(day['date']) or [
+                entry for entry in self.demands
+                if entry['date'] is None and entry['weekday'] in (None, day['weekday'])
+            ]
+            for entry in entries:
+                first = d * buckets_per_day + entry['start_minutes'] // bucket
+                last = d * buckets_per_day + -(-entry['end_minutes'] // bucket)
+                demand[first:last] = np.maximum(demand[first:last], entry['required_employees'])
+        return demand
+    
+    def _shift_buckets(self):
+        """シフトごとの、通して勤務する時間帯の範囲（その日の0時からの時間帯の番号 [first, last)）"""
+        bucket = self.demand_bucket_minutes
+        starts = np.array([shift["start_minutes"] for shift in self.shifts], dtype=np.int64)
+        ends = np.array([shift["end_minutes"] for shift in self.shifts], dtype=np.int64)
+        first = -(-starts // bucket)
+        return first, np.maximum(first, ends // bucket)
+    
+    def _demand_coverage(self, demand, days, shift_positions):
+        """(日, シフト) の配列が勤務する時間帯ごとの人数（差分の累積和で求める）"""
+        buckets_per_day = 24 * 60 // self.demand_bucket_minutes
+        first, last = self._shift_buckets()
+        delta = np.zeros(len(demand) + 1, dtype=np.int64)
+        starts = np.minimum(days * buckets_per_day + first[shift_positions], len(demand))
+        ends = np.minimum(days * buckets_per_day + last[shift_positions], len(demand))
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, ends, -1)
+        return np.cumsum(delta[:-1])
+    
+    def _demand_groups(self):
+        """需要曲線の制約をまとめたもの: (勤務する (日, シフト) の番号のタプル, 必要人数, 時間帯の数) のリスト
+
+        (日, シフト) の番号は 日 × シフト数 + シフト。需要のない時間帯と、変数のない
+        (日, シフト) は除く。同じ組み合わせ・同じ必要人数の時間帯は1つの制約にまとめる。
+        """
+        num_days = len(self.days)
+        num_shifts = len(self.shifts)
+        buckets_per_day = 24 * 60 // self.demand_bucket_minutes
+        demand = self._demand_curve()
+        
+        # (日, シフト) ごとの時間帯の範囲を展開した、時間帯と (日, シフト) の対応（接続行列）
+        first, last = self._shift_buckets()
+        has_vars = np.zeros(num_days * num_shifts, dtype=bool)
+        has_vars[self.var_d * num_shifts + self.var_s] = True
+        keys = np.flatnonzero(has_vars)
+        lengths = (last - first)[keys % num_shifts]
+        pair_keys = np.repeat(keys, lengths)
+        offsets = np.arange(len(pair_keys)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        buckets = (pair_keys // num_shifts) * buckets_per_day + first[pair_keys % num_shifts] + offsets
+        keep = buckets < len(demand)
+        buckets, pair_keys = buckets[keep], pair_keys[keep]
+        
+        covering = {}
+        for bucket, key in zip(buckets.tolist(), pair_keys.tolist()):
+            covering.setdefault(bucket, []).append(key)
+        
+        groups = {}
+        for bucket in np.flatnonzero(demand > 0).tolist():
+            group = (tuple(sorted(covering.get(bucket, ()))), int(demand[bucket]))
+            groups[group] = groups.get(group, 0) + 1
+        return [(pairs, required, weight) for (pairs, required), weight in groups.items()]
+    
+    def _build_index(self):
+        """モデル構築用の整数インデックス配列を事前に計算する"""
+        num_employees = len(self.employees)
+        num_days = len(self.days)
+        num_shifts = len(self.shifts)
+        
+        self._employee_pos = {employee["id"]: e for e, employee in enumerate(self.employees)}
+        self._shift_pos = {shift["id"]: s for s, shift in enumerate(self.shifts)}
+        self._day_pos = {day["date"]: d for d, day in enumerate(self.days)}
+        
+        self.eligibility = self._compute_eligibility()
+        
+        # 変数ごとの (従業員, 日, シフト) 位置。従業員 → 日 → シフトの順に並ぶ
+        # 申請用シフトは時刻指定の希望を出した (従業員, 日) にだけ変数を作る（1日の上限時間を超える希望は除く）
+        mask = np.repeat(self.eligibility[:, None, :], num_days, axis=1)
+        request_e, request_d, request_s = self._time_request_positions()
+        max_daily_minutes = np.array([employee["max_hours_day"] * 60 for employee in self.employees], dtype=np.int64)
+        within = self._longest_day_minutes()[request_s] <= max_daily_minutes[request_e]
+        mask[request_e[within], request_d[within], request_s[within]] = True
+        self.var_e, self.var_d, self.var_s = np.nonzero(mask)
+        
+        # (従業員, 日, シフト) → 変数番号 の密な対応表（変数がない場合は -1）
+        self.var_index = np.full((num_employees, num_days, num_shifts), -1, dtype=np.int64)
+        self.var_index[self.var_e, self.var_d, self.var_s] = np.arange(len(self.var_e))
+        
+        # (従業員, 日) ごとの変数範囲 (CSR形式): day_ptr[e * 日数 + d] から day_ptr[e * 日数 + d + 1] まで
+        self.day_ptr = np.searchsorted(self.var_e * num_days + self.var_d, np.arange(num_employees * num_days + 1))
+    
+    def _vars_at(self, positions):
+        """変数番号の配列から変数のリストを取得する"""
+        return self.assign_vars[positions].tolist()
+    
+    def setup_model(self, previous_result=None, change_penalty=5):
+        """最適化モデルをセットアップする
+
+        従業員・シフト・期間から決まるベースモデルはフィンガープリントが変わらない限り
+        再利用し、勤務不可日・バッティング回避・希望シフトなど実行ごとの差分だけを
+        ベースモデルの複製に追加する。previous_result を渡すと、その割り当てを
+        解のヒントとして読み込み、変更1件ごとに change_penalty のペナルティを与える。
+        """
+        fingerprint = self.get_base_fingerprint()
+        if self._base_model is None or fingerprint != self._base_fingerprint:
+            self._build_base_model()
+            self._base_fingerprint = fingerprint
+        
+        self.model = self._base_model.Clone()
+        self._apply_run_settings(previous_result, change_penalty)
+    
+    def _build_base_model(self):
+        """実行ごとに変わらない変数と制約（制約1・2・3・5・6）を構築する"""
+        self._build_index()
+        model = cp_model.CpModel()
+        
+        num_employees = len(self.employees)
+        num_days = len(self.days)
+        num_shifts = len(self.shifts)
+        var_e, var_d, var_s = self.var_e, self.var_d, self.var_s
+        
         # 変数: employee, day, shift の組み合わせに対する割り当て (0または1)
-        self.shift_vars = {}
+        # スキル要件を満たさない組み合わせは変数を作らない（制約3を兼ねる）
+        # 制約の種類ごとの変数・制約の数
+        self._base_model_stats = {}
+        counted = [0, 0]
+        
+        def count(family):
+            variables, constraints = _model_size(model)
+            self._base_model_stats[family] = {'variables': variables - counted[0], 'constraints': constraints - counted[1]}
+            counted[:] = [variables, constraints]
         
-        for employee in self.employees:
-            for day_idx, day in enumerate(self.days):
-                for shift in self.shifts:
-                    var_name = f'e{employee["id"]}_d{day_idx}_s{shift["id"]}'
-                    self.shift_vars[(employee["id"], day_idx, shift["id"])] = self.model.NewBoolVar(var_name)
+        employee_ids = [employee["id"] for employee in self.employees]
+        shift_ids = [shift["id"] for shift in self.shifts]
+        self.assign_vars = np.empty(len(var_e), dtype=object)
+        self.assign_vars[:] = [
+            model.NewBoolVar(f'e{employee_ids[e]}_d{d}_s{shift_ids[s]}')
+            for e, d, s in zip(var_e.tolist(), var_d.tolist(), var_s.tolist())
+        ]
+        # 割り当て変数のモデル内の番号（解の値を一括で取り出すため）
+        self.assign_index = np.array([var.Index() for var in self.assign_vars.tolist()], dtype=np.int64)
+        count('assignment')
         
         # 制約1: 各従業員は1日に最大1つのシフトのみ割り当て可能
-        for employee in self.employees:
-            for day_idx, _ in enumerate(self.days):
-                daily_shifts = []
-                for shift in self.shifts:
-                    daily_shifts.append(self.shift_vars[(employee["id"], day_idx, shift["id"])])
-                self.model.Add(sum(daily_shifts) <= 1)
+        # 勤務日変数 works[e, d] = その日のシフト変数の和 (0または1) として1回だけ結び付け、
+        # 日単位の制約（連続勤務日数など）はシフト変数ではなく勤務日変数で表す
+        day_counts = np.diff(self.day_ptr)
+        self.works = np.full(num_employees * num_days, None, dtype=object)
+        # シフト変数が1つだけの日はその変数をそのまま勤務日変数にする
+        single = np.flatnonzero(day_counts == 1)
+        self.works[single] = self.assign_vars[self.day_ptr[single]]
+        for key in np.flatnonzero(day_counts > 1).tolist():
+            works = model.NewBoolVar(f'works_e{employee_ids[key // num_days]}_d{key % num_days}')
+            model.Add(cp_model.LinearExpr.Sum(self._vars_at(slice(self.day_ptr[key], self.day_ptr[key + 1]))) == works)
+            self.works[key] = works
+        self.works = self.works.reshape(num_employees, num_days)
+        count('works_on_day')
         
         # 制約2: 各シフトには必要な人数を割り当てる（ソフト制約に変更）
         self.required_employees_violations = []
-        for day_idx, _ in enumerate(self.days):
-            for shift in self.shifts:
-                shift_employees = []
-                for employee in self.employees:
-                    shift_employees.append(self.shift_vars[(employee["id"], day_idx, shift["id"])])
-                
-                # ソフト制約: 違反すると大きなペナルティを与える
-                violation = self.model.NewIntVar(0, len(self.employees), f'violation_d{day_idx}_s{shift["id"]}')
-                self.model.Add(sum(shift_employees) + violation >= shift["required_employees"])
-                self.model.Add(sum(shift_employees) <= shift["required_employees"] + 2)  # 少し余裕を持たせる
-                
-                # 違反に大きな重みを付ける
-                self.required_employees_violations.append(violation * 1000)
+        # 不足変数1つが表す不足の数の重み（需要曲線モードでは同じ制約になる時間帯の数）
+        required_violation_weights = []
+        coverage_order = np.lexsort((var_e, var_s, var_d))
+        coverage_ptr = np.searchsorted((var_d * num_shifts + var_s)[coverage_order], np.arange(num_days * num_shifts + 1))
+        
+        if self.demands:
+            # 需要曲線モード: 時間帯ごとに、その時間帯を通して勤務する人数（申請用シフトを含む）を数える
+            # 勤務する (日, シフト) の組み合わせが同じ時間帯は同じ制約になるため、組み合わせと必要人数ごとに1つにまとめる
+            for pairs, required, weight in self._demand_groups():
+                positions = np.concatenate(
+                    [coverage_order[coverage_ptr[key]:coverage_ptr[key + 1]] for key in pairs] + [np.empty(0, dtype=np.int64)]
+                )
+                violation = model.NewIntVar(0, required, f'demand_violation_{len(self.required_employees_violations)}')
+                model.Add(cp_model.LinearExpr.Sum(self._vars_at(positions)) + violation >= required)
+                self.required_employees_violations.append(violation)
+                required_violation_weights.append(weight)
+        else:
+            for day_idx in range(num_days):
+                for s, shift in enumerate(self.shifts):
+                    # 申請用シフトは本人の希望なので必要人数の制約を付けない
+                    if shift.get('request_only'):
+                        continue
+                    required = shift["required_employees"]
+                    key = day_idx * num_shifts + s
+                    positions = coverage_order[coverage_ptr[key]:coverage_ptr[key + 1]]
+                    shift_employees = cp_model.LinearExpr.Sum(self._vars_at(positions))
+                    
+                    # ソフト制約: 違反すると大きなペナルティを与える
+                    if required > 0:
+                        violation = model.NewIntVar(0, required, f'violation_d{day_idx}_s{shift["id"]}')
+                        model.Add(shift_employees + violation >= required)
+                        self.required_employees_violations.append(violation)
+                        required_violation_weights.append(1)
+                    if len(positions) > required + 2:
+                        model.Add(shift_employees <= required + 2)  # 少し余裕を持たせる
+        self.required_violation_index = np.array(
+            [violation.Index() for violation in self.required_employees_violations], dtype=np.int64
+        )
+        self.required_violation_weights = np.array(required_violation_weights, dtype=np.int64)
+        count('required_employees')
         
         # 制約3: スキル要件を満たす（これはハード制約のまま）
-        for day_idx, _ in enumerate(self.days):
-            for shift in self.shifts:
-                if shift["required_skills"]:
-                    for employee in self.employees:
-                        has_required_skills = all(skill in employee["skills"] for skill in shift["required_skills"])
-                        if not has_required_skills:
-                            # 必要なスキルがない従業員はそのシフトに割り当てられない
-                            self.model.Add(self.shift_vars[(employee["id"], day_idx, shift["id"])] == 0)
+        # 要件を満たさない組み合わせには変数を作成していないため、追加の制約は不要
         
-        # 制約4: 勤務不可日（ソフト制約に変更）
-        self.unavailable_violations = []
-        for employee in self.employees:
-            for day_idx, day in enumerate(self.days):
-                if day["date"] in employee["unavailable_days"]:
-                    for shift in self.shifts:
-                        # 勤務不可日の割り当ては避けるが、絶対に不可ではない
-                        violation_var = self.shift_vars[(employee["id"], day_idx, shift["id"])]
-                        self.unavailable_violations.append(violation_var * 500)  # 500は重み
-        
-        # 制約5: 1週間の最大勤務時間（ハード制約のまま）
-        for employee in self.employees:
+        # 制約5: 1日・1週間の最大勤務時間（ハード制約のまま）
+        # 日をまたぐシフトは0時までをその日、0時以降を翌日の勤務時間として暦日ごとに数える
+        same_day_minutes, next_day_minutes = self._calendar_day_minutes()
+        var_same_day = same_day_minutes[var_s]
+        var_next_day = next_day_minutes[var_s]
+        # 従業員・暦日ごとの勤務時間の最大値（その日に始まるシフトと前日からのシフトの最大値の和）
+        max_same_day = np.zeros(num_employees * num_days, dtype=np.int64)
+        np.maximum.at(max_same_day, var_e * num_days + var_d, var_same_day)
+        max_next_day = np.zeros(num_employees * num_days, dtype=np.int64)
+        np.maximum.at(max_next_day, var_e * num_days + var_d, var_next_day)
+        max_day_minutes = max_same_day.reshape(num_employees, num_days)
+        max_day_minutes[:, 1:] += max_next_day.reshape(num_employees, num_days)[:, :-1]
+        
+        def day_minutes(e, d):
+            """従業員 e の暦日 d の勤務時間（分）の式"""
+            key = e * num_days + d
+            positions = np.arange(self.day_ptr[key], self.day_ptr[key + 1])
+            weights = var_same_day[positions]
+            if d > 0:
+                previous = np.arange(self.day_ptr[key - 1], self.day_ptr[key])
+                previous = previous[var_next_day[previous] > 0]
+                positions = np.concatenate([positions, previous])
+                weights = np.concatenate([weights, var_next_day[previous]])
+            return cp_model.LinearExpr.WeightedSum(self._vars_at(positions), weights.tolist())
+        
+        # 1日の上限。1つで暦日の上限を超えるシフトは変数を作っていないため（_compute_eligibility）、
+        # 前日からのシフトと重なる日（2日目以降）が対象
+        # 1日に始まるシフトは高々1つなので、前日のシフトと合わせて上限を超える組を同時に選べないようにする
+        # （重なるシフトが同じ前日のシフトどうしは1つの AtMostOne にまとめる）
+        for e, employee in enumerate(self.employees):
+            max_daily_minutes = employee["max_hours_day"] * 60
+            for d in (np.flatnonzero(max_day_minutes[e, 1:] > max_daily_minutes) + 1).tolist():
+                key = e * num_days + d
+                today = np.arange(self.day_ptr[key], self.day_ptr[key + 1])
+                previous = np.arange(self.day_ptr[key - 1], self.day_ptr[key])
+                conflicts = defaultdict(list)
+                for position in previous[var_next_day[previous] > 0].tolist():
+                    over = today[var_same_day[today] > max_daily_minutes - var_next_day[position]]
+                    if len(over):
+                        conflicts[tuple(over.tolist())].append(position)
+                for over, positions in conflicts.items():
+                    model.AddAtMostOne(self._vars_at(np.array(positions + list(over))))
+        count('max_hours_day')
+        
+        # 1週間の上限: 暦週（week_origin の曜日、既定では月曜日始まり）または任意の連続7日間
+        # どのように割り当てても上限を超えない期間は制約不要
+        week_offset = self._week_offset()
+        if self.weekly_hours_window == 'rolling':
+            periods = [(d, min(d + 7, num_days)) for d in range(max(1, num_days - 6))]
+        else:
+            periods = [
+                (max(0, week * 7 - week_offset), min(num_days, (week + 1) * 7 - week_offset))
+                for week in range((num_days + week_offset + 6) // 7)
+            ]
+        periods = np.array(periods, dtype=np.int64).reshape(-1, 2)
+        max_cumulative = np.zeros((num_employees, num_days + 1), dtype=np.int64)
+        np.cumsum(max_day_minutes, axis=1, out=max_cumulative[:, 1:])
+        for e, employee in enumerate(self.employees):
             max_weekly_minutes = employee["max_hours_week"] * 60
+            limited = periods[
+                max_cumulative[e, periods[:, 1]] - max_cumulative[e, periods[:, 0]] > max_weekly_minutes
+            ].tolist()
+            if not limited:
+                continue
             
-            for week_start in range(0, len(self.days), 7):
-                week_end = min(week_start + 7, len(self.days))
-                weekly_work_minutes = []
-                
-                for day_idx in range(week_start, week_end):
-                    for shift in self.shifts:
-                        work_minutes = self.shift_vars[(employee["id"], day_idx, shift["id"])] * shift["duration"]
-                        weekly_work_minutes.append(work_minutes)
-                
-                self.model.Add(sum(weekly_work_minutes) <= max_weekly_minutes)
+            if self.weekly_hours_window != 'rolling':
+                # 暦週は重ならないため、日ごとの式をそのまま足す
+                for first, last in limited:
+                    model.Add(cp_model.LinearExpr.Sum([day_minutes(e, d) for d in range(first, last)]) <= max_weekly_minutes)
+                continue
+            
+            # 連続7日間は重なるため、勤務時間の累積和の変数を1日1つ作り、区間の上限は累積和の差で表す
+            first_day = min(first for first, _ in limited)
+            last_day = max(last for _, last in limited)
+            cumulative = {first_day: 0}
+            for d in range(first_day, last_day):
+                cumulative[d + 1] = model.NewIntVar(
+                    0, int(max_cumulative[e, d + 1] - max_cumulative[e, first_day]),
+                    f'minutes_e{employee_ids[e]}_upto_d{d}'
+                )
+                model.Add(cumulative[d + 1] == cumulative[d] + day_minutes(e, d))
+            for first, last in limited:
+                model.Add(cumulative[last] - cumulative[first] <= max_weekly_minutes)
+        count('max_hours_week')
         
         # 制約6: 連続勤務日数の上限（ハード制約のまま）
-        for employee in self.employees:
+        # 勤務できる日（シフト変数がある日）の数の累積和。窓内の勤務できる日が上限以下なら制約不要
+        workable = np.zeros((num_employees, num_days + 1), dtype=np.int64)
+        np.cumsum(day_counts.reshape(num_employees, num_days) > 0, axis=1, out=workable[:, 1:])
+        for e, employee in enumerate(self.employees):
             max_consecutive = employee["max_consecutive_days"]
             
-            for start_idx in range(len(self.days) - max_consecutive):
-                consecutive_days = []
-                
-                for day_offset in range(max_consecutive + 1):
-                    day_shifts = []
-                    for shift in self.shifts:
-                        day_shifts.append(self.shift_vars[(employee["id"], start_idx + day_offset, shift["id"])])
-                    # その日に勤務するかどうか
-                    consecutive_days.append(sum(day_shifts))
-                
+            for start_idx in range(num_days - max_consecutive):
                 # max_consecutive + 1日連続で勤務しないようにする
-                self.model.Add(sum(consecutive_days) <= max_consecutive)
+                end_idx = start_idx + max_consecutive + 1
+                if workable[e, end_idx] - workable[e, start_idx] <= max_consecutive:
+                    continue
+                works = [var for var in self.works[e, start_idx:end_idx].tolist() if var is not None]
+                model.Add(cp_model.LinearExpr.Sum(works) <= max_consecutive)
+        count('max_consecutive_days')
+        
+        # 制約7: 最低休息時間（ハード制約）
+        # 1日に始まるシフトは高々1つなので、休息が足りない組の表の各グループを1つの AtMostOne にする
+        for first_shifts, following_shifts in self._rest_conflicts():
+            first = self.var_index[:, :-1, first_shifts]
+            following = self.var_index[:, 1:, following_shifts]
+            active = (first >= 0).any(axis=2) & (following >= 0).any(axis=2)
+            for e, d in zip(*np.nonzero(active)):
+                positions = np.concatenate([first[e, d], following[e, d]])
+                model.AddAtMostOne(self._vars_at(positions[positions >= 0]))
+        count('min_rest')
+        
+        self._base_model = model
+    
+    def _schedule_assignment(self, schedule):
+        """スケジュール（Schedule または従来の辞書形式）を (従業員, 日) → シフト位置 の配列に変換する
+
+        戻り値は (割り当て配列, スケジュールに含まれるかどうかの配列)。休みは -1。
+        この問題にない従業員・日・シフトは無視する。
+        """
+        employee_pos = {employee["id"]: e for e, employee in enumerate(self.employees)}
+        day_pos = {day["date"]: d for d, day in enumerate(self.days)}
+        shift_pos = {shift["id"]: s for s, shift in enumerate(self.shifts)}
+        assignment = np.full((len(self.employees), len(self.days)), -1, dtype=np.int64)
+        known = np.zeros((len(self.employees), len(self.days)), dtype=bool)
+        
+        if isinstance(schedule, Schedule):
+            # 従業員・日・シフトの位置を対応付けて配列ごと変換する
+            rows = np.array([employee_pos.get(emp_id, -1) for emp_id in schedule.employee_ids], dtype=np.int64)
+            columns = np.array([day_pos.get(day["date"], -1) for day in schedule.days], dtype=np.int64)
+            # 休み (-1) は末尾の -1 に対応する
+            shift_map = np.array([shift_pos.get(shift["id"], -1) for shift in schedule.shifts] + [-1], dtype=np.int64)
+            valid_rows = np.flatnonzero(rows >= 0)
+            valid_columns = np.flatnonzero(columns >= 0)
+            target = np.ix_(rows[valid_rows], columns[valid_columns])
+            assignment[target] = shift_map[schedule.assignment[np.ix_(valid_rows, valid_columns)]]
+            known[target] = True
+            return assignment, known
+        
+        for emp_id, employee_schedule in schedule.items():
+            if emp_id not in employee_pos:
+                continue
+            e = employee_pos[emp_id]
+            for day_data in employee_schedule:
+                if day_data['date'] not in day_pos:
+                    continue
+                d = day_pos[day_data['date']]
+                known[e, d] = True
+                if day_data['shift'] is not None and day_data['shift']['id'] in shift_pos:
+                    assignment[e, d] = shift_pos[day_data['shift']['id']]
+        
+        return assignment, known
+    
+    def _request_masks(self):
+        """勤務不可日 (従業員 × 日) と希望シフト (従業員 × シフト) のビットマップ"""
+        day_pos = {day["date"]: d for d, day in enumerate(self.days)}
+        shift_pos = {shift["id"]: s for s, shift in enumerate(self.shifts)}
+        unavailable = np.zeros((len(self.employees), len(self.days)), dtype=bool)
+        preferred = np.zeros((len(self.employees), len(self.shifts)), dtype=bool)
+        for e, employee in enumerate(self.employees):
+            unavailable[e, [day_pos[date] for date in employee["unavailable_days"] if date in day_pos]] = True
+            preferred[e, [shift_pos[shift_id] for shift_id in employee["preferred_shifts"] if shift_id in shift_pos]] = True
+        return unavailable, preferred
+    
+    def _interchangeable_employees(self, preferred):
+        """入れ替えても制約・目的関数が変わらない従業員のグループ（位置の配列のリスト、2人以上のみ）
+
+        スキル・勤務時間と連続勤務日数の上限が同じで、期間内の勤務不可日・希望シフト・
+        時刻指定の希望・固定された割り当てがなく、バッティング回避ペアにも含まれない従業員をまとめる。
+        """
+        excluded = self.unavailable_mask.any(axis=1) | preferred.any(axis=1)
+        excluded[self._time_request_positions()[0]] = True
+        for emp_id, date in self.fixed_assignments:
+            if emp_id in self._employee_pos and date in self._day_pos:
+                excluded[self._employee_pos[emp_id]] = True
+        for pair in getattr(self, 'avoidance_pairs', []):
+            for emp_id in pair:
+                if emp_id in self._employee_pos:
+                    excluded[self._employee_pos[emp_id]] = True
+        
+        groups = {}
+        for e, employee in enumerate(self.employees):
+            if excluded[e]:
+                continue
+            key = (frozenset(employee["skills"]), employee["max_hours_day"], employee["max_hours_week"],
+                   employee["max_consecutive_days"])
+            groups.setdefault(key, []).append(e)
+        return [np.array(members, dtype=np.int64) for members in groups.values() if len(members) > 1]
+    
+    def _assignment_from_values(self, values):
+        """解の変数値の配列から (従業員, 日) → シフト位置 の配列（休みは -1）を作る"""
+        chosen = np.flatnonzero(values[self.assign_index] == 1)
+        assignment = np.full((len(self.employees), len(self.days)), -1, dtype=np.int32)
+        assignment[self.var_e[chosen], self.var_d[chosen]] = self.var_s[chosen]
+        return assignment
+    
+    def _make_schedule(self, assignment):
+        """(従業員, 日) → シフト位置 の配列から結果のスケジュールを作る"""
+        return Schedule(assignment, [employee["id"] for employee in self.employees], self.days, self.shifts)
+    
+    def _apply_run_settings(self, previous_result=None, change_penalty=5):
+        """実行ごとの差分（勤務不可日・バッティング回避・希望シフト・前回の解・目的関数）を追加する"""
+        num_days = len(self.days)
+        var_e, var_d, var_s = self.var_e, self.var_d, self.var_s
+        shift_ids = [shift["id"] for shift in self.shifts]
+        
+        # 制約の種類ごとの変数・制約の数（ベースモデルの分を含む）
+        families = {family: dict(counts) for family, counts in self._base_model_stats.items()}
+        counted = list(_model_size(self.model))
+        
+        def count(family):
+            variables, constraints = _model_size(self.model)
+            families[family] = {'variables': variables - counted[0], 'constraints': constraints - counted[1]}
+            counted[:] = [variables, constraints]
+        
+        # 割り当て変数ごとの目的関数の係数
+        coefficients = np.zeros(len(var_e), dtype=np.int64)
+        
+        # 制約4: 勤務不可日（ソフト制約に変更）
+        self.unavailable_mask, preferred = self._request_masks()
+        self.unavailable_positions = np.flatnonzero(self.unavailable_mask[var_e, var_d])
+        # 勤務不可日の割り当ては避けるが、絶対に不可ではない
+        coefficients[self.unavailable_positions] -= self.UNAVAILABLE_WEIGHT
+        self.unavailable_violations = self._vars_at(self.unavailable_positions)
         
         # 制約7: バッティング回避（ソフト制約に変更）
         self.avoidance_violations = []
         if hasattr(self, 'avoidance_pairs'):
             for emp1_id, emp2_id in self.avoidance_pairs:
-                for day_idx, _ in enumerate(self.days):
-                    for shift in self.shifts:
-                        # 同時勤務の回避をソフト制約に
-                        violation = self.model.NewBoolVar(f'avoid_{emp1_id}_{emp2_id}_d{day_idx}_s{shift["id"]}')
-                        self.model.Add(
-                            self.shift_vars[(emp1_id, day_idx, shift["id"])] + 
-                            self.shift_vars[(emp2_id, day_idx, shift["id"])] <= 1 + violation
-                        )
-                        self.avoidance_violations.append(violation * 300)  # 300は重み
+                if emp1_id not in self._employee_pos or emp2_id not in self._employee_pos:
+                    continue
+                e1 = self._employee_pos[emp1_id]
+                e2 = self._employee_pos[emp2_id]
+                # 両者とも割り当て変数がある (日, シフト) のみが対象（申請用シフトは希望を出した日だけ）
+                common = (self.var_index[e1] >= 0) & (self.var_index[e2] >= 0)
+                
+                for day_idx, s in zip(*np.nonzero(common)):
+                    # 同時勤務の回避をソフト制約に
+                    violation = self.model.NewBoolVar(f'avoid_{emp1_id}_{emp2_id}_d{day_idx}_s{shift_ids[s]}')
+                    self.model.Add(
+                        self.assign_vars[self.var_index[e1, day_idx, s]] +
+                        self.assign_vars[self.var_index[e2, day_idx, s]] <= 1 + violation
+                    )
+                    self.avoidance_violations.append(violation)
+        count('avoidance')
         
         # 目的関数: 希望シフトへの割り当てを最大化 + 制約違反のペナルティを最小化
-        preferences = []
+        coefficients[preferred[var_e, var_s]] += self.PREFERENCE_WEIGHT
         
-        for employee in self.employees:
-            for day_idx, _ in enumerate(self.days):
-                for shift in self.shifts:
-                    if shift["id"] in employee["preferred_shifts"]:
-                        preferences.append(self.shift_vars[(employee["id"], day_idx, shift["id"])] * 10)  # 10は重み
+        # 固定された割り当て: 変数の値を固定する
+        for (emp_id, date), shift_id in self.fixed_assignments.items():
+            if emp_id not in self._employee_pos or date not in self._day_pos:
+                continue
+            key = self._employee_pos[emp_id] * num_days + self._day_pos[date]
+            for position in range(self.day_ptr[key], self.day_ptr[key + 1]):
+                is_fixed_shift = shift_id is not None and shift_ids[var_s[position]] == shift_id
+                self.model.Add(self.assign_vars[position] == int(is_fixed_shift))
+        count('fixed_assignments')
+        
+        # 対称性の除去: 入れ替え可能な従業員は、初日の割り当て（シフトの登録順、休みは最後）の順に並べる
+        # 勤務時間の合計で並べる制約より探索の妨げが少ない
+        # 前回の解のヒント・変更のペナルティは従業員ごとに異なるため、その場合は付けない
+        has_previous = previous_result is not None and previous_result.get('status') == 'success'
+        if self.symmetry_breaking and not has_previous and self.days:
+            for members in self._interchangeable_employees(preferred):
+                values = []
+                for e in members.tolist():
+                    positions = slice(self.day_ptr[e * num_days], self.day_ptr[e * num_days + 1])
+                    values.append(cp_model.LinearExpr.WeightedSum(
+                        self._vars_at(positions), (len(self.shifts) - var_s[positions]).tolist()
+                    ))
+                for first, second in zip(values, values[1:]):
+                    self.model.Add(first >= second)
+        count('symmetry_breaking')
+        self.model_stats = {'variables': counted[0], 'constraints': counted[1], 'families': families}
+        
+        # 前回の解: ヒントとして読み込み、割り当ての変更にペナルティを与える（最小変更）
+        if has_previous:
+            assignment, known = self._schedule_assignment(previous_result['schedule'])
+            was_assigned = assignment[var_e, var_d] == var_s
+            for var, value in zip(self.assign_vars.tolist(), was_assigned.tolist()):
+                self.model.AddHint(var, value)
+            
+            # 前回の結果に含まれる (従業員, 日) のみが対象。定数項は目的関数から省く
+            if change_penalty:
+                was_known = known[var_e, var_d]
+                coefficients[was_known & was_assigned] += change_penalty
+                coefficients[was_known & ~was_assigned] -= change_penalty
         
         # 目的関数 = 希望シフトの割り当て - 制約違反のペナルティ
-        violations = (
-            self.required_employees_violations + 
-            self.unavailable_violations + 
+        weighted_positions = np.flatnonzero(coefficients)
+        terms = (
+            self._vars_at(weighted_positions) +
+            self.required_employees_violations +
             self.avoidance_violations
         )
+        weights = (
+            coefficients[weighted_positions].tolist() +
+            (-self.REQUIRED_EMPLOYEES_WEIGHT * self.required_violation_weights).tolist() +
+            [-self.AVOIDANCE_WEIGHT] * len(self.avoidance_violations)
+        )
+        
+        self.model.Maximize(cp_model.LinearExpr.WeightedSum(terms, weights))
+    
+    def _configure_solver(self, solver_config=None):
+        """ソルバーのパラメータを設定する（省略時は self.solver_config）"""
+        if solver_config is None:
+            solver_config = self.solver_config
+        solver_config.apply(self.solver)
+        return solver_config
+    
+    def get_cache_key(self, previous_result=None, change_penalty=5, solver_config=None):
+        """問題データ・ソルバーパラメータ・前回の解から結果キャッシュのキーを求める"""
+        solver_config = self._configure_solver(solver_config)
+        # ログの出力先は結果に影響しないためキーに含めない
+        solver_params = {key: value for key, value in solver_config.to_dict().items() if key != 'log_to'}
         
-        self.model.Maximize(sum(preferences) - sum(violations))
+        extra = None
+        if previous_result is not None and previous_result.get('status') == 'success':
+            previous_schedule = sorted(
+                (str(emp_id), str(day_data['date']), day_data['shift']['id'] if day_data['shift'] else None)
+                for emp_id, employee_schedule in previous_result['schedule'].items()
+                for day_data in employee_schedule
+            )
+            extra = {'previous_schedule': previous_schedule, 'change_penalty': change_penalty}
+        
+        return make_cache_key(self.export_problem(), solver_params, extra)
     
-    def solve(self):
-        """最適化問題を解く"""
-        self.setup_model()
+    def solve(self, previous_result=None, change_penalty=5, solver_config=None, progress_callback=None):
+        """最適化問題を解く
+
+        previous_result に以前の solve() の戻り値を渡すと、その解から探索を始め、
+        割り当ての変更が少ない解を優先する（change_penalty=0 でヒントのみ）。
+        solver_config を渡すと、この実行に限り self.solver_config の代わりに使う。
+        progress_callback を渡すと、改善解が見つかるたびに進捗の辞書
+        （solution_index, objective_value, best_bound, gap, elapsed, violations と、その時点の schedule）で呼び出す。
+        探索を途中で打ち切った場合（stop_event）も、それまでの最良解を返す。
+        """
+        timer = PhaseTimer()
+        solver_config = self._configure_solver(solver_config)
         
-        # ソルバーのパラメータを設定
-        self.solver.parameters.linearization_level = 0
-        self.solver.parameters.max_time_in_seconds = 60.0  # 解探索の時間制限（必要に応じて調整）
+        # 同じ入力の結果がキャッシュにあればそのまま返す
+        cache_key = None
+        if self.cache is not None:
+            with timer.phase('cache_lookup'):
+                cache_key = self.get_cache_key(previous_result, change_penalty, solver_config)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                cached['metrics'] = {'cache_hit': True, 'phases': timer.to_dict(), 'peak_rss_bytes': peak_rss_bytes()}
+                return cached
         
-        # 問題の複雑さに応じてヒントを追加
-        # ランダムシードの設定（異なる解を得るため）
-        self.solver.parameters.random_seed = 42
+        with timer.phase('model_build'):
+            self.setup_model(previous_result, change_penalty)
         
-        # より多様な解を探すための設定
-        self.solver.parameters.num_search_workers = 8  # 並列ワーカー数（CPUコア数に合わせて調整）
-        self.solver.parameters.log_search_progress = True  # 検索の進捗をログに出力
+        # presolve の時間を求めるため、ログを出力しない設定でもログを生成して読み取る
+        log_listener = _SolverLogListener(self.solver.log_callback)
+        self.solver.parameters.log_search_progress = True
+        self.solver.log_callback = log_listener
         
-        status = self.solver.Solve(self.model)
+        finished = threading.Event()
+        if self.stop_event is not None:
+            watcher = threading.Thread(
+                target=_watch_stop_event,
+                args=(self.stop_event, self.solver, finished),
+                daemon=True
+            )
+            watcher.start()
+        try:
+            with timer.phase('solve'):
+                if progress_callback is not None:
+                    status = self.solver.Solve(self.model, _ProgressCallback(self, progress_callback))
+                else:
+                    status = self.solver.Solve(self.model)
+        finally:
+            finished.set()
+        
+        response = self.solver.ResponseProto()
+        solver_stats = {
+            'status': self.solver.StatusName(status),
+            'wall_time': response.wall_time,
+            'user_time': response.user_time,
+            'deterministic_time': response.deterministic_time,
+            'num_branches': response.num_branches,
+            'num_conflicts': response.num_conflicts,
+            'num_booleans': response.num_booleans
+        }
+        if log_listener.search_start is not None:
+            solver_stats['presolve_time'] = log_listener.search_start
+            solver_stats['search_time'] = max(0.0, response.wall_time - log_listener.search_start)
+        
+        run_metrics = {
+            'cache_hit': False,
+            'model': self.model_stats,
+            'solver': solver_stats,
+            'peak_rss_bytes': peak_rss_bytes()
+        }
         
         if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-            # スケジュールの解を取得
-            schedule = {}
-            
-            for employee in self.employees:
-                employee_schedule = []
+            with timer.phase('extract'):
+                # 解の値を一括で取得し、(従業員, 日) → シフト位置 の配列にする
+                values = np.fromiter(response.solution, dtype=np.int64, count=len(response.solution))
+                schedule = self._make_schedule(self._assignment_from_values(values))
                 
-                for day_idx, day in enumerate(self.days):
-                    assigned_shift = None
-                    
-                    for shift in self.shifts:
-                        if self.solver.Value(self.shift_vars[(employee["id"], day_idx, shift["id"])]) == 1:
-                            assigned_shift = shift
-                            break
-                    
-                    employee_schedule.append({
-                        'date': day["date"],
-                        'weekday': day["weekday"],
-                        'shift': assigned_shift
-                    })
-                
-                schedule[employee["id"]] = employee_schedule
-            
-            # 制約違反の集計
-            violations_summary = {
-                'required_employees_violations': sum(self.solver.Value(v) for v in self.required_employees_violations),
-                'unavailable_violations': sum(self.solver.Value(v) for v in self.unavailable_violations) / 500,  # 重みで割る
-                'avoidance_violations': sum(self.solver.Value(v) for v in self.avoidance_violations) / 300  # 重みで割る
-            }
+                # 制約違反の集計
+                violations_summary = {
+                    'required_employees_violations': int(
+                        (values[self.required_violation_index] * self.required_violation_weights).sum()
+                    ),
+                    'unavailable_violations': int(values[self.assign_index[self.unavailable_positions]].sum()),
+                    'avoidance_violations': int(values[
+                        np.array([violation.Index() for violation in self.avoidance_violations], dtype=np.int64)
+                    ].sum())
+                }
             
-            return {
+            result = {
                 'status': 'success',
                 'schedule': schedule,
                 'objective_value': self.solver.ObjectiveValue(),
-                'violations': violations_summary
+                'violations': violations_summary,
+                'metrics': dict(run_metrics, phases=timer.to_dict())
             }
+            if previous_result is not None and previous_result.get('status') == 'success':
+                # ソルバーの目的関数値は変更のペナルティを含むため、前回の解がない場合と同じ値に計算し直す
+                result['objective_value'] = self.evaluate_schedule(schedule)['objective_value']
+                result['changed_assignments'] = self.count_changes(schedule, previous_result)
+            
+            # 途中で打ち切った解は同じ入力の最終結果とは限らないため保存しない
+            stopped = self.stop_event is not None and self.stop_event.is_set()
+            if cache_key is not None and not stopped:
+                self.cache.put(cache_key, result)
+            
+            return result
         else:
             # 問題が解決できなかった場合のデバッグ情報
             debug_info = {
@@ -278,8 +1099,299 @@ class ShiftOptimizer:
             return {
                 'status': 'failed',
                 'reason': f'Solver status: {status}',
-                'debug_info': debug_info
+                'debug_info': debug_info,
+                'metrics': dict(run_metrics, phases=timer.to_dict())
+            }
+    
+    def iter_solve(self, previous_result=None, change_penalty=5, solver_config=None):
+        """最適化を別スレッドで実行し、改善解ごとに ('solution', 進捗) を、最後に ('result', 結果) を返す
+
+        途中でイテレーションをやめる（break する）と探索を打ち切る。
+        """
+        events = queue.Queue()
+        
+        def run():
+            try:
+                result = self.solve(previous_result, change_penalty, solver_config,
+                                    progress_callback=lambda progress: events.put(('solution', progress)))
+                events.put(('result', result))
+            except Exception as e:
+                events.put(('error', e))
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                kind, payload = events.get()
+                if kind == 'error':
+                    raise payload
+                yield kind, payload
+                if kind == 'result':
+                    return
+        finally:
+            # 探索開始前に停止を要求した場合に備えて、終了するまで繰り返し停止させる
+            while thread.is_alive():
+                self.solver.StopSearch()
+                thread.join(0.1)
+    
+    def evaluate_schedule(self, schedule):
+        """スケジュールの制約違反数と目的関数値（前回の解との差分項を除く）を計算する"""
+        employee_pos = {employee["id"]: e for e, employee in enumerate(self.employees)}
+        num_days = len(self.days)
+        num_shifts = len(self.shifts)
+        
+        # (従業員, 日) → シフト位置（休みは -1）
+        assignment, _ = self._schedule_assignment(schedule)
+        assigned_e, assigned_d = np.nonzero(assignment >= 0)
+        assigned_s = assignment[assigned_e, assigned_d]
+        
+        # 必要人数の不足（需要曲線モードでは時間帯ごとの不足の合計）
+        if self.demands:
+            demand = self._demand_curve()
+            coverage = self._demand_coverage(demand, assigned_d, assigned_s)
+            required_violations = int(np.maximum(demand - coverage, 0).sum())
+        else:
+            counts = np.zeros((num_days, num_shifts), dtype=np.int64)
+            np.add.at(counts, (assigned_d, assigned_s), 1)
+            required = np.array([shift["required_employees"] for shift in self.shifts], dtype=np.int64)
+            required_violations = int(np.maximum(required[None, :] - counts, 0).sum())
+        
+        # 勤務不可日の出勤と希望シフトへの割り当て
+        unavailable, preferred = self._request_masks()
+        unavailable_violations = int(np.count_nonzero(unavailable[assigned_e, assigned_d]))
+        preferences = int(np.count_nonzero(preferred[assigned_e, assigned_s]))
+        
+        # バッティング回避の違反
+        avoidance_violations = 0
+        for emp1_id, emp2_id in getattr(self, 'avoidance_pairs', []):
+            if emp1_id not in employee_pos or emp2_id not in employee_pos:
+                continue
+            shifts1 = assignment[employee_pos[emp1_id]]
+            shifts2 = assignment[employee_pos[emp2_id]]
+            avoidance_violations += int(np.count_nonzero((shifts1 >= 0) & (shifts1 == shifts2)))
+        
+        objective_value = (
+            self.PREFERENCE_WEIGHT * preferences -
+            self.REQUIRED_EMPLOYEES_WEIGHT * required_violations -
+            self.UNAVAILABLE_WEIGHT * unavailable_violations -
+            self.AVOIDANCE_WEIGHT * avoidance_violations
+        )
+        
+        return {
+            'objective_value': float(objective_value),
+            'violations': {
+                'required_employees_violations': required_violations,
+                'unavailable_violations': unavailable_violations,
+                'avoidance_violations': avoidance_violations
+            }
+        }
+    
+    def count_changes(self, schedule, previous_result):
+        """前回の結果から割り当てが変わった (従業員, 日) の数（前回の結果に含まれる日のみ数える）"""
+        assignment, _ = self._schedule_assignment(schedule)
+        previous_assignment, known = self._schedule_assignment(previous_result['schedule'])
+        return int(np.count_nonzero(known & (assignment != previous_assignment)))
+    
+    def solve_rolling_horizon(self, window_days=14, overlap_days=None, previous_result=None, change_penalty=5,
+                              solver_config=None, progress_callback=None):
+        """期間を重なりのある区間に分割して順に解く（長期間向け）
+
+        各区間は window_days 日で、最後の overlap_days 日（既定は最大連続勤務日数）は
+        次の区間で解き直す。確定済みの直前の日は次の区間に固定値として含めるため、
+        連続勤務日数と週の勤務時間の制約は区間の境界をまたいでも守られる。
+        progress_callback には区間ごとの改善解の進捗が 'window'（区間の番号）付きで渡される。
+        """
+        if overlap_days is None:
+            overlap_days = max([employee["max_consecutive_days"] for employee in self.employees], default=1)
+        overlap_days = max(1, overlap_days)
+        if window_days <= overlap_days:
+            raise ValueError(f"区間の日数 ({window_days}) は重なりの日数 ({overlap_days}) より長くしてください")
+        
+        # 区間の先頭に固定値として含める日数（連続勤務日数と、週の勤務時間のため最低6日）
+        # 日をまたぐシフトがある場合は、固定した最初の日に前日から入る勤務時間も数えるため1日多く含める
+        max_consecutive = max([employee["max_consecutive_days"] for employee in self.employees], default=0)
+        overnight = any(shift["end_minutes"] > 24 * 60 for shift in self.shifts)
+        history_days = max(overlap_days, max_consecutive, 7 if overnight else 6)
+        num_days = len(self.days)
+        problem = self.export_problem()
+        # 区間の初日ではなく全体と同じ基準で週を区切る
+        week_origin = self.week_origin
+        
+        # 確定した割り当て: (従業員, 日) → シフト位置（休みは -1）
+        committed = np.full((len(self.employees), num_days), -1, dtype=np.int32)
+        shift_ids = [shift["id"] for shift in self.shifts]
+        windows = []
+        window_metrics = []
+        start = 0
+        while start < num_days:
+            end = min(start + window_days, num_days)
+            lookback = max(0, start - history_days)
+            
+            window = self.__class__.from_problem(problem, solver_config=solver_config or self.solver_config)
+            window.days = [dict(day) for day in self.days[lookback:end]]
+            window.week_origin = week_origin
+            window.solver = self.solver
+            window.stop_event = self.stop_event
+            for day_idx in range(lookback, start):
+                for e, employee in enumerate(self.employees):
+                    s = committed[e, day_idx]
+                    window.fix_assignment(employee["id"], self.days[day_idx]['date'], shift_ids[s] if s >= 0 else None)
+            
+            window_callback = None
+            if progress_callback is not None:
+                window_callback = lambda progress, index=len(windows): progress_callback(dict(progress, window=index))
+            result = window.solve(previous_result=previous_result, change_penalty=change_penalty,
+                                  progress_callback=window_callback)
+            window_metrics.append(result.get('metrics', {}))
+            windows.append({
+                'start_date': self.days[start]['date'],
+                'end_date': self.days[end - 1]['date'],
+                'status': result['status']
+            })
+            if result['status'] != 'success':
+                result['debug_info']['window'] = windows[-1]
+                return result
+            
+            # 最後の区間以外は、重なり部分を次の区間で解き直す
+            commit_end = end if end == num_days else end - overlap_days
+            window_assignment, _ = self._schedule_assignment(result['schedule'])
+            committed[:, start:commit_end] = window_assignment[:, start:commit_end]
+            start = commit_end
+        
+        schedule = self._make_schedule(committed)
+        
+        result = {
+            'status': 'success',
+            'schedule': schedule,
+            'windows': windows,
+            'metrics': merge_metrics(window_metrics)
+        }
+        result.update(self.evaluate_schedule(schedule))
+        if previous_result is not None and previous_result.get('status') == 'success':
+            result['changed_assignments'] = self.count_changes(schedule, previous_result)
+        return result
+
+    def find_components(self):
+        """従業員–シフトの割り当て可能関係とバッティング回避ペアによる連結成分を求める
+
+        戻り値は {'employee_ids': [...], 'shift_ids': [...]} のリスト。
+        """
+        num_employees = len(self.employees)
+        eligibility = self._compute_eligibility()
+        
+        # 従業員を 0..E-1、シフトを E..E+S-1 とする Union-Find
+        parent = list(range(num_employees + len(self.shifts)))
+        
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+        
+        def union(a, b):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+        
+        for e, s in zip(*np.nonzero(eligibility)):
+            union(int(e), num_employees + int(s))
+        
+        # 需要曲線モードではすべてのシフトが同じ需要を満たすため分割しない
+        if self.demands:
+            for s in range(1, len(self.shifts)):
+                union(num_employees, num_employees + s)
+        
+        employee_pos = {employee["id"]: e for e, employee in enumerate(self.employees)}
+        for emp1_id, emp2_id in getattr(self, 'avoidance_pairs', []):
+            if emp1_id in employee_pos and emp2_id in employee_pos:
+                union(employee_pos[emp1_id], employee_pos[emp2_id])
+        
+        components = {}
+        for e, employee in enumerate(self.employees):
+            components.setdefault(find(e), {'employee_ids': [], 'shift_ids': []})['employee_ids'].append(employee["id"])
+        for s, shift in enumerate(self.shifts):
+            components.setdefault(find(num_employees + s), {'employee_ids': [], 'shift_ids': []})['shift_ids'].append(shift["id"])
+        
+        return list(components.values())
+    
+    def solve_decomposed(self, max_workers=None, previous_result=None, change_penalty=5, solver_config=None):
+        """連結成分ごとに独立したモデルを作り、プロセスプールで並列に解いて結果を統合する
+
+        成分が1つしかない場合は通常の solve() と同じ。stop_event を使う場合は
+        プロセス間で共有できるもの（multiprocessing.Manager().Event() など）を設定する。
+        ソルバーのワーカー数は、同時に動くプロセスの間で分け合う。
+        """
+        if solver_config is None:
+            solver_config = self.solver_config
+        # 時刻指定の希望しかない従業員も申請用シフトを割り当てるため部分問題に含める
+        requesting_ids = {emp_id for emp_id, _ in self.time_requests}
+        components = [
+            component for component in self.find_components()
+            if component['employee_ids'] and (component['shift_ids'] or requesting_ids.intersection(component['employee_ids']))
+        ]
+        if len(components) <= 1:
+            return self.solve(previous_result=previous_result, change_penalty=change_penalty,
+                              solver_config=solver_config)
+        
+        problem = self.export_problem()
+        tasks = []
+        for component in components:
+            employee_ids = set(component['employee_ids'])
+            shift_ids = set(component['shift_ids'])
+            subproblem = dict(problem)
+            subproblem['employees'] = [e for e in problem['employees'] if e['id'] in employee_ids]
+            # 申請用シフトは成分の従業員が希望しているものを含める
+            subproblem['time_requests'] = {
+                key: shift_id for key, shift_id in problem['time_requests'].items() if key[0] in employee_ids
+            }
+            shift_ids |= set(subproblem['time_requests'].values())
+            subproblem['shifts'] = [s for s in problem['shifts'] if s['id'] in shift_ids]
+            subproblem['avoidance_pairs'] = [
+                pair for pair in problem['avoidance_pairs'] if pair[0] in employee_ids and pair[1] in employee_ids
+            ]
+            subproblem['fixed_assignments'] = {
+                key: shift_id for key, shift_id in problem['fixed_assignments'].items() if key[0] in employee_ids
             }
+            
+            previous_subresult = None
+            if previous_result is not None and previous_result.get('status') == 'success':
+                # 成分に含まれない従業員の割り当ては部分問題の側で無視される
+                previous_subresult = {'status': 'success', 'schedule': previous_result['schedule']}
+            tasks.append((subproblem, previous_subresult))
+        
+        if max_workers is None:
+            max_workers = available_cpu_count()
+        max_workers = max(1, min(max_workers, len(tasks)))
+        component_config = solver_config.replace(num_workers=max(1, solver_config.num_workers // max_workers))
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_solve_component, subproblem, previous_subresult, change_penalty, self.stop_event,
+                                component_config)
+                for subproblem, previous_subresult in tasks
+            ]
+            results = [future.result() for future in futures]
+        
+        # 成分の結果を統合する（どの成分にも割り当て可能なシフトがない従業員は休み）
+        assignment = np.full((len(self.employees), len(self.days)), -1, dtype=np.int32)
+        for component, result in zip(components, results):
+            if result['status'] != 'success':
+                result['debug_info']['component_employee_ids'] = component['employee_ids']
+                return result
+            component_assignment, known = self._schedule_assignment(result['schedule'])
+            assignment[known] = component_assignment[known]
+        schedule = self._make_schedule(assignment)
+        
+        result = {
+            'status': 'success',
+            'schedule': schedule,
+            'components': len(components),
+            'metrics': merge_metrics([result.get('metrics', {}) for result in results])
+        }
+        result.update(self.evaluate_schedule(schedule))
+        if previous_result is not None and previous_result.get('status') == 'success':
+            result['changed_assignments'] = self.count_changes(schedule, previous_result)
+        return result
     
     def _get_status_name(self, status):
         """ステータスコードに対応する名前を返す"""
@@ -296,41 +1408,123 @@ class ShiftOptimizer:
         else:
             return f"UNKNOWN_STATUS ({status})"
     
+    def _result_schedule(self, result):
+        """結果のスケジュールを Schedule として返す（従来の辞書形式は変換する）"""
+        schedule = result['schedule']
+        if isinstance(schedule, Schedule):
+            return schedule
+        return self._make_schedule(self._schedule_assignment(schedule)[0])
+    
+    def _shift_table_columns(self, schedule):
+        """シフト表の行を作るための、従業員・シフトごとの値を事前に計算する"""
+        employee_names = {employee["id"]: employee["name"] for employee in self.employees}
+        names = [employee_names.get(emp_id) for emp_id in schedule.employee_ids]
+        # 従業員名の順（同名の場合は元の順）に並べる
+        employee_order = np.array(sorted(range(len(names)), key=lambda e: str(names[e])), dtype=np.int64)
+        
+        # シフト位置ごとの値。末尾は休み (-1) 用
+        shifts = schedule.shifts
+        shift_names, name_uniques = pd.factorize(pd.Series([shift["name"] for shift in shifts] + ['Off'], dtype=object))
+        return {
+            'employee_order': employee_order,
+            'employee_ids': np.array(schedule.employee_ids)[employee_order],
+            'employee_names': np.array(names, dtype=object)[employee_order],
+            'shift_ids': np.array([shift["id"] for shift in shifts] + [None], dtype=object),
+            'shift_name_codes': shift_names,
+            'shift_name_categories': name_uniques,
+            'start_times': np.array([self._minutes_to_time(shift["start_minutes"]) for shift in shifts] + [None], dtype=object),
+            'end_times': np.array([self._minutes_to_time(shift["end_minutes"] % (24 * 60)) for shift in shifts] + [None], dtype=object)
+        }
+    
+    def _shift_table_frame(self, schedule, columns, day_start, day_end):
+        """day_start から day_end までの日のシフト表（日付 → 従業員名の順）を作る"""
+        num_employees = len(columns['employee_order'])
+        days = schedule.days[day_start:day_end]
+        # (日, 従業員) の順に並べたシフト位置
+        positions = schedule.assignment[columns['employee_order'], day_start:day_end].T.ravel()
+        
+        return pd.DataFrame({
+            'employee_id': np.tile(columns['employee_ids'], len(days)),
+            'employee_name': np.tile(columns['employee_names'], len(days)),
+            'date': np.repeat(np.array([day["date"] for day in days], dtype=object), num_employees),
+            'weekday': np.repeat(np.array([day["weekday"] for day in days], dtype=np.int64), num_employees),
+            'shift_id': columns['shift_ids'][positions],
+            'shift_name': pd.Categorical.from_codes(
+                columns['shift_name_codes'][positions], categories=columns['shift_name_categories']
+            ),
+            'start_time': columns['start_times'][positions],
+            'end_time': columns['end_times'][positions]
+        })
+    
     def get_shift_table(self, result):
-        """スケジュール結果をデータフレーム形式で取得"""
+        """スケジュール結果をデータフレーム形式で取得（日付・従業員名の順）"""
         if result['status'] != 'success':
             return None
-            
-        rows = []
         
-        for emp_id, schedule in result['schedule'].items():
-            employee = next(e for e in self.employees if e['id'] == emp_id)
-            
-            for day_data in schedule:
-                row = {
-                    'employee_id': emp_id,
-                    'employee_name': employee['name'],
-                    'date': day_data['date'],
-                    'weekday': day_data['weekday'],
-                    'shift_id': day_data['shift']['id'] if day_data['shift'] else None,
-                    'shift_name': day_data['shift']['name'] if day_data['shift'] else 'Off',
-                    'start_time': self._minutes_to_time(day_data['shift']['start_minutes']) if day_data['shift'] else None,
-                    'end_time': self._minutes_to_time(day_data['shift']['end_minutes'] % (24 * 60)) if day_data['shift'] else None
-                }
-                rows.append(row)
+        schedule = self._result_schedule(result)
+        return self._shift_table_frame(schedule, self._shift_table_columns(schedule), 0, len(schedule.days))
+
+    def get_schedule_matrix(self, result, employee_query=None, start_date=None, end_date=None):
+        """スケジュール結果を 従業員名 × 日付 の表（値はシフト名、休みは 'Off'）で取得する
+
+        employee_query は従業員名の部分一致または従業員IDで絞り込む。
+        start_date / end_date を指定するとその範囲の日だけを列にする。
+        """
+        if result['status'] != 'success':
+            return None
+
+        schedule = self._result_schedule(result)
+        columns = self._shift_table_columns(schedule)
+
+        rows = np.arange(len(columns['employee_order']))
+        if employee_query:
+            query = str(employee_query)
+            rows = np.flatnonzero([
+                query in str(name) or query == str(emp_id)
+                for name, emp_id in zip(columns['employee_names'], columns['employee_ids'])
+            ])
+
+        dates = [day["date"] for day in schedule.days]
+        day_positions = np.array([
+            d for d, date in enumerate(dates)
+            if (start_date is None or date >= start_date) and (end_date is None or date <= end_date)
+        ], dtype=np.int64)
+
+        # 割り当て配列をそのまま並べ替えてシフト名に置き換える（休み -1 は末尾の 'Off'）
+        shift_names = np.asarray(columns['shift_name_categories'], dtype=object)[columns['shift_name_codes']]
+        positions = schedule.assignment[np.ix_(columns['employee_order'][rows], day_positions)]
+        frame = pd.DataFrame(shift_names[positions], columns=[dates[d] for d in day_positions])
+        frame.insert(0, 'employee_name', columns['employee_names'][rows])
+        return frame
+
+    def iter_csv_chunks(self, result, chunk_rows=10000, encoding='utf-8-sig'):
+        """シフト表を CSV として、chunk_rows 行程度ずつエンコード済みのバイト列で返す
+
+        大きなスケジュールでも表全体をメモリ上に作らずに書き出せる。
+        """
+        if result['status'] != 'success':
+            return
         
-        df = pd.DataFrame(rows)
-        # 見やすいようにソート
-        df = df.sort_values(['date', 'employee_name'])
-        return df
+        schedule = self._result_schedule(result)
+        columns = self._shift_table_columns(schedule)
+        chunk_days = max(1, chunk_rows // max(1, len(schedule.employee_ids)))
+        num_days = len(schedule.days)
+        
+        # BOM はヘッダーの前に一度だけ書き出す
+        yield self._shift_table_frame(schedule, columns, 0, 0).to_csv(index=False).encode(encoding)
+        row_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+        for day_start in range(0, num_days, chunk_days):
+            frame = self._shift_table_frame(schedule, columns, day_start, min(day_start + chunk_days, num_days))
+            yield frame.to_csv(index=False, header=False).encode(row_encoding)
     
     def export_to_csv(self, result, filename):
         """スケジュール結果をCSVファイルに出力"""
-        df = self.get_shift_table(result)
-        if df is not None:
-            df.to_csv(filename, index=False, encoding='utf-8-sig')
-            return True
-        return False
+        if result['status'] != 'success':
+            return False
+        with open(filename, 'wb') as f:
+            for chunk in self.iter_csv_chunks(result):
+                f.write(chunk)
+        return True
     
     def _minutes_to_time(self, minutes):
         """分単位の時間をHH:MM形式に変換"""
@@ -338,8 +1532,8 @@ class ShiftOptimizer:
         m = minutes % 60
         return f"{h:02d}:{m:02d}"
 
-# 使用例
-if __name__ == "__main__":
+def example_optimizer():
+    """使用例の問題（3人・2シフト・1週間）を登録した ShiftOptimizer（benchmark.py でも使う）"""
     optimizer = ShiftOptimizer()
     
     # 従業員を追加
@@ -358,6 +1552,11 @@ if __name__ == "__main__":
     
     # バッティング回避ペアを追加
     optimizer.add_avoidance_pair(1, 3)
+    return optimizer
+
+# 使用例
+if __name__ == "__main__":
+    optimizer = example_optimizer()
     
     # 最適化実行
     result = optimizer.solve()
@@ -1,6 +1,7 @@
-import pandas as pd
 import datetime
+from collections import defaultdict
 from flask import current_app
+from csv_import import read_shift_requests
 
 class ShiftRequestManager:
     def __init__(self, optimizer=None):
@@ -81,141 +82,75 @@ class ShiftRequestManager:
         self.shift_requests.append(request)
         return request
     
+    def add_requests(self, requests):
+        """変換済みのシフト希望（add_request が作る形式の辞書）をまとめて追加する"""
+        self.shift_requests.extend(requests)
+        return len(requests)
+    
     def import_requests_from_csv(self, file_path=None, file_content=None, encoding='utf-8-sig'):
-        """CSVファイルからシフト希望をインポート"""
+        """CSVファイルからシフト希望をインポートし、ImportReport を返す
+        
+        エラーのある行は取り込まず、行番号とエラー内容を ImportReport に記録する。
+        """
         try:
             if file_path:
-                df = pd.read_csv(file_path, encoding=encoding)
+                source = file_path
             elif file_content:
-                df = pd.read_csv(file_content, encoding=encoding)
+                source = file_content
             else:
                 raise ValueError("ファイルパスまたはファイル内容を指定してください")
             
-            # カラム名の正規化（全角スペースを半角に、余分なスペースを削除）
-            df.columns = [col.replace('　', ' ').strip() for col in df.columns]
-            
-            # 必須カラムのチェック
-            required_columns = ['スタッフコード', '日付']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"必須カラムがありません: {', '.join(missing_columns)}")
-            
-            # データをインポート
-            for _, row in df.iterrows():
-                employee_id = row['スタッフコード']
-                date = row['日付']
-                
-                # 休みの判定
-                is_day_off = False
-                shift_name = None
-                if '休み' in row and pd.notna(row['休み']):
-                    is_day_off = True
-                elif 'シフト名' in row and pd.notna(row['シフト名']):
-                    shift_name = row['シフト名']
-                
-                # 時間情報の取得
-                start_time = None
-                end_time = None
-                break_time = None
-                
-                if '出勤時刻' in row and pd.notna(row['出勤時刻']):
-                    start_time = str(row['出勤時刻'])
-                
-                if '退勤時刻' in row and pd.notna(row['退勤時刻']):
-                    end_time = str(row['退勤時刻'])
-                
-                if '休憩時間' in row and pd.notna(row['休憩時間']):
-                    break_time = row['休憩時間']
-                
-                # 備考情報
-                note = None
-                if 'スタッフからの備考' in row and pd.notna(row['スタッフからの備考']):
-                    note = row['スタッフからの備考']
-                
-                # シフト希望を追加
-                self.add_request(
-                    employee_id=employee_id,
-                    date=date,
-                    shift_name=shift_name,
-                    start_time=start_time,
-                    end_time=end_time,
-                    break_time=break_time,
-                    note=note,
-                    is_day_off=is_day_off
-                )
-            
-            return len(df)
+            requests, report = read_shift_requests(source, encoding=encoding)
+            report.imported = self.add_requests(requests)
+            return report
         except Exception as e:
             current_app.logger.error(f"シフト希望インポートエラー: {str(e)}")
             raise
     
     def apply_requests_to_optimizer(self):
         """シフト希望を最適化エンジンに適用"""
+        return self.apply_requests(self.shift_requests)
+    
+    def apply_requests(self, requests):
+        """シフト希望を従業員ごとにまとめて最適化エンジンに適用する"""
         if not self.optimizer:
             raise ValueError("最適化エンジンが設定されていません")
         
-        # シフト希望を適用
-        for request in self.shift_requests:
-            employee_id = request['employee_id']
-            date = request['date']
-            
-            # 従業員のインデックスを取得
-            employee_index = None
-            for i, emp in enumerate(self.optimizer.employees):
-                if emp['id'] == employee_id:
-                    employee_index = i
-                    break
-            
-            if employee_index is None:
+        employees = self.optimizer.employees
+        shifts = self.optimizer.shifts
+        
+        # 従業員ごとにまとめる（同じ従業員の希望は申請順のまま）
+        requests_by_employee = defaultdict(list)
+        for request in requests:
+            requests_by_employee[request['employee_id']].append(request)
+        
+        # シフト名（前方一致）→ シフトID
+        shift_ids_by_name = {}
+        
+        for employee_id, employee_requests in requests_by_employee.items():
+            employee = employees.get(employee_id)
+            if employee is None:
                 continue  # 従業員が見つからない場合はスキップ
             
-            # 休みの希望を適用
-            if request['is_day_off']:
-                # 勤務不可日に追加
-                if date not in self.optimizer.employees[employee_index]['unavailable_days']:
-                    self.optimizer.employees[employee_index]['unavailable_days'].append(date)
-            
-            # シフト名による希望を適用
-            elif request['shift_name']:
-                shift_id = None
-                
-                # シフト名からシフトIDを検索
-                for shift in self.optimizer.shifts:
-                    if shift['name'] == request['shift_name'] or shift['name'].startswith(request['shift_name']):
-                        shift_id = shift['id']
-                        break
-                
-                if shift_id is not None:
-                    # 希望シフトに追加
-                    if shift_id not in self.optimizer.employees[employee_index]['preferred_shifts']:
-                        self.optimizer.employees[employee_index]['preferred_shifts'].append(shift_id)
-            
-            # 時刻指定の希望を適用
-            elif request['start_minutes'] is not None and request['end_minutes'] is not None:
-                # 時刻指定シフトの場合は、最適化エンジンに新しいシフトを追加
-                # このシフトは従業員専用とし、希望シフトに設定
-                shift_name = f"Request_{employee_id}_{date.strftime('%Y%m%d')}"
-                
-                # 既存のシフトIDの最大値を取得
-                max_shift_id = 0
-                for shift in self.optimizer.shifts:
-                    if shift['id'] > max_shift_id:
-                        max_shift_id = shift['id']
-                
-                new_shift_id = max_shift_id + 1
+            for request in employee_requests:
+                # 休みの希望は勤務不可日に追加
+                if request['is_day_off']:
+                    employee['unavailable_days'].add(request['date'])
                 
-                # 新しいシフトを追加
-                self.optimizer.add_shift(
-                    shift_id=new_shift_id,
-                    name=shift_name,
-                    start_time=request['start_minutes'],
-                    end_time=request['end_minutes'],
-                    required_skills=[],  # スキル要件なし
-                    required_employees=1,  # 1人必要
-                    is_fixed=True  # 固定シフト
-                )
+                # シフト名による希望は希望シフトに追加
+                elif request['shift_name']:
+                    if request['shift_name'] not in shift_ids_by_name:
+                        shift = shifts.find_prefix(request['shift_name'])
+                        shift_ids_by_name[request['shift_name']] = None if shift is None else shift['id']
+                    shift_id = shift_ids_by_name[request['shift_name']]
+                    if shift_id is not None:
+                        employee['preferred_shifts'].add(shift_id)
                 
-                # 希望シフトに追加
-                self.optimizer.employees[employee_index]['preferred_shifts'].append(new_shift_id)
+                # 時刻指定の希望はその日だけ割り当てられる申請用シフト（同じ時間帯で共有）にし、希望シフトに設定
+                elif request['start_minutes'] is not None and request['end_minutes'] is not None:
+                    shift_id = self.optimizer.add_time_request(
+                        employee_id, request['date'], request['start_minutes'], request['end_minutes']
+                    )
+                    employee['preferred_shifts'].add(shift_id)
         
-        return len(self.shift_requests)
+        return len(requests)
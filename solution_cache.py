@@ -0,0 +1,191 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+
+
+def _normalize_problem(problem):
+    """問題データを順序に依存しない正規形に変換する"""
+    employees = sorted(
+        (
+            {
+                'id': e['id'],
+                'skills': sorted(e['skills']),
+                'max_hours_day': e['max_hours_day'],
+                'max_hours_week': e['max_hours_week'],
+                'max_consecutive_days': e['max_consecutive_days'],
+                'unavailable_days': sorted(str(d) for d in e['unavailable_days']),
+                'preferred_shifts': sorted(e['preferred_shifts'])
+            }
+            for e in problem['employees']
+        ),
+        key=lambda e: e['id']
+    )
+    shifts = sorted(
+        (
+            {
+                'id': s['id'],
+                'name': s['name'],
+                'start_minutes': s['start_minutes'],
+                'end_minutes': s['end_minutes'],
+                'required_skills': sorted(s['required_skills']),
+                'required_employees': s['required_employees'],
+                'is_fixed': s['is_fixed'],
+                'request_only': s.get('request_only', False)
+            }
+            for s in problem['shifts']
+        ),
+        key=lambda s: s['id']
+    )
+    days = [str(d['date']) for d in problem['days']]
+    avoidance_pairs = sorted({tuple(sorted(pair)) for pair in problem.get('avoidance_pairs', [])})
+
+    fixed_assignments = sorted(
+        [str(emp_id), str(date), shift_id]
+        for (emp_id, date), shift_id in problem.get('fixed_assignments', {}).items()
+    )
+
+    time_requests = sorted(
+        [str(emp_id), str(date), shift_id]
+        for (emp_id, date), shift_id in problem.get('time_requests', {}).items()
+    )
+
+    demands = sorted(
+        [d['start_minutes'], d['end_minutes'], d['required_employees'], str(d['weekday']), str(d['date'])]
+        for d in problem.get('demands', [])
+    )
+
+    return {
+        'employees': employees,
+        'shifts': shifts,
+        'days': days,
+        'avoidance_pairs': [list(pair) for pair in avoidance_pairs],
+        'week_origin': str(problem['week_origin']) if problem.get('week_origin') else None,
+        'fixed_assignments': fixed_assignments,
+        'time_requests': time_requests,
+        'demands': demands,
+        'demand_bucket_minutes': problem.get('demand_bucket_minutes', 30),
+        'weekly_hours_window': problem.get('weekly_hours_window', 'calendar'),
+        'min_rest_hours': problem.get('min_rest_hours', 0)
+    }
+
+
+def make_cache_key(problem, solver_params='', extra=None):
+    """問題データ・ソルバーパラメータから内容ベースのキー (SHA-256) を作る"""
+    payload = {
+        'problem': _normalize_problem(problem),
+        'solver_params': solver_params,
+        'extra': extra
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SolutionCache:
+    """最適化結果をディスクに保存するキャッシュ（件数・容量による LRU 破棄）"""
+
+    def __init__(self, cache_dir=None, max_entries=None, max_bytes=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('SHIFT_CACHE_DIR', os.path.join(os.getcwd(), '.shift_cache'))
+        if max_entries is None:
+            max_entries = int(os.environ.get('SHIFT_CACHE_MAX_ENTRIES', 200))
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('SHIFT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key):
+        """キャッシュされた結果を返す（ない場合は None）"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # 最終利用時刻を更新して LRU の順序に反映する
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """結果を保存し、上限を超えた古いエントリを破棄する"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # 別プロセスから読まれても壊れないようにアトミックに置き換える
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        """件数・合計サイズの上限を超えた分を、最終利用時刻の古い順に削除する"""
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.pkl'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        removed = 0
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+
+    def clear(self):
+        """すべてのエントリを削除する"""
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.pkl'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """ヒット数・ミス数などの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
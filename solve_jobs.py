@@ -0,0 +1,338 @@
+import os
+import time
+import uuid
+import threading
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from shift_optimizer import ShiftOptimizer
+from solution_cache import SolutionCache
+from metrics import REGISTRY
+
+
+class JobQueueFullError(RuntimeError):
+    """待ち行列が上限に達しているときに送出される"""
+
+
+# ワーカープロセスごとに使い回す最適化エンジン（ベースモデルを再利用するため）
+_worker_optimizer = None
+
+
+def _solve_with_options(optimizer, previous_result, solve_options, progress_callback=None):
+    """solve_options['method'] に応じた解法で最適化する
+
+    solve_options['solver_config'] (SolverConfig) があれば、その設定で解く。
+    並列に解く 'decompose' では改善解の進捗は通知されない。
+    """
+    method = solve_options.get('method', 'standard')
+    solver_config = solve_options.get('solver_config')
+    if method == 'rolling':
+        return optimizer.solve_rolling_horizon(
+            window_days=solve_options.get('window_days', 14),
+            overlap_days=solve_options.get('overlap_days'),
+            previous_result=previous_result,
+            solver_config=solver_config,
+            progress_callback=progress_callback
+        )
+    if method == 'decompose':
+        return optimizer.solve_decomposed(
+            max_workers=solve_options.get('max_workers'),
+            previous_result=previous_result,
+            solver_config=solver_config
+        )
+    return optimizer.solve(previous_result=previous_result, solver_config=solver_config,
+                           progress_callback=progress_callback)
+
+
+def _run_solve_job(problem, stop_event, state, previous_result=None, solve_options=None):
+    """ワーカープロセスで最適化を実行する
+
+    改善解の進捗は state['progress'] に、その時点のスケジュールは state['incumbent'] に書き込む。
+    """
+    if stop_event.is_set():
+        return None
+    state['status'] = 'running'
+
+    global _worker_optimizer
+    if _worker_optimizer is None:
+        _worker_optimizer = ShiftOptimizer()
+        # 結果はプロセス間で共有されるディスクキャッシュに保存する
+        _worker_optimizer.cache = SolutionCache()
+    optimizer = _worker_optimizer
+    optimizer.load_problem(problem)
+    optimizer.stop_event = stop_event
+    def report_progress(progress):
+        progress = dict(progress)
+        schedule = progress.pop('schedule')
+        state['incumbent'] = {
+            'status': 'success',
+            'schedule': schedule,
+            'objective_value': progress['objective_value'],
+            'violations': progress['violations'],
+            'solution_index': progress['solution_index']
+        }
+        state['progress'] = progress
+
+    try:
+        return _solve_with_options(optimizer, previous_result, solve_options or {}, report_progress)
+    finally:
+        optimizer.stop_event = None
+
+
+class SolveJobManager:
+    """スケジュール最適化をバックグラウンドのプロセスプールで実行するジョブ管理"""
+
+    def __init__(self, max_workers=None, max_pending=None, max_history=50, metrics=REGISTRY, on_finished=None,
+                 job_store=None, sync_interval=0.5):
+        if max_workers is None:
+            max_workers = int(os.environ.get('SHIFT_JOB_WORKERS', 2))
+        if max_pending is None:
+            max_pending = int(os.environ.get('SHIFT_JOB_MAX_PENDING', 10))
+
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self.max_history = max_history
+        # 完了したジョブの計測値を集計する (metrics.MetricsRegistry)。None の場合は集計しない
+        self.metrics = metrics
+        # 完了したジョブの結果を受け取る関数 on_finished(job_id, result)（保存先への書き込みなど）
+        self.on_finished = on_finished
+        # ジョブの状態を共有する保存先 (storage.Storage)。このプロセスのジョブの状態と最良解を
+        # sync_interval 秒ごとに書き込み、ほかのプロセスから依頼された取り消し・採用を実行する
+        self.job_store = job_store
+        self.sync_interval = sync_interval
+        self._sync_thread = None
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+
+    def _get_executor(self):
+        """プロセスプールを遅延生成する"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _get_manager(self):
+        """プロセス間で共有するオブジェクトのマネージャーを遅延生成する"""
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager
+
+    def _count_pending(self):
+        return sum(1 for job in self.jobs.values() if job['status'] in ('queued', 'running'))
+
+    def _prune_history(self):
+        """古い完了済みジョブを破棄する"""
+        finished = [job for job in self.jobs.values() if job['status'] not in ('queued', 'running')]
+        finished.sort(key=lambda job: job['finished_at'] or job['submitted_at'])
+        for job in finished[:max(0, len(finished) - self.max_history)]:
+            del self.jobs[job['id']]
+
+    def submit(self, problem, previous_result=None, solve_options=None):
+        """最適化ジョブを投入し、ジョブIDを返す
+
+        previous_result は前回の解として引き継ぎ、solve_options は解法とソルバーの設定
+        （{'method': 'rolling', 'window_days': 14, 'solver_config': SolverConfig(...)} など）を指定する。
+        """
+        with self._lock:
+            if self._count_pending() >= self.max_pending:
+                raise JobQueueFullError(f"実行待ちのジョブが上限 ({self.max_pending} 件) に達しています")
+
+            job_id = uuid.uuid4().hex
+            manager = self._get_manager()
+            stop_event = manager.Event()
+            state = manager.dict()
+            job = {
+                'id': job_id,
+                'method': (solve_options or {}).get('method', 'standard'),
+                'status': 'queued',
+                'submitted_at': datetime.datetime.now(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'future': None,
+                'stop_event': stop_event,
+                'state': state,
+                'progress': None,
+                'accepted': False
+            }
+            self.jobs[job_id] = job
+            self._prune_history()
+
+            future = self._get_executor().submit(_run_solve_job, problem, stop_event, state, previous_result, solve_options)
+            job['future'] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        if self.job_store is not None:
+            self._start_sync()
+        return job_id
+
+    def _start_sync(self):
+        """保存先との同期スレッドを起動する（実行中なら何もしない）"""
+        with self._lock:
+            if self._sync_thread is not None:
+                return
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._sync_thread.start()
+
+    def _sync_loop(self):
+        """実行待ち・実行中のジョブがなくなるまで保存先と同期する"""
+        published = {}
+        while True:
+            with self._lock:
+                pending = [job['id'] for job in self.jobs.values() if job['status'] in ('queued', 'running')]
+                if not pending:
+                    self._sync_thread = None
+                    return
+            for job_id in pending:
+                status = self.status(job_id)
+                if status is None:
+                    continue
+                # 最良解は新しい解が見つかったときだけ書き込む
+                solution_index = (status['progress'] or {}).get('solution_index')
+                incumbent = None
+                if solution_index is not None and published.get(job_id) != solution_index:
+                    incumbent = self.incumbent(job_id)
+                    published[job_id] = solution_index
+                try:
+                    self.job_store.save_job(status, incumbent)
+                    control = (self.job_store.load_job(job_id) or {}).get('control')
+                except Exception:
+                    # 保存先の一時的なエラーでは同期を止めず、次の周期で書き直す
+                    published.pop(job_id, None)
+                    continue
+                if control == 'cancel':
+                    done = self.cancel(job_id)
+                elif control == 'accept' and not status['accepted']:
+                    done = self.accept(job_id)
+                else:
+                    continue
+                if done:
+                    try:
+                        self.job_store.save_job(self.status(job_id))
+                    except Exception:
+                        pass
+            time.sleep(self.sync_interval)
+
+    def _on_done(self, job_id, future):
+        """ジョブ完了時に結果を記録する"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job['finished_at'] = datetime.datetime.now()
+            if future.cancelled() or job['status'] == 'cancelled':
+                job['status'] = 'cancelled'
+            elif future.exception() is not None:
+                job['status'] = 'failed'
+                job['error'] = str(future.exception())
+            else:
+                job['status'] = 'done'
+                job['result'] = future.result()
+                if self.metrics is not None and job['result'] is not None:
+                    self.metrics.record_solve(job['result'], job['method'])
+            if job['state'] is not None:
+                job['progress'] = job['state'].get('progress', job['progress'])
+            job['future'] = None
+            job['stop_event'] = None
+            job['state'] = None
+            if self.metrics is not None:
+                self.metrics.inc('shift_jobs_finished_total', help_text='終了した最適化ジョブの数', status=job['status'])
+            result = job['result'] if job['status'] == 'done' else None
+        if self.on_finished is not None and result is not None:
+            self.on_finished(job_id, result)
+        # 結果を保存してから終了した状態を書き込む（ほかのプロセスは終了を見て結果を読む）
+        if self.job_store is not None:
+            self.job_store.save_job(self.status(job_id))
+
+    def count_pending(self):
+        """実行待ち・実行中のジョブ数"""
+        with self._lock:
+            return self._count_pending()
+
+    def status(self, job_id):
+        """ジョブの状態を辞書で返す（存在しない場合は None）"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['state'] is not None:
+                state = job['state'].copy()
+                if job['status'] == 'queued' and state.get('status') == 'running':
+                    job['status'] = 'running'
+                job['progress'] = state.get('progress', job['progress'])
+            return {
+                'id': job['id'],
+                'method': job['method'],
+                'status': job['status'],
+                'submitted_at': job['submitted_at'].isoformat(),
+                'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+                'error': job['error'],
+                'progress': job['progress'],
+                'accepted': job['accepted']
+            }
+
+    def result(self, job_id):
+        """完了したジョブの結果を返す（未完了の場合は None）"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'done':
+                return None
+            return job['result']
+
+    def incumbent(self, job_id):
+        """実行中のジョブのこれまでの最良解を結果と同じ形式で返す（解がまだない場合は None）
+
+        完了したジョブは result() の結果を返す。
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'done':
+                return job['result']
+            if job['state'] is None:
+                return None
+            return job['state'].get('incumbent')
+
+    def accept(self, job_id):
+        """実行中のジョブの探索を打ち切り、それまでの最良解を結果として採用する
+
+        期間分割 ('rolling') のジョブは残りの区間を解けなくなるため採用できない。
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'running') or job['state'] is None:
+                return False
+            if job['method'] == 'rolling':
+                return False
+            # 解がまだ見つかっていない場合は採用できない
+            if job['state'].get('progress') is None:
+                return False
+            job['accepted'] = True
+            stop_event = job['stop_event']
+        stop_event.set()
+        return True
+
+    def cancel(self, job_id):
+        """ジョブを取り消す。待機中なら破棄し、実行中なら探索を停止させる"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'running'):
+                return False
+            job['status'] = 'cancelled'
+            future = job['future']
+            stop_event = job['stop_event']
+        if future is not None and not future.cancel() and stop_event is not None:
+            stop_event.set()
+        return True
+
+    def shutdown(self):
+        """プロセスプールを停止する"""
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
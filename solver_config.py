@@ -0,0 +1,161 @@
+import os
+import logging
+
+logger = logging.getLogger('shift_optimizer.solver')
+
+
+def available_cpu_count():
+    """実際に利用できるCPU数（CPUアフィニティと cgroup のクォータを考慮）を返す"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    # cgroup v2
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, int(int(quota) / int(period))))
+        return count
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            count = min(count, max(1, quota // period))
+    except (OSError, ValueError):
+        pass
+
+    return count
+
+
+class SolverConfig:
+    """CP-SATソルバーの設定（時間制限・ワーカー数・早期終了のギャップ・ログ出力先）"""
+
+    # 名前付きプリセット
+    PRESETS = {
+        # 画面での確認用: 短時間で打ち切る
+        'fast_preview': {'max_time_in_seconds': 10.0, 'relative_gap_limit': 0.05},
+        # 通常の作成
+        'balanced': {'max_time_in_seconds': 60.0, 'relative_gap_limit': 0.01},
+        # 夜間バッチ: 最適解の証明まで時間をかける
+        'overnight': {'max_time_in_seconds': 8 * 3600.0, 'relative_gap_limit': 0.0},
+    }
+
+    # ログの出力先: 標準出力 / logging ('shift_optimizer.solver') / 出力しない
+    LOG_DESTINATIONS = ('stdout', 'logger', 'none')
+
+    def __init__(self, max_time_in_seconds=60.0, num_workers=None, relative_gap_limit=0.0,
+                 random_seed=42, log_to='stdout', linearization_level=0):
+        if num_workers is None:
+            num_workers = available_cpu_count()
+        if log_to not in self.LOG_DESTINATIONS:
+            raise ValueError(f"ログの出力先が不正です: {log_to} ({', '.join(self.LOG_DESTINATIONS)} のいずれか)")
+        if max_time_in_seconds <= 0:
+            raise ValueError(f"時間制限は正の値を指定してください: {max_time_in_seconds}")
+        if num_workers < 1:
+            raise ValueError(f"ワーカー数は1以上を指定してください: {num_workers}")
+        if not 0.0 <= relative_gap_limit < 1.0:
+            raise ValueError(f"相対ギャップは0以上1未満を指定してください: {relative_gap_limit}")
+
+        self.max_time_in_seconds = float(max_time_in_seconds)
+        self.num_workers = int(num_workers)
+        self.relative_gap_limit = float(relative_gap_limit)
+        self.random_seed = int(random_seed)
+        self.log_to = log_to
+        self.linearization_level = int(linearization_level)
+
+    @classmethod
+    def preset(cls, name, **overrides):
+        """名前付きプリセットから設定を作る"""
+        if name not in cls.PRESETS:
+            raise ValueError(f"不明なプリセットです: {name} ({', '.join(cls.PRESETS)} のいずれか)")
+        options = dict(cls.PRESETS[name])
+        options.update(overrides)
+        return cls(**options)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """環境変数 (SHIFT_SOLVER_*) から設定を作る"""
+        if environ is None:
+            environ = os.environ
+
+        options = {}
+        if environ.get('SHIFT_SOLVER_TIME_LIMIT'):
+            options['max_time_in_seconds'] = float(environ['SHIFT_SOLVER_TIME_LIMIT'])
+        if environ.get('SHIFT_SOLVER_WORKERS'):
+            options['num_workers'] = int(environ['SHIFT_SOLVER_WORKERS'])
+        if environ.get('SHIFT_SOLVER_RELATIVE_GAP'):
+            options['relative_gap_limit'] = float(environ['SHIFT_SOLVER_RELATIVE_GAP'])
+        if environ.get('SHIFT_SOLVER_SEED'):
+            options['random_seed'] = int(environ['SHIFT_SOLVER_SEED'])
+        if environ.get('SHIFT_SOLVER_LOG'):
+            options['log_to'] = environ['SHIFT_SOLVER_LOG']
+
+        preset = environ.get('SHIFT_SOLVER_PRESET')
+        if preset:
+            return cls.preset(preset, **options)
+        return cls(**options)
+
+    @classmethod
+    def from_form(cls, form, base=None):
+        """フォームの入力 (solver_preset, time_limit, num_workers, relative_gap) から設定を作る
+
+        空欄の項目はプリセット（未指定の場合は base）の値を使う。
+        """
+        if base is None:
+            base = cls.from_env()
+
+        preset = form.get('solver_preset', '').strip()
+        config = cls.preset(preset, num_workers=base.num_workers, log_to=base.log_to) if preset else base
+
+        overrides = {}
+        try:
+            if form.get('time_limit', '').strip():
+                overrides['max_time_in_seconds'] = float(form['time_limit'])
+            if form.get('num_workers', '').strip():
+                overrides['num_workers'] = int(form['num_workers'])
+            if form.get('relative_gap', '').strip():
+                overrides['relative_gap_limit'] = float(form['relative_gap'])
+        except ValueError:
+            raise ValueError("ソルバー設定には数値を入力してください")
+        return config.replace(**overrides)
+
+    def replace(self, **overrides):
+        """一部の項目を置き換えた設定を返す"""
+        options = self.to_dict()
+        options.update(overrides)
+        return self.__class__(**options)
+
+    def to_dict(self):
+        return {
+            'max_time_in_seconds': self.max_time_in_seconds,
+            'num_workers': self.num_workers,
+            'relative_gap_limit': self.relative_gap_limit,
+            'random_seed': self.random_seed,
+            'log_to': self.log_to,
+            'linearization_level': self.linearization_level
+        }
+
+    def apply(self, solver):
+        """CpSolver にパラメータとログの出力先を設定する"""
+        parameters = solver.parameters
+        parameters.linearization_level = self.linearization_level
+        parameters.max_time_in_seconds = self.max_time_in_seconds
+        parameters.num_workers = self.num_workers
+        parameters.relative_gap_limit = self.relative_gap_limit
+        parameters.random_seed = self.random_seed
+
+        parameters.log_search_progress = self.log_to != 'none'
+        parameters.log_to_stdout = self.log_to == 'stdout'
+        solver.log_callback = logger.info if self.log_to == 'logger' else None
+
+    def __repr__(self):
+        options = ', '.join(f'{key}={value!r}' for key, value in self.to_dict().items())
+        return f'SolverConfig({options})'
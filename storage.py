@@ -0,0 +1,739 @@
+import os
+import abc
+import json
+import queue
+import pickle
+import sqlite3
+import datetime
+import threading
+import contextlib
+from urllib.parse import urlparse
+
+from registry import DuplicateIdError
+
+# load_problem() で読み込める部分
+PROBLEM_PARTS = ('employees', 'shifts', 'period')
+
+
+def _period_days(start_date, end_date):
+    """期間の日の一覧（ShiftOptimizer.set_schedule_period と同じ形式）"""
+    days = []
+    current_date = start_date
+    while current_date <= end_date:
+        days.append({'date': current_date, 'weekday': current_date.weekday()})
+        current_date += datetime.timedelta(days=1)
+    return days
+
+
+class Storage(abc.ABC):
+    """問題データ（従業員・シフト・シフト希望・期間）と最適化結果の保存先のインターフェース
+
+    従業員・シフトは ShiftOptimizer の登録簿と同じ形式の辞書、シフト希望は
+    ShiftRequestManager と同じ形式の辞書でやり取りする。複数のワーカープロセスから
+    同じ保存先を使えるように、状態はすべて保存先に置く。
+    """
+
+    # 従業員
+    @abc.abstractmethod
+    def list_employees(self, employee_ids=None):
+        """登録順の従業員の一覧（employee_ids を指定するとその従業員だけ）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def employee_names(self):
+        """従業員ID → 名前"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_employees(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_employees(self, employees):
+        """従業員を追加する（ID が登録済みの場合は DuplicateIdError で1件も追加しない）"""
+        raise NotImplementedError
+
+    # シフト
+    @abc.abstractmethod
+    def list_shifts(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_shifts(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_shifts(self, shifts):
+        """シフトを追加する（ID が登録済みの場合は DuplicateIdError で1件も追加しない）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_time_requests(self):
+        """時刻指定の希望 (従業員ID, 日付) → 申請用シフトID"""
+        raise NotImplementedError
+
+    # シフト希望
+    @abc.abstractmethod
+    def list_requests(self, employee_id=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_requests(self, requests):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear_requests(self):
+        raise NotImplementedError
+
+    # 期間・バッティング回避ペアなどの設定
+    @abc.abstractmethod
+    def get_settings(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_settings(self, **settings):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_problem(self, problem):
+        """export_problem() の辞書で従業員・シフト・時刻指定の希望・需要曲線・回避ペアをまとめて置き換える"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def edit_problem(self):
+        """従業員・シフト・時刻指定の希望を読み込んだ問題の辞書を渡し、ブロック内での変更を書き戻すコンテキストマネージャー
+
+        書き戻すのは変更された従業員・シフトの行と時刻指定の希望の行だけ。読み込みから書き戻しまでの間に
+        ほかのリクエストやワーカーの書き込みが割り込まないようにする（ブロック内の読み込みも同じ状態を見る）。
+        """
+        raise NotImplementedError
+
+    def load_problem(self, include=PROBLEM_PARTS):
+        """export_problem() 形式の辞書を作る。include に含まれない部分は空にする"""
+        problem = {
+            'employees': [],
+            'shifts': [],
+            'days': [],
+            'avoidance_pairs': [],
+            'week_origin': None,
+            'fixed_assignments': {},
+            'time_requests': {},
+            'demands': [],
+            'demand_bucket_minutes': 30,
+            'weekly_hours_window': 'calendar',
+            'min_rest_hours': 0
+        }
+        settings = self.get_settings() if 'shifts' in include or 'period' in include else {}
+        if 'employees' in include:
+            problem['employees'] = self.list_employees()
+        if 'shifts' in include:
+            problem['shifts'] = self.list_shifts()
+            problem['time_requests'] = self.list_time_requests()
+            # 需要曲線はシフトと同じく必要人数を決めるため、シフトと一緒に読み込む
+            problem['demands'] = [
+                dict(demand, date=datetime.date.fromisoformat(demand['date']) if demand['date'] else None)
+                for demand in settings.get('demands', [])
+            ]
+            problem['demand_bucket_minutes'] = settings.get('demand_bucket_minutes', 30)
+        if 'period' in include:
+            if settings.get('start_date') and settings.get('end_date'):
+                problem['days'] = _period_days(
+                    datetime.date.fromisoformat(settings['start_date']),
+                    datetime.date.fromisoformat(settings['end_date'])
+                )
+            problem['avoidance_pairs'] = [tuple(pair) for pair in settings.get('avoidance_pairs', [])]
+            if settings.get('week_origin'):
+                problem['week_origin'] = datetime.date.fromisoformat(settings['week_origin'])
+            problem['weekly_hours_window'] = settings.get('weekly_hours_window', 'calendar')
+            problem['min_rest_hours'] = settings.get('min_rest_hours', 0)
+        return problem
+
+    # 最適化結果
+    @abc.abstractmethod
+    def save_result(self, result, job_id=None):
+        """結果を新しい版として保存し、版番号を返す（同じ job_id の結果は1回だけ保存する）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def result_info(self):
+        """最新の結果の (版番号, status)。結果がない場合は (0, None)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_result(self):
+        """最新の結果の (版番号, 結果の辞書)。結果がない場合は (0, None)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_job_result(self, job_id, result):
+        """実行中のジョブ（設定の current_job_id）の結果なら保存して版番号を返す。ほかのジョブの結果は保存せず None"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_job_result(self, job_id):
+        """ジョブの保存済みの結果（保存されていない場合は None）"""
+        raise NotImplementedError
+
+    # 最適化ジョブ（ジョブを実行するプロセス以外のワーカーからも状態の参照と取り消し・採用の依頼ができるようにする）
+    @abc.abstractmethod
+    def save_job(self, job, incumbent=None):
+        """ジョブの状態（SolveJobManager.status() の辞書）を保存する。incumbent はその時点の最良解"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_job(self, job_id):
+        """ジョブの状態の辞書（存在しない場合は None）。依頼された操作は 'control' に入る"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_job_incumbent(self, job_id):
+        """ジョブの保存済みの最良解（保存されていない場合は None）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def request_job_control(self, job_id, action):
+        """実行待ち・実行中のジョブに操作（'cancel' または 'accept'）を依頼する。依頼できた場合は True"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reset(self):
+        """すべてのデータを削除する"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _ConnectionPool:
+    """SQLite の接続を使い回すプール（size 本まで作り、使用中ならほかの接続が返るのを待つ）"""
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self._size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    skills TEXT NOT NULL,
+    max_hours_day INTEGER NOT NULL,
+    max_hours_week INTEGER NOT NULL,
+    max_consecutive_days INTEGER NOT NULL,
+    unavailable_days TEXT NOT NULL,
+    preferred_shifts TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS employees_position ON employees (position);
+CREATE INDEX IF NOT EXISTS employees_name ON employees (name);
+
+CREATE TABLE IF NOT EXISTS shifts (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    start_minutes INTEGER NOT NULL,
+    end_minutes INTEGER NOT NULL,
+    required_skills TEXT NOT NULL,
+    required_employees INTEGER NOT NULL,
+    is_fixed INTEGER NOT NULL,
+    request_only INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS shifts_position ON shifts (position);
+CREATE INDEX IF NOT EXISTS shifts_name ON shifts (name);
+
+CREATE TABLE IF NOT EXISTS time_requests (
+    employee_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    shift_id INTEGER NOT NULL,
+    PRIMARY KEY (employee_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS shift_requests (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    employee_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    shift_name TEXT,
+    start_minutes INTEGER,
+    end_minutes INTEGER,
+    break_minutes REAL,
+    note TEXT,
+    is_day_off INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shift_requests_employee_date ON shift_requests (employee_id, date);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    control TEXT,
+    incumbent BLOB,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT UNIQUE,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+'''
+
+
+def _employee_row(employee, position):
+    return (
+        employee['id'], position, employee['name'], json.dumps(list(employee['skills']), ensure_ascii=False),
+        employee['max_hours_day'], employee['max_hours_week'], employee['max_consecutive_days'],
+        json.dumps(sorted(date.isoformat() for date in employee['unavailable_days'])),
+        json.dumps(sorted(employee['preferred_shifts']))
+    )
+
+
+def _employee_from_row(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'skills': json.loads(row['skills']),
+        'max_hours_day': row['max_hours_day'],
+        'max_hours_week': row['max_hours_week'],
+        'max_consecutive_days': row['max_consecutive_days'],
+        'unavailable_days': {datetime.date.fromisoformat(date) for date in json.loads(row['unavailable_days'])},
+        'preferred_shifts': set(json.loads(row['preferred_shifts']))
+    }
+
+
+def _shift_row(shift, position):
+    return (
+        shift['id'], position, shift['name'], shift['start_minutes'], shift['end_minutes'],
+        json.dumps(list(shift['required_skills']), ensure_ascii=False), shift['required_employees'],
+        int(bool(shift['is_fixed'])), int(bool(shift.get('request_only', False)))
+    )
+
+
+def _shift_from_row(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'start_minutes': row['start_minutes'],
+        'end_minutes': row['end_minutes'],
+        'duration': row['end_minutes'] - row['start_minutes'],
+        'required_skills': json.loads(row['required_skills']),
+        'required_employees': row['required_employees'],
+        'is_fixed': bool(row['is_fixed']),
+        'request_only': bool(row['request_only'])
+    }
+
+
+def _request_from_row(row):
+    return {
+        'employee_id': row['employee_id'],
+        'date': datetime.date.fromisoformat(row['date']),
+        'shift_name': row['shift_name'],
+        'start_minutes': row['start_minutes'],
+        'end_minutes': row['end_minutes'],
+        'break_minutes': row['break_minutes'],
+        'note': row['note'],
+        'is_day_off': bool(row['is_day_off'])
+    }
+
+
+class SQLiteStorage(Storage):
+    """SQLite の保存先（WAL モードで複数プロセスから読み書きできる）"""
+
+    def __init__(self, path, pool_size=None, max_results=None, max_jobs=None):
+        if pool_size is None:
+            pool_size = int(os.environ.get('SHIFT_STORAGE_POOL_SIZE', 5))
+        if max_results is None:
+            max_results = int(os.environ.get('SHIFT_STORAGE_MAX_RESULTS', 20))
+        if max_jobs is None:
+            max_jobs = int(os.environ.get('SHIFT_STORAGE_MAX_JOBS', 50))
+        self.path = path
+        self.max_results = max_results
+        self.max_jobs = max_jobs
+        # メモリ上のデータベースは接続ごとに別になるため1本だけ使う
+        self._pool = _ConnectionPool(self._connect, 1 if path == ':memory:' else max(1, pool_size))
+        # edit_problem() の実行中のスレッドはそのトランザクションの接続で読み書きする
+        self._local = threading.local()
+        with self._pool.connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        if self.path != ':memory:':
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 30000')
+        if self.path != ':memory:':
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """接続を借りてトランザクションを実行する（例外時はロールバック）
+
+        すでにこのスレッドのトランザクションの中にいる場合は、その一部として実行する。
+        """
+        current = getattr(self._local, 'conn', None)
+        if current is not None:
+            yield current
+            return
+        with self._pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.conn = conn
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+            finally:
+                self._local.conn = None
+
+    def _query(self, sql, parameters=()):
+        current = getattr(self._local, 'conn', None)
+        if current is not None:
+            return current.execute(sql, parameters).fetchall()
+        with self._pool.connection() as conn:
+            return conn.execute(sql, parameters).fetchall()
+
+    # 従業員
+    def list_employees(self, employee_ids=None):
+        if employee_ids is None:
+            rows = self._query('SELECT * FROM employees ORDER BY position')
+        else:
+            employee_ids = list(employee_ids)
+            if not employee_ids:
+                return []
+            placeholders = ','.join('?' * len(employee_ids))
+            rows = self._query(f'SELECT * FROM employees WHERE id IN ({placeholders}) ORDER BY position', employee_ids)
+        return [_employee_from_row(row) for row in rows]
+
+    def employee_names(self):
+        return {row['id']: row['name'] for row in self._query('SELECT id, name FROM employees ORDER BY position')}
+
+    def count_employees(self):
+        return self._query('SELECT COUNT(*) FROM employees')[0][0]
+
+    def _insert(self, conn, table, rows, kind):
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        placeholders = ','.join('?' * len(ids))
+        duplicates = [row[0] for row in conn.execute(f'SELECT id FROM {table} WHERE id IN ({placeholders})', ids)]
+        seen = set()
+        for record_id in ids:
+            if record_id in seen:
+                duplicates.append(record_id)
+            seen.add(record_id)
+        if duplicates:
+            raise DuplicateIdError(f"{kind}ID {', '.join(str(record_id) for record_id in duplicates)} は既に登録されています")
+        conn.executemany(f"INSERT INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows)
+
+    def _next_position(self, conn, table):
+        return conn.execute(f'SELECT COALESCE(MAX(position), -1) + 1 FROM {table}').fetchone()[0]
+
+    def add_employees(self, employees):
+        with self._transaction() as conn:
+            start = self._next_position(conn, 'employees')
+            rows = [_employee_row(employee, start + i) for i, employee in enumerate(employees)]
+            self._insert(conn, 'employees', rows, '従業員')
+
+    # シフト
+    def list_shifts(self):
+        return [_shift_from_row(row) for row in self._query('SELECT * FROM shifts ORDER BY position')]
+
+    def count_shifts(self):
+        return self._query('SELECT COUNT(*) FROM shifts')[0][0]
+
+    def add_shifts(self, shifts):
+        with self._transaction() as conn:
+            start = self._next_position(conn, 'shifts')
+            rows = [_shift_row(shift, start + i) for i, shift in enumerate(shifts)]
+            self._insert(conn, 'shifts', rows, 'シフト')
+
+    def list_time_requests(self):
+        return {
+            (row['employee_id'], datetime.date.fromisoformat(row['date'])): row['shift_id']
+            for row in self._query('SELECT employee_id, date, shift_id FROM time_requests')
+        }
+
+    # シフト希望
+    def list_requests(self, employee_id=None):
+        if employee_id is None:
+            rows = self._query('SELECT * FROM shift_requests ORDER BY seq')
+        else:
+            rows = self._query('SELECT * FROM shift_requests WHERE employee_id = ? ORDER BY date, seq', (employee_id,))
+        return [_request_from_row(row) for row in rows]
+
+    def add_requests(self, requests):
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO shift_requests (employee_id, date, shift_name, start_minutes, end_minutes, '
+                'break_minutes, note, is_day_off) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (request['employee_id'], request['date'].isoformat(), request['shift_name'],
+                     request['start_minutes'], request['end_minutes'], request['break_minutes'],
+                     request['note'], int(bool(request['is_day_off'])))
+                    for request in requests
+                ]
+            )
+
+    def clear_requests(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM shift_requests')
+
+    # 設定
+    def get_settings(self):
+        return {row['key']: json.loads(row['value']) for row in self._query('SELECT key, value FROM settings')}
+
+    def update_settings(self, **settings):
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO settings (key, value) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                [(key, json.dumps(value, ensure_ascii=False, default=str)) for key, value in settings.items()]
+            )
+
+    def save_problem(self, problem):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM employees')
+            conn.execute('DELETE FROM shifts')
+            conn.execute('DELETE FROM time_requests')
+            self._insert(conn, 'employees',
+                         [_employee_row(employee, i) for i, employee in enumerate(problem['employees'])], '従業員')
+            self._insert(conn, 'shifts', [_shift_row(shift, i) for i, shift in enumerate(problem['shifts'])], 'シフト')
+            conn.executemany(
+                'INSERT INTO time_requests (employee_id, date, shift_id) VALUES (?, ?, ?)',
+                [(emp_id, date.isoformat(), shift_id) for (emp_id, date), shift_id in problem.get('time_requests', {}).items()]
+            )
+            demands = [
+                dict(demand, date=demand['date'].isoformat() if demand['date'] else None)
+                for demand in problem.get('demands', [])
+            ]
+            conn.executemany(
+                'INSERT INTO settings (key, value) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                [
+                    ('avoidance_pairs', json.dumps([list(pair) for pair in problem.get('avoidance_pairs', [])])),
+                    ('demands', json.dumps(demands)),
+                    ('demand_bucket_minutes', json.dumps(problem.get('demand_bucket_minutes', 30))),
+                    ('weekly_hours_window', json.dumps(problem.get('weekly_hours_window', 'calendar'))),
+                    ('min_rest_hours', json.dumps(problem.get('min_rest_hours', 0)))
+                ]
+            )
+
+    @contextlib.contextmanager
+    def edit_problem(self):
+        with self._transaction() as conn:
+            problem = self.load_problem(include=('employees', 'shifts'))
+            # 位置と ID を除いた行の内容で変更を判定する
+            employee_rows = {employee['id']: _employee_row(employee, 0)[2:] for employee in problem['employees']}
+            shift_rows = {shift['id']: _shift_row(shift, 0)[2:] for shift in problem['shifts']}
+            time_requests = dict(problem['time_requests'])
+
+            yield problem
+
+            # 変更された行だけを更新し、新しい行は末尾に追加する
+            added = []
+            for employee in problem['employees']:
+                row = _employee_row(employee, 0)
+                if employee['id'] not in employee_rows:
+                    added.append(employee)
+                elif row[2:] != employee_rows[employee['id']]:
+                    conn.execute(
+                        'UPDATE employees SET name = ?, skills = ?, max_hours_day = ?, max_hours_week = ?, '
+                        'max_consecutive_days = ?, unavailable_days = ?, preferred_shifts = ? WHERE id = ?',
+                        row[2:] + (row[0],)
+                    )
+            start = self._next_position(conn, 'employees')
+            self._insert(conn, 'employees', [_employee_row(employee, start + i) for i, employee in enumerate(added)], '従業員')
+
+            added = []
+            for shift in problem['shifts']:
+                row = _shift_row(shift, 0)
+                if shift['id'] not in shift_rows:
+                    added.append(shift)
+                elif row[2:] != shift_rows[shift['id']]:
+                    conn.execute(
+                        'UPDATE shifts SET name = ?, start_minutes = ?, end_minutes = ?, required_skills = ?, '
+                        'required_employees = ?, is_fixed = ?, request_only = ? WHERE id = ?',
+                        row[2:] + (row[0],)
+                    )
+            start = self._next_position(conn, 'shifts')
+            self._insert(conn, 'shifts', [_shift_row(shift, start + i) for i, shift in enumerate(added)], 'シフト')
+
+            conn.executemany(
+                'DELETE FROM time_requests WHERE employee_id = ? AND date = ?',
+                [(emp_id, date.isoformat()) for emp_id, date in time_requests if (emp_id, date) not in problem['time_requests']]
+            )
+            conn.executemany(
+                'INSERT INTO time_requests (employee_id, date, shift_id) VALUES (?, ?, ?) '
+                'ON CONFLICT (employee_id, date) DO UPDATE SET shift_id = excluded.shift_id',
+                [
+                    (emp_id, date.isoformat(), shift_id)
+                    for (emp_id, date), shift_id in problem['time_requests'].items()
+                    if time_requests.get((emp_id, date)) != shift_id
+                ]
+            )
+
+    # 最適化結果
+    def save_result(self, result, job_id=None):
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._transaction() as conn:
+            if job_id is not None:
+                row = conn.execute('SELECT version FROM results WHERE job_id = ?', (job_id,)).fetchone()
+                if row is not None:
+                    return row['version']
+            version = conn.execute(
+                'INSERT INTO results (job_id, status, created_at, data) VALUES (?, ?, ?, ?)',
+                (job_id, result.get('status', 'unknown'), datetime.datetime.now().isoformat(), data)
+            ).lastrowid
+            # 古い版は max_results 件を残して削除する
+            conn.execute('DELETE FROM results WHERE version <= ?', (version - self.max_results,))
+        return version
+
+    def result_info(self):
+        rows = self._query('SELECT version, status FROM results ORDER BY version DESC LIMIT 1')
+        if not rows:
+            return 0, None
+        return rows[0]['version'], rows[0]['status']
+
+    def load_result(self):
+        rows = self._query('SELECT version, data FROM results ORDER BY version DESC LIMIT 1')
+        if not rows:
+            return 0, None
+        return rows[0]['version'], pickle.loads(rows[0]['data'])
+
+    def save_job_result(self, job_id, result):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'current_job_id'").fetchone()
+            if row is None or json.loads(row['value']) != job_id:
+                return None
+            return self.save_result(result, job_id=job_id)
+
+    def load_job_result(self, job_id):
+        rows = self._query('SELECT data FROM results WHERE job_id = ?', (job_id,))
+        if not rows:
+            return None
+        return pickle.loads(rows[0]['data'])
+
+    # 最適化ジョブ
+    def save_job(self, job, incumbent=None):
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, data, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET status = excluded.status, data = excluded.data, '
+                'updated_at = excluded.updated_at',
+                (job['id'], job['status'], json.dumps(job, ensure_ascii=False, default=str),
+                 datetime.datetime.now().isoformat())
+            )
+            if incumbent is not None:
+                conn.execute('UPDATE jobs SET incumbent = ? WHERE id = ?',
+                             (pickle.dumps(incumbent, protocol=pickle.HIGHEST_PROTOCOL), job['id']))
+            # 古いジョブは max_jobs 件を残して削除する
+            conn.execute('DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?)',
+                         (self.max_jobs,))
+
+    def load_job(self, job_id):
+        rows = self._query('SELECT data, control FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        return dict(json.loads(rows[0]['data']), control=rows[0]['control'])
+
+    def load_job_incumbent(self, job_id):
+        rows = self._query('SELECT incumbent FROM jobs WHERE id = ?', (job_id,))
+        if not rows or rows[0]['incumbent'] is None:
+            return None
+        return pickle.loads(rows[0]['incumbent'])
+
+    def request_job_control(self, job_id, action):
+        with self._transaction() as conn:
+            # 取り消しの依頼は採用の依頼で上書きしない
+            return conn.execute(
+                "UPDATE jobs SET control = ? WHERE id = ? AND status IN ('queued', 'running') "
+                "AND (control IS NULL OR control != 'cancel')",
+                (action, job_id)
+            ).rowcount > 0
+
+    def reset(self):
+        with self._transaction() as conn:
+            for table in ('employees', 'shifts', 'time_requests', 'shift_requests', 'settings', 'jobs'):
+                conn.execute(f'DELETE FROM {table}')
+            # 結果の版番号は増え続けるように、削除しても AUTOINCREMENT の値は残す
+            conn.execute('DELETE FROM results')
+
+    def close(self):
+        self._pool.close()
+
+
+# URL のスキーム → 保存先のクラス
+BACKENDS = {'sqlite': SQLiteStorage}
+
+
+def register_backend(scheme, factory):
+    """保存先の実装を登録する（factory は URL を解析した結果を受け取って Storage を返す）
+
+    Storage のメソッドを実装していないクラスは作成時に TypeError になる。
+    """
+    BACKENDS[scheme] = factory
+
+
+def create_storage(url=None):
+    """URL から保存先を作る（既定は環境変数 SHIFT_STORAGE_URL、未設定なら ./shift_data.sqlite3）
+
+    sqlite:///相対パス, sqlite:////絶対パス, sqlite:///:memory: の形式。
+    """
+    if url is None:
+        url = os.environ.get('SHIFT_STORAGE_URL', 'sqlite:///shift_data.sqlite3')
+    parsed = urlparse(url)
+    if parsed.scheme not in BACKENDS:
+        raise ValueError(f"保存先の種類が不明です: {parsed.scheme} ({', '.join(BACKENDS)} のいずれか)")
+    if parsed.scheme == 'sqlite':
+        return SQLiteStorage(parsed.path[1:] if parsed.path.startswith('/') else parsed.path)
+    return BACKENDS[parsed.scheme](parsed)
@@ -0,0 +1,77 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shift_optimizer import ShiftOptimizer
+from solver_config import SolverConfig
+
+START = datetime.date(2023, 1, 2)
+
+
+def build_optimizer(request_end_minutes):
+    """A だけが夜勤に入れ、B は初日に時刻指定の希望を出している2人・2日の問題"""
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=10, log_to='none', num_workers=1))
+    optimizer.add_employee(1, 'A', skills=['夜勤'], max_hours_day=8)
+    optimizer.add_employee(2, 'B', max_hours_day=8)
+    optimizer.add_shift(1, '夜勤', '22:00', '06:00', required_skills=['夜勤'])
+    optimizer.set_schedule_period(START, START + datetime.timedelta(days=1))
+    shift_id = optimizer.add_time_request(2, START, 8 * 60, request_end_minutes)
+    optimizer.employees.get(2)['preferred_shifts'].add(shift_id)
+    return optimizer, shift_id
+
+
+def assigned(result, employee_id, date):
+    """従業員のその日のシフトID（休みは None）"""
+    for entry in result['schedule'][employee_id]:
+        if entry['date'] == date:
+            return entry['shift']['id'] if entry['shift'] else None
+
+
+def at_most_one_employees(optimizer):
+    """モデルの AtMostOne 制約ごとに、含まれる割り当て変数の従業員IDの集合を返す"""
+    optimizer.setup_model()
+    employee_ids = [employee["id"] for employee in optimizer.employees]
+    owner = {
+        var.Index(): employee_ids[e] for var, e in zip(optimizer.assign_vars.tolist(), optimizer.var_e.tolist())
+    }
+    return [
+        {owner[literal] for literal in constraint.at_most_one.literals if literal in owner}
+        for constraint in optimizer.model.Proto().constraints
+        if len(constraint.at_most_one.literals)
+    ]
+
+
+def test_daily_limit_does_not_couple_employees():
+    # B の初日の希望（08:00-18:00）は1日の上限を超える。A の最終日の夜勤と同じ制約に入れてはいけない
+    optimizer, _ = build_optimizer(18 * 60)
+    assert all(len(employees) == 1 for employees in at_most_one_employees(optimizer))
+
+
+def test_request_over_daily_limit_is_not_assigned():
+    optimizer, _ = build_optimizer(18 * 60)
+    result = optimizer.solve()
+    assert assigned(result, 2, START) is None
+    assert assigned(result, 1, START) == 1
+    assert assigned(result, 1, START + datetime.timedelta(days=1)) == 1
+
+
+def test_request_within_daily_limit_is_assigned():
+    # A の2日目は前日の夜勤の 6h と当日の夜勤の 2h で上限ちょうど
+    optimizer, shift_id = build_optimizer(16 * 60)
+    result = optimizer.solve()
+    assert assigned(result, 2, START) == shift_id
+    assert assigned(result, 1, START + datetime.timedelta(days=1)) == 1
+
+
+def test_overnight_shift_eligibility_uses_calendar_days():
+    # 1日の上限は暦日ごとに数えるため、20:00-06:00（当日 4h・翌日 6h）は上限 8h に収まる
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=10, log_to='none', num_workers=1))
+    optimizer.add_employee(1, 'A', max_hours_day=8)
+    optimizer.add_shift(1, '夜勤', '20:00', '06:00')
+    optimizer.add_shift(2, '遅番', '15:00', '03:00')
+    optimizer.set_schedule_period(START, START)
+    assert optimizer._compute_eligibility().tolist() == [[True, False]]
+    result = optimizer.solve()
+    assert assigned(result, 1, START) == 1
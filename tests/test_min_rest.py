@@ -0,0 +1,64 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shift_optimizer import ShiftOptimizer
+from solver_config import SolverConfig
+
+
+def _optimizer(min_rest_hours=None):
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=5, log_to='none', num_workers=1))
+    optimizer.add_shift(1, '早番', '08:00', '16:00', required_employees=1)
+    optimizer.add_shift(2, '遅番', '16:00', '22:00', required_employees=1)
+    optimizer.add_shift(3, '夜勤', '22:00', '06:00', required_employees=1)
+    if min_rest_hours is not None:
+        optimizer.min_rest_hours = min_rest_hours
+    return optimizer
+
+
+def _conflict_table(optimizer):
+    """_rest_conflicts() の結果を 前日のシフトID → 翌日のシフトIDの集合 にする"""
+    shift_ids = [shift["id"] for shift in optimizer.shifts]
+    table = {}
+    for first, following in optimizer._rest_conflicts():
+        for a in first.tolist():
+            table[shift_ids[a]] = {shift_ids[b] for b in following.tolist()}
+    return table
+
+
+def test_no_rest_constraint_by_default():
+    # 既定では最低休息時間を設けない（既存の入力の解を変えない）
+    optimizer = _optimizer()
+    assert optimizer.min_rest_hours == 0
+    assert optimizer._rest_conflicts() == []
+    # 設定を含まない保存済みの問題も同じ
+    problem = _optimizer(min_rest_hours=11).export_problem()
+    del problem['min_rest_hours']
+    assert ShiftOptimizer.from_problem(problem).min_rest_hours == 0
+
+
+def test_rest_conflicts_with_overnight_shift():
+    optimizer = _optimizer(min_rest_hours=11)
+    # 遅番 (22:00 終了) → 翌日の早番は 10 時間、夜勤 (翌 06:00 終了) → 翌日の早番・遅番は 2・10 時間
+    assert _conflict_table(optimizer) == {2: {1}, 3: {1, 2}}
+
+    # 8 時間なら夜勤の後の早番だけ
+    optimizer.min_rest_hours = 8
+    assert _conflict_table(optimizer) == {3: {1}}
+
+
+def test_schedule_keeps_min_rest():
+    optimizer = _optimizer(min_rest_hours=11)
+    for e in range(4):
+        optimizer.add_employee(e + 1, f'P{e + 1}', max_hours_day=8, max_hours_week=40, max_consecutive_days=5)
+    optimizer.set_schedule_period(datetime.date(2023, 1, 2), datetime.date(2023, 1, 15))
+    result = optimizer.solve()
+    assert result['status'] == 'success'
+
+    conflicts = _conflict_table(optimizer)
+    for employee_schedule in result['schedule'].values():
+        shifts = [day['shift']['id'] if day['shift'] else None for day in employee_schedule]
+        for first, following in zip(shifts, shifts[1:]):
+            assert following not in conflicts.get(first, set())
@@ -0,0 +1,44 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shift_optimizer import ShiftOptimizer
+from solver_config import SolverConfig
+
+
+def calendar_day_minutes(optimizer, result):
+    """従業員 × 暦日の勤務時間（分）。日をまたぐシフトは0時以降を翌日に数える"""
+    assignment = result['schedule'].assignment
+    same_day, next_day = optimizer._calendar_day_minutes()
+    minutes = np.zeros((assignment.shape[0], assignment.shape[1] + 1), dtype=np.int64)
+    employees, days = np.nonzero(assignment >= 0)
+    np.add.at(minutes, (employees, days), same_day[assignment[employees, days]])
+    np.add.at(minutes, (employees, days + 1), next_day[assignment[employees, days]])
+    return minutes[:, :-1]
+
+
+def test_rolling_horizon_keeps_limits_with_overnight_shifts():
+    # 区間の境界で、固定した最初の日に前日の夜のシフトから入る勤務時間も週の上限に数える
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=2, log_to='none', num_workers=1))
+    for e in range(3):
+        optimizer.add_employee(e + 1, f'P{e + 1}', max_hours_day=8, max_hours_week=24, max_consecutive_days=6)
+    optimizer.add_shift(1, '夕', '20:00', '02:00', required_employees=2)
+    optimizer.add_shift(2, '日', '09:00', '15:00', required_employees=1)
+    optimizer.set_schedule_period(datetime.date(2023, 1, 2), datetime.date(2023, 1, 29))
+    optimizer.weekly_hours_window = 'rolling'
+    optimizer.min_rest_hours = 0
+
+    result = optimizer.solve_rolling_horizon(window_days=9, overlap_days=2)
+    assert result['status'] == 'success'
+
+    minutes = calendar_day_minutes(optimizer, result)
+    max_day = np.array([employee["max_hours_day"] * 60 for employee in optimizer.employees])
+    max_week = np.array([employee["max_hours_week"] * 60 for employee in optimizer.employees])
+    assert (minutes <= max_day[:, None]).all()
+    cumulative = np.concatenate([np.zeros((len(minutes), 1), dtype=np.int64), np.cumsum(minutes, axis=1)], axis=1)
+    weekly = cumulative[:, 7:] - cumulative[:, :-7]
+    assert (weekly <= max_week[:, None]).all()
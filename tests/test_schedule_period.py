@@ -0,0 +1,27 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shift_optimizer import ShiftOptimizer
+from solver_config import SolverConfig
+
+
+def test_empty_period_with_interchangeable_employees():
+    # 入れ替え可能な従業員がいても、期間が空なら空のスケジュールを返す
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=5, log_to='none', num_workers=1))
+    optimizer.add_employee(1, 'A')
+    optimizer.add_employee(2, 'B')
+    optimizer.add_shift(1, '早番', '08:00', '16:00')
+    result = optimizer.solve()
+    assert result['status'] == 'success'
+    assert len(result['schedule'][1]) == 0
+
+
+def test_reversed_period_is_rejected():
+    optimizer = ShiftOptimizer()
+    with pytest.raises(ValueError):
+        optimizer.set_schedule_period(datetime.date(2023, 1, 7), datetime.date(2023, 1, 1))
@@ -0,0 +1,45 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shift_optimizer import ShiftOptimizer
+from solver_config import SolverConfig
+
+
+def _optimizer():
+    optimizer = ShiftOptimizer(solver_config=SolverConfig(max_time_in_seconds=10, log_to='none', num_workers=1))
+    optimizer.add_employee(1, 'A', preferred_shifts=[1])
+    optimizer.add_employee(2, 'B', preferred_shifts=[2])
+    optimizer.add_employee(3, 'C')
+    optimizer.add_shift(1, '早番', '08:00', '16:00', required_employees=1)
+    optimizer.add_shift(2, '遅番', '16:00', '22:00', required_employees=1)
+    optimizer.set_schedule_period(datetime.date(2023, 1, 2), datetime.date(2023, 1, 8))
+    return optimizer
+
+
+def test_warm_start_objective_excludes_change_penalty():
+    optimizer = _optimizer()
+    first = optimizer.solve()
+    assert first['status'] == 'success'
+    assert 'changed_assignments' not in first
+
+    # 前回の解から始めても、目的関数値に変更のペナルティ（の報酬）は含めない
+    second = optimizer.solve(previous_result=first, change_penalty=5)
+    assert second['status'] == 'success'
+    assert second['objective_value'] == optimizer.evaluate_schedule(second['schedule'])['objective_value']
+    assert second['objective_value'] == first['objective_value']
+    assert second['changed_assignments'] == optimizer.count_changes(second['schedule'], first)
+
+
+def test_changed_assignments_counts_edits():
+    optimizer = _optimizer()
+    first = optimizer.solve()
+    # C を1日だけ勤務不可にすると、その日の割り当てだけが変わる
+    working = next(day for day in first['schedule'][3] if day['shift'] is not None)
+    optimizer.employees[2]['unavailable_days'].add(working['date'])
+    second = optimizer.solve(previous_result=first, change_penalty=5)
+    assert second['status'] == 'success'
+    assert second['violations']['unavailable_violations'] == 0
+    assert second['changed_assignments'] >= 1